@@ -0,0 +1,83 @@
+"""
+accounts
+~~~~~~~~~~~~~~~~~~~~
+Short lived cache of `pesaplyMM.get_account_details` lookups.
+ > cache = AccountCache(maxsize=10000, ttl=300)
+ > mm = pesaplyMM('2550000000', '0000', account_cache=cache)
+ > mm.get_account_details('2551111111')  # asks the server
+ > mm.get_account_details('2551111111')  # answered from the cache
+Accounts that do not exist are remembered too, for `negative_ttl` seconds.
+"""
+from collections import OrderedDict
+from copy import deepcopy
+import threading
+import time
+
+# cached in place of the details of an account that does not exist
+INVALID = object()
+
+
+class AccountCache(object):
+    """
+    Thread-safe cache of account details, bounded to the `maxsize` most
+    recently used accounts, each kept for at most `ttl` seconds.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, negative_ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, account):
+        """
+        Returns the cached details of `account`, `INVALID` if it is known
+        not to exist or None if it is not cached. The details are a copy,
+        which the caller is free to change.
+        """
+        with self._lock:
+            entry = self._entries.pop(account, None)
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return None
+            # re-insert to mark it most recently used
+            self._entries[account] = entry
+            if entry[1] is INVALID:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+                return deepcopy(entry[1])
+            return entry[1]
+
+    def set(self, account, details):
+        """Caches a copy of `details`"""
+        self._put(account, deepcopy(details), self.ttl)
+
+    def set_invalid(self, account):
+        self._put(account, INVALID, self.negative_ttl)
+
+    def invalidate(self, account):
+        with self._lock:
+            self._entries.pop(account, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'negative_hits': self.negative_hits,
+                    'misses': self.misses,
+                    'size': len(self._entries)}
+
+    def _put(self, account, value, ttl):
+        with self._lock:
+            self._entries.pop(account, None)
+            self._entries[account] = (time.time() + ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
@@ -0,0 +1,358 @@
+"""
+aiopesaply
+~~~~~~~~~~~~~~~~~~~~
+asyncio client for the pesaply Mobile Money web application, offering the
+same operations as `pesaplyMM` without blocking a thread per request.
+Requires Python 3.5+ and aiohttp, which requirements.txt installs on
+those versions only: it cannot be used on the python-2.7 runtime the app
+is deployed on (runtime.txt).
+Clients for different accounts can share one connection pool, which also
+enforces the per-host concurrency limit:
+ > connector = create_connector(limit_per_host=20)
+ > clients = [AsyncPesaplyMM(acc, pin, connector=connector) for acc, pin in accounts]
+ > balances = await asyncio.gather(*[c.get_balance() for c in clients])
+ > await asyncio.gather(*[c.close() for c in clients])
+The mobile pages are reached by following a chain of links; once the form
+at the end of a chain has been seen it is posted to directly.
+"""
+import asyncio
+from html.parser import HTMLParser
+import io
+import json
+from urllib.parse import urljoin
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .exceptions import *
+from .scraping import BALANCE, ERROR, INVALID_PIN, NOT_FOUND, OK, PAYMENT, PAYMENT_RECIPIENT
+from .transactions import parse_transactions
+
+
+def create_connector(limit=100, limit_per_host=10):
+    """
+    Returns a connection pool that can be shared by many clients, allowing
+    at most `limit_per_host` concurrent connections to each host
+    """
+    if aiohttp is None:
+        raise ImportError('aiohttp is required for the asyncio client')
+    return aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host)
+
+
+class AsyncPesaplyMM(object):
+    """
+    Counterpart of `pesaplyMM` whose operations are coroutines.
+    Each client has its own cookie jar (i.e. login), but clients given the
+    same `connector` share its connections. `timeout` is the total number of
+    seconds allowed for each request.
+    The HTTP session is opened by the first request, so a client can be
+    created outside the event loop; once it has been used, call `close`
+    (or use `async with`) to release its connections:
+    > async with AsyncPesaplyMM(account, pin) as mm:
+    >     balance = await mm.get_balance()
+    """
+    AUTH_URL = 'https://sarafu.pesaply.com/do/login'
+    TRANSACTIONS_EXPORT_URL = 'https://sarafu.pesaply.com/do/exportAccountHistoryToCsv'
+    TRANSACTIONS_URL = 'https://sarafu.pesaply.com/do/member/accountHistory?advanced=true&memberId=0&typeId=5'
+    SEARCH_MEMBERS_URL = 'https://sarafu.pesaply.com/do/searchMembersAjax'
+    MOBILE_WEB_URL = 'https://wap.pesaply.com/%(accountno)s/Bluesarafu'
+    ERROR_URL = 'https://sarafu.pesaply.com/do/error'
+
+    def __init__(self, account, pin, connector=None, timeout=30):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for the asyncio client')
+        self.account = account
+        self.pin = pin
+        self.connector = connector
+        self.timeout = timeout
+        # created by the first request, inside the event loop that runs it
+        self._session = None
+        self._auth_lock = None
+        # forms at the end of link chains, keyed by operation
+        self._forms = {}
+
+    async def close(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.close()
+
+    async def get_account_details(self, account):
+        """See `pesaplyMM.get_account_details`"""
+        r = await self._authed('POST', self.SEARCH_MEMBERS_URL, {'username': account, '_': ''})
+
+        if r.body:
+            # single quoted json parameters are not valid so convert
+            # them into double quoted parameters
+            _decoded = json.loads(r.body.replace("'", '"'))
+            if _decoded[0]:
+                return _decoded[0][0]
+
+        raise InvalidAccountException
+
+    async def get_transactions(self, **kwargs):
+        """See `pesaplyMM.get_transactions`"""
+        kw_map = {
+            'to_date': 'query(period).end',
+            'from_account_id': 'query(member)',
+            'from_date': 'query(period).begin',
+            'txn_ref': 'query(transactionNumber)'}
+
+        form = self._forms.get('transactions')
+        if form is None:
+            page = await self._authed('GET', self.TRANSACTIONS_URL)
+            form = page.form(name='accountHistoryForm')
+            form.action = self.TRANSACTIONS_EXPORT_URL
+            self._forms['transactions'] = form
+
+        data = form.data()
+        for key, field_name in kw_map.items():
+            if key in kwargs:
+                if key.endswith('_date'):
+                    data[field_name] = kwargs[key].strftime('%d/%m/%Y')
+                else:
+                    data[field_name] = kwargs[key]
+
+        r = await self._authed('POST', form.action, data)
+        return [txn.as_dict() for txn in parse_transactions(io.StringIO(r.body))]
+
+    async def get_balance(self):
+        """See `pesaplyMM.get_balance`"""
+        form = await self._chain_form('balance', ['My sarafu', 'Balance Inquiry'])
+        data = form.data()
+        data['pin'] = self.pin
+        r = await self._fetch('POST', form.action, data)
+        outcome = BALANCE.classify(r.body)
+
+        # Pin valid?
+        if outcome.kind == INVALID_PIN:
+            raise AuthDeniedException
+
+        # An error could occur for other reasons
+        if outcome.kind == ERROR:
+            raise RequestErrorException
+
+        if outcome.kind == OK:
+            return outcome.value
+        # the form we posted to directly may be stale
+        self._forms.pop('balance', None)
+
+    async def make_payment(self, recipient, amount, description=None):
+        """See `pesaplyMM.make_payment`"""
+        form = await self._chain_form('payment', ['My sarafu', 'Transfer', 'sarafu-to-sarafu'])
+        data = form.data()
+        data.update({'recipient': recipient, 'pin': self.pin, 'amount': amount, 'channel': 'WAP'})
+        r = await self._fetch('POST', form.action, data)
+
+        # Right away, we can tell if the recipient doesn't exist and raise an exception
+        if PAYMENT_RECIPIENT.classify(r.body).kind == NOT_FOUND:
+            raise InvalidAccountException
+
+        if not r.forms:
+            # the form we posted to directly is stale; nothing was paid yet
+            self._forms.pop('payment', None)
+            raise RequestErrorException
+
+        confirm = r.forms[0]
+        data = confirm.data()
+        data['pin'] = self.pin
+        r = await self._fetch('POST', confirm.action, data)
+        outcome = PAYMENT.classify(r.body)
+
+        # We don't get to know if our pin was valid until this step
+        if outcome.kind == INVALID_PIN:
+            raise AuthDeniedException
+
+        # An error could occur for other reasons
+        if outcome.kind == ERROR:
+            raise RequestErrorException
+
+        return outcome.value
+
+    async def _chain_form(self, name, link_texts):
+        """
+        Returns the first form on the mobile page reached by following
+        `link_texts`, walking the links only the first time
+        """
+        form = self._forms.get(name)
+        if form is None:
+            page = await self._fetch('GET', self.MOBILE_WEB_URL % {'accountno': self.account})
+            # Search for the existence of the Register link - indicating a new account
+            if page.link('Register'):
+                raise InvalidAccountException
+            for text in link_texts:
+                link = page.link(text)
+                if link is None:
+                    raise RequestErrorException
+                page = await self._fetch('GET', link)
+            if not page.forms:
+                raise RequestErrorException
+            form = self._forms[name] = page.forms[0]
+        return form
+
+    async def _auth(self):
+        r = await self._fetch('POST', self.AUTH_URL, {'principal': self.account, 'password': self.pin})
+
+        # a successful login is redirected to https://sarafu.pesaply.com/do/member/home
+        if r.url.startswith(self.ERROR_URL):
+            raise AuthDeniedException
+        return True
+
+    async def _authed(self, method, url, data=None):
+        """
+        Internally used to request a URL that requires a login, logging in
+        and retrying once if the server redirects to the login page
+        """
+        try:
+            return await self._checked(method, url, data)
+        except AuthRequiredException:
+            if self._auth_lock is None:
+                self._auth_lock = asyncio.Lock()
+            async with self._auth_lock:
+                await self._auth()
+            return await self._checked(method, url, data)
+
+    async def _checked(self, method, url, data=None):
+        r = await self._fetch(method, url, data)
+
+        # check that we've not been redirected to the login page or an error occured
+        if r.url.startswith(self.AUTH_URL):
+            raise AuthRequiredException
+        elif r.url.startswith(self.ERROR_URL):
+            raise RequestErrorException
+        return r
+
+    async def _fetch(self, method, url, data=None):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=self.connector or create_connector(),
+                connector_owner=self.connector is None,
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self._session.request(method, url, data=data) as response:
+            body = await response.text()
+            return Page(str(response.url), body)
+
+
+class Form(object):
+    """A form scraped from a page: where it posts to and its default values"""
+
+    def __init__(self, action, name=None):
+        self.action = action
+        self.name = name
+        self.fields = []
+
+    def data(self):
+        """Returns the values a browser would submit without changes"""
+        return dict(self.fields)
+
+
+class Page(object):
+    """A fetched page with its links and forms"""
+
+    def __init__(self, url, body):
+        self.url = url
+        self.body = body
+        self._parser = None
+
+    @property
+    def links(self):
+        return self._parsed().links
+
+    @property
+    def forms(self):
+        return self._parsed().forms
+
+    def link(self, text):
+        """Returns the absolute URL of the link with exactly this text"""
+        for href, link_text in self.links:
+            if link_text == text:
+                return href
+
+    def form(self, name):
+        for form in self.forms:
+            if form.name == name:
+                return form
+        raise RequestErrorException('form %s not found' % name)
+
+    def _parsed(self):
+        if self._parser is None:
+            self._parser = _PageParser(self.url)
+            self._parser.feed(self.body)
+            self._parser.close()
+        return self._parser
+
+
+class _PageParser(HTMLParser):
+
+    def __init__(self, url):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.url = url
+        self.links = []
+        self.forms = []
+        self._link = None
+        self._form = None
+        self._select = None
+        self._textarea = None
+        self._submitted = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'a' and 'href' in attrs:
+            self._link = [urljoin(self.url, attrs['href']), '']
+        elif tag == 'form':
+            self._form = Form(urljoin(self.url, attrs.get('action') or self.url), attrs.get('name'))
+            self._submitted = False
+            self.forms.append(self._form)
+        elif tag == 'option' and self._select is not None:
+            value = attrs.get('value', '')
+            if self._select[1] is None:
+                self._select[1] = value
+            if 'selected' in attrs and self._select[2] is None:
+                self._select[2] = value
+        elif self._form is None or not attrs.get('name') or 'disabled' in attrs:
+            return
+        elif tag == 'input':
+            kind = (attrs.get('type') or 'text').lower()
+            if kind in ('checkbox', 'radio'):
+                if 'checked' in attrs:
+                    self._form.fields.append((attrs['name'], attrs.get('value', 'on')))
+            elif kind in ('submit', 'image'):
+                # like mechanize, submit with the first button
+                if not self._submitted:
+                    self._submitted = True
+                    self._form.fields.append((attrs['name'], attrs.get('value', '')))
+            elif kind not in ('button', 'reset', 'file'):
+                self._form.fields.append((attrs['name'], attrs.get('value', '')))
+        elif tag == 'select':
+            self._select = [attrs['name'], None, None]
+        elif tag == 'textarea':
+            self._textarea = [attrs['name'], '']
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._link is not None:
+            self.links.append((self._link[0], self._link[1].strip()))
+            self._link = None
+        elif tag == 'form':
+            self._form = None
+        elif tag == 'select' and self._select is not None:
+            name, first, selected = self._select
+            if selected is not None or first is not None:
+                self._form.fields.append((name, selected if selected is not None else first))
+            self._select = None
+        elif tag == 'textarea' and self._textarea is not None:
+            self._form.fields.append(tuple(self._textarea))
+            self._textarea = None
+
+    def handle_data(self, data):
+        if self._link is not None:
+            self._link[1] += data
+        if self._textarea is not None:
+            self._textarea[1] += data
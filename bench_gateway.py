@@ -0,0 +1,61 @@
+"""
+Benchmarks for the checkout gateway.
+Run from the repository root:
+ $ python bench_gateway.py [iterations]
+"""
+from decimal import Decimal
+import sys
+import time
+import timeit
+
+from gateway import sarafu, Amount, TSH, USD
+
+
+def _gateway():
+    return sarafu('https://cloud.pesaply.com/checkout?a=1&b="2"', 'M<100>', 's3cret', '4100',
+                  merchant_response_url2='https://cloud.pesaply.com/r2?x=%20')
+
+
+def bench_forms(number):
+    gw = _gateway()
+    amount = Amount(Decimal('1250.50'), TSH)
+    alt_amount = Amount(Decimal('0.55'), USD)
+    cases = [
+        dict(),
+        dict(alt_amount=alt_amount, text='Pay & go'),
+        dict(xhtml=True, form_attrs={'id': 'checkout', 'class': 'form'}),
+    ]
+
+    for kwargs in cases:
+        current = gw._build_form('ORD-1<2>', amount, **kwargs)
+        compiled = gw.build_order_form('ORD-1<2>', amount, **kwargs)
+        assert current == compiled and type(current) is type(compiled), (current, compiled)
+
+    print 'forms: output is byte-identical for %d cases' % len(cases)
+    for name, fn in [('_build_form', gw._build_form), ('build_order_form', gw.build_order_form)]:
+        t = timeit.timeit(lambda: fn('ORD-12345', amount, alt_amount=alt_amount, text='Pay'), number=number)
+        print '%-20s %8.0f forms/s' % (name, number / t)
+
+
+def bench_signing(number):
+    gw = _gateway()
+    orders = [('ORD-%d' % i, Amount(Decimal(i) / 100, TSH), i % 3 and Amount(Decimal(i) / 300, USD) or None)
+              for i in xrange(number)]
+
+    start = time.time()
+    expected = [(order[0], gw._build_sig([gw.password, gw.merchant_id, gw.acquirer_id, order[0],
+                                          order[1].amount_as_string(), order[1].currency] +
+                                         (order[2] and [order[2].amount_as_string(), order[2].currency] or [])))
+                for order in orders]
+    print '%-20s %8.0f orders/s' % ('_build_sig', number / (time.time() - start))
+
+    start = time.time()
+    signed = list(gw.sign_orders(orders))
+    print '%-20s %8.0f orders/s' % ('sign_orders', number / (time.time() - start))
+    assert signed == expected
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bench_forms(number)
+    bench_signing(number * 5)
@@ -0,0 +1,110 @@
+"""
+Benchmark of `OrderBook`: add, cancel and quote rates, against quoting
+by scanning every live order as was done before. Checks along the way
+that quotes, depth and snapshots agree with a scan of the orders.
+Run from the directory containing the package:
+ $ python -m sarafu.bench_orderbook [orders]
+"""
+import random
+import sys
+import time
+
+from .orderbook import BID_TYPES, OrderBook
+from .orders import Lot, Order, TradeType
+
+SYMBOLS = [u'GOOG', u'AAPL', u'TBL', u'CRDB', u'NMB', u'TPCC', u'SWIS', u'DSE']
+TRADE_TYPES = [TradeType.BUY, TradeType.SELL, TradeType.SHORT, TradeType.CALL]
+
+
+def make_orders(count, seed=1):
+    rand = random.Random(seed)
+    orders = []
+    for i in range(count):
+        trade_type = TRADE_TYPES[i % 4]
+        # bids below 1000, asks from 1000
+        base = 900 if trade_type in BID_TYPES else 1000
+        order = Order(symbol=SYMBOLS[rand.randrange(len(SYMBOLS))], total_quantity=0,
+                      trade_type=trade_type)
+        if i % 5:
+            order.lots = [Lot(price=base + rand.randrange(100), quantity=rand.randrange(1, 50))
+                          for _ in range(rand.randrange(1, 4))]
+            order.total_quantity = sum(lot.quantity for lot in order.lots)
+        else:
+            order.total_quantity = rand.randrange(1, 100)
+            order.limit = base + rand.randrange(100)
+        orders.append(order)
+    return orders
+
+
+def levels(orders, symbol):
+    """The bid and ask levels of `symbol` by going through `orders`"""
+    bids, asks = {}, {}
+    for order in orders:
+        if order.symbol != symbol:
+            continue
+        side = bids if order.trade_type in BID_TYPES else asks
+        resting = ([(lot.price, lot.quantity) for lot in order.lots] or
+                   [(order.limit, order.total_quantity)])
+        for price, quantity in resting:
+            side[price] = side.get(price, 0) + quantity
+    return sorted(bids.items(), reverse=True), sorted(asks.items())
+
+
+def scan_quote(orders, symbol):
+    bids, asks = levels(orders, symbol)
+    return bids[0] if bids else None, asks[0] if asks else None
+
+
+def check(book, live):
+    orders = list(live.values())
+    for symbol in SYMBOLS:
+        bids, asks = levels(orders, symbol)
+        assert book.quote(symbol) == scan_quote(orders, symbol)
+        assert book.depth(symbol, 5) == (bids[:5], asks[:5])
+        snapshot = book.snapshot(symbol)
+        assert list(snapshot['bid_prices']) == [price for price, quantity in bids]
+        assert list(snapshot['ask_quantities']) == [quantity for price, quantity in asks]
+
+
+def timed(label, count, run):
+    start = time.time()
+    run()
+    elapsed = time.time() - start
+    print('%-24s %8d ops %8.3f s %8.2f us/op' % (label, count, elapsed, elapsed / count * 1e6))
+
+
+def main(count):
+    orders = make_orders(count)
+    book = OrderBook()
+    live = {}
+
+    # correctness, with adds and cancels interleaved
+    rand = random.Random(2)
+    for i, order in enumerate(orders[:5000]):
+        book.add(i, order)
+        live[i] = order
+        if rand.random() < 0.4:
+            cancelled = rand.choice(list(live))
+            book.cancel(cancelled)
+            del live[cancelled]
+        if i % 500 == 0:
+            check(book, live)
+    check(book, live)
+    assert set(live) == set(i for i in range(5000) if i in book)
+    print('order book checks ok')
+
+    book = OrderBook()
+    timed('add', count, lambda: [book.add(i, order) for i, order in enumerate(orders)])
+    quotes = count
+    timed('quote', quotes, lambda: [book.quote(SYMBOLS[i % len(SYMBOLS)]) for i in range(quotes)])
+    scans = 20
+    timed('quote by scanning orders', scans,
+          lambda: [scan_quote(orders, SYMBOLS[i % len(SYMBOLS)]) for i in range(scans)])
+    timed('snapshot', 1000, lambda: [book.snapshot(SYMBOLS[i % len(SYMBOLS)])
+                                     for i in range(1000)])
+    timed('cancel', count, lambda: [book.cancel(i) for i in range(count)])
+    assert not len(book) and all(book.quote(symbol) == (None, None) for symbol in SYMBOLS)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,62 @@
+"""
+Benchmark of the `ordercodec` binary encoding of orders against protojson:
+encode and decode rates in orders/sec and the encoded size, and batch
+validation against `check_initialized`. Round trips and errors are
+checked by tests/test_ordercodec.py.
+ $ python bench_orders.py [orders]
+"""
+import sys
+import time
+
+from protorpc import protojson
+
+from orders import Lot, Order, TradeType
+from ordercodec import codec_for, decode_frames, encode_frames
+
+SYMBOLS = [u'GOOG', u'AAPL', u'TBL', u'CRDB', u'NMB', u'TPCC', u'SWIS', u'DSE']
+TRADE_TYPES = [TradeType.BUY, TradeType.SELL, TradeType.SHORT, TradeType.CALL]
+
+
+def make_orders(count):
+    orders = []
+    for i in xrange(count):
+        lots = [Lot(price=300 + (i + j) % 20, quantity=1 + (i * j) % 50) for j in range(1 + i % 5)]
+        order = Order(symbol=SYMBOLS[i % len(SYMBOLS)],
+                      total_quantity=sum(lot.quantity for lot in lots),
+                      trade_type=TRADE_TYPES[i % 4], lots=lots)
+        if i % 3:
+            order.limit = 310 + i % 7
+        orders.append(order)
+    return orders
+
+
+def timed(label, count, run):
+    start = time.time()
+    result = run()
+    elapsed = time.time() - start
+    print '%-24s %8d orders %8.2f s %10.0f orders/s' % (label, count, elapsed, count / elapsed)
+    return result
+
+
+def main(count):
+    orders = make_orders(count)
+    codec = codec_for(Order)
+
+    json = timed('protojson encode', count,
+                 lambda: [protojson.encode_message(order) for order in orders])
+    timed('protojson decode', count,
+          lambda: [protojson.decode_message(Order, data) for data in json])
+    data = timed('ordercodec encode', count, lambda: encode_frames(Order, orders))
+    timed('ordercodec decode', count, lambda: decode_frames(Order, data))
+    print 'size: protojson %.1f bytes/order, ordercodec %.1f bytes/order' % (
+        float(sum(len(d) for d in json)) / count, float(len(data)) / count)
+
+    def check_initialized():
+        for order in orders:
+            order.check_initialized()
+    timed('check_initialized', count, check_initialized)
+    timed('codec.errors', count, lambda: codec.errors(orders))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
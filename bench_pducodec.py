@@ -0,0 +1,88 @@
+"""
+Benchmark of the `pducodec` SMPP codec: encode, decode and stream
+throughput of submit_sm PDUs, in PDUs/sec, against the smpp.pdu encoder
+used by pdu.py when it is installed. The round trip of the deliver_sm
+sample from pdu.py is checked by tests/test_pducodec.py.
+ $ python bench_pducodec.py [pdus]
+"""
+import sys
+import time
+
+from pducodec import PDUEncoder, PDUReader, SubmitSM, decode
+
+try:
+    from smpp.pdu.pdu_encoding import PDUEncoder as SmppEncoder
+    from smpp.pdu import operations
+except (ImportError, SyntaxError):
+    # run from the repo root, smpp.py there shadows the smpp package
+    SmppEncoder = None
+
+
+def submits(count):
+    return [SubmitSM(i + 1, source_addr_ton=5, source_addr=b'sarafu',
+                     dest_addr_ton=1, dest_addr_npi=1, destination_addr=b'2557%08d' % i,
+                     registered_delivery=1,
+                     short_message=b'Payment of TZS %d.00 received. Ref %08d' % (i % 90000, i))
+            for i in range(count)]
+
+
+def timed(label, count, run):
+    start = time.time()
+    run()
+    elapsed = time.time() - start
+    print('%-24s %8d PDUs %8.2f s %10.0f PDUs/s' % (label, count, elapsed, count / elapsed))
+
+
+def main(count):
+    pdus = submits(count)
+    encoder = PDUEncoder()
+
+    def encode():
+        for pdu in pdus:
+            encoder.encode(pdu)
+    timed('encode', count, encode)
+
+    wire = [encoder.encode(pdu).tobytes() for pdu in pdus]
+
+    def decode_all():
+        for data in wire:
+            decode(data)
+    timed('decode', count, decode_all)
+
+    # 64KiB reads, as from a socket
+    stream = b''.join(wire)
+    chunks = [stream[i:i + 65536] for i in range(0, len(stream), 65536)]
+
+    def read():
+        reader = PDUReader()
+        decoded = 0
+        for chunk in chunks:
+            decoded += len(reader.feed(chunk))
+        assert decoded == count
+    timed('stream decode', count, read)
+
+    if SmppEncoder is None:
+        print('smpp.pdu not installed, skipping comparison')
+        return
+    smpp_encoder = SmppEncoder()
+    smpp_pdus = [operations.SubmitSM(pdu.sequence, source_addr=pdu.source_addr,
+                                     destination_addr=pdu.destination_addr,
+                                     short_message=pdu.short_message.tobytes()
+                                     if isinstance(pdu.short_message, memoryview)
+                                     else pdu.short_message)
+                 for pdu in pdus]
+
+    def smpp_encode():
+        for pdu in smpp_pdus:
+            smpp_encoder.encode(pdu)
+    timed('smpp.pdu encode', count, smpp_encode)
+
+    def smpp_decode():
+        import io
+        for data in wire:
+            smpp_encoder.decode(io.BytesIO(data))
+    timed('smpp.pdu decode', count, smpp_decode)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,57 @@
+"""
+Benchmark of inserting AIM responses one at a time against
+`ResponseManager.bulk_create_from_lists`, in rows/sec.
+Run from a project with the billing models installed, e.g.:
+ $ DJANGO_SETTINGS_MODULE=pesaply.settings python bench_responses.py <app_label> [rows] [batch_size]
+The rows inserted are removed again.
+"""
+import sys
+import time
+
+import django
+from django.apps import apps
+from django.db import transaction
+
+
+def aim_rows(count):
+    """AIM response lists like those in the response logs"""
+    for i in xrange(count):
+        yield ['1', '1', '1', 'This transaction has been approved.', 'A1B2C3', 'Y',
+               str(2149186848 + i), 'INV%06d' % i, 'Order %d' % i, '%d.00' % (10 + i % 90),
+               'CC', 'auth_capture', 'C%05d' % (i % 5000), 'Asha', 'Mwangi', 'Pesaply',
+               'P.O. Box 1', 'Dar es Salaam', 'DSM', '11101', 'TZ', '255700000000', '',
+               'asha@example.com', '', '', '', '', '', '', '', '', '0.00', '0.00', '0.00',
+               'FALSE', '', '8E4A4A01D0E8F2C5B2E3F8B15D5D9A7C', 'M', '2']
+
+
+def timed(label, rows, insert):
+    start = time.time()
+    insert()
+    elapsed = time.time() - start
+    print '%-24s %8d rows %8.2f s %10.0f rows/s' % (label, rows, elapsed, rows / elapsed)
+
+
+def main(app_label, rows, batch_size):
+    django.setup()
+    Response = apps.get_model(app_label, 'Response')
+    last = Response.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    # one at a time, each insert committed as when responses are received;
+    # this is far slower, so time it over a tenth of the rows
+    single = max(rows // 10, 1)
+    try:
+        timed('create_from_list', single,
+              lambda: [Response.objects.create_from_list(items) for items in aim_rows(single)])
+    finally:
+        Response.objects.filter(pk__gt=last).delete()
+
+    with transaction.atomic():
+        timed('bulk_create_from_lists', rows,
+              lambda: Response.objects.bulk_create_from_lists(aim_rows(rows), batch_size))
+        transaction.set_rollback(True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1],
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 1000)
@@ -0,0 +1,54 @@
+"""
+Benchmark of the mobile page classifiers against the chain of re.search
+calls they replaced, over a set of recorded pages.
+Run from the repository root:
+ $ python bench_scraping.py [iterations]
+"""
+import re
+import sys
+import timeit
+
+from scraping import BALANCE, ERROR, INVALID_PIN, OK, PAYMENT, UNKNOWN
+
+_PAGE = ('<?xml version="1.0"?><!DOCTYPE html PUBLIC "-//WAPFORUM//DTD XHTML Mobile 1.0//EN" '
+         '"http://www.wapforum.org/DTD/xhtml-mobile10.dtd"><html><head><title>Bluesarafu</title>'
+         '</head><body><div class="hdr">sarafu Mobile Money</div>%s'
+         '<div class="nav"><a href="/home">Home</a> | <a href="/help">Help</a></div>'
+         '<div class="ftr">Karibu sarafu. Huduma kwa wateja 0800 000 000</div></body></html>')
+
+# (page, classifier, expected outcome kind, expected value)
+FIXTURES = [
+    (_PAGE % '<p>Transfer successful.<br/>Transaction id: 40918273</p>', PAYMENT, OK, '40918273'),
+    (_PAGE % '<p class="err">Invalid PIN. Please try again.</p>', PAYMENT, INVALID_PIN, None),
+    (_PAGE % '<p class="err">Error occured while processing your request</p>', PAYMENT, ERROR, None),
+    (_PAGE % '<p>Your balance is TSH 125000.50</p>', BALANCE, OK, '125000.50'),
+    (_PAGE % '<p class="err">Invalid PIN</p>', BALANCE, INVALID_PIN, None),
+    (_PAGE % '<p>Service temporarily unavailable</p>', BALANCE, UNKNOWN, None),
+]
+
+_VALUES = {PAYMENT: r'Transaction id: (?P<txnid>\d+)', BALANCE: r'Your balance is TSH (?P<balance>[\d\.]+)'}
+
+
+def search_chain(body, value):
+    """The checks as they were made before the classifiers"""
+    if re.search(r'Invalid PIN', body):
+        return INVALID_PIN
+    if re.search(r'Error occured', body):
+        return ERROR
+    if re.search(value, body):
+        match = re.search(value, body)
+        return match.group(1)
+
+
+def main(number):
+    for body, classifier, kind, value in FIXTURES:
+        assert classifier.classify(body) == (kind, value), (body, classifier.classify(body))
+
+    t = timeit.timeit(lambda: [search_chain(body, _VALUES[c]) for body, c, _, _ in FIXTURES], number=number)
+    print '%-16s %8.2f us/page' % ('re.search chain', t * 1e6 / number / len(FIXTURES))
+    t = timeit.timeit(lambda: [c.classify(body) for body, c, _, _ in FIXTURES], number=number)
+    print '%-16s %8.2f us/page' % ('classify', t * 1e6 / number / len(FIXTURES))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,110 @@
+"""
+Benchmark of `SMPPClient` against `FakeSMSC`: receipts submitted per
+second with a window of 1 (a submit/response pair at a time) and with
+larger windows, for an SMSC answering after `latency` ms. Checks that every
+delivery receipt is matched to its order, that a long receipt goes as
+concatenated segments, and that the client binds again and carries on
+after the connection is dropped.
+Requires Python 3.5+; run from the directory containing the package:
+ $ python -m sarafu.bench_smpp [messages] [latency_ms]
+"""
+import asyncio
+import sys
+import time
+
+from .fakesmsc import FakeSMSC
+from .smppclient import SMPPClient, SMPPConnectionError
+
+
+async def run(smsc, messages, window):
+    received = {}
+    client = SMPPClient('127.0.0.1', smsc.port, 'sarafu', 'secret', window=window,
+                        source_addr='SARAFU', rebind_delay=0.05, throttle_delay=0.01,
+                        on_receipt=lambda receipt: received.__setitem__(receipt.order_id,
+                                                                        receipt))
+    await client.start(timeout=5)
+    orders = ['ORD%08d' % i for i in range(messages)]
+    start = time.time()
+    await asyncio.gather(*[client.submit(order_id, '2557%08d' % i,
+                                         b'Payment of TZS 5000.00 received. Ref ' + order_id.encode())
+                           for i, order_id in enumerate(orders)])
+    elapsed = time.time() - start
+    while len(received) < messages:
+        await asyncio.sleep(0.01)
+    await client.close()
+
+    assert sorted(received) == orders, 'receipts not matched to their orders'
+    assert all(receipt.state == 'DELIVRD' for receipt in received.values())
+    print('window %-4d %8d messages %8.2f s %10.0f messages/s' % (
+        window, messages, elapsed, messages / elapsed))
+
+
+async def segmented(smsc):
+    """A receipt too long for one message, every segment receipted"""
+    received = []
+    client = SMPPClient('127.0.0.1', smsc.port, 'sarafu', 'secret',
+                        on_receipt=received.append)
+    await client.start(timeout=5)
+    sent = len(smsc.messages)
+    message_ids = await client.submit_message('ORD1', '255700000000', u'Malipo ✓ ' * 10)
+    while len(received) < len(message_ids):
+        await asyncio.sleep(0.01)
+    await client.close()
+    segments = [short_message for message_id, addr, short_message in smsc.messages[sent:]]
+    assert len(segments) == 2 and all(s.startswith(b'\x05\x00\x03') for s in segments)
+    assert set(receipt.order_id for receipt in received) == {'ORD1'}
+    print('long receipt sent in %d segments' % len(segments))
+
+
+async def rebind(smsc):
+    """
+    Drops the connection mid-run; submits which never went out are sent
+    again, those left unanswered are not
+    """
+    client = SMPPClient('127.0.0.1', smsc.port, 'sarafu', 'secret', window=20,
+                        rebind_delay=0.05)
+    await client.start(timeout=5)
+
+    async def submit(i):
+        while True:
+            try:
+                return await client.submit('ORD%d' % i, '255700000000', b'Payment received')
+            except SMPPConnectionError as e:
+                if e.unanswered:
+                    return None
+
+    accepted = len(smsc.messages)
+    submits = asyncio.gather(*[submit(i) for i in range(500)])
+    await asyncio.sleep(smsc.latency * 3)
+    smsc.drop_connections()
+    message_ids = [message_id for message_id in await submits if message_id]
+    unanswered = set(submit.order_id for submit in client.unacknowledged)
+    assert len(set(message_ids)) + len(unanswered) == 500
+    # nothing was sent twice
+    assert len(smsc.messages) - accepted <= 500
+    assert client.binds == 2, client.binds
+    await client.close()
+    print('rebound after the connection was dropped, %d submits, %d unanswered' % (
+        client.submitted, len(unanswered)))
+
+
+async def main(messages, latency):
+    smsc = FakeSMSC(latency=latency, receipt_delay=latency)
+    await smsc.start()
+    try:
+        for window in (1, 10, 50, 200):
+            await run(smsc, messages if window > 1 else min(messages, 500), window)
+        smsc.throttle_every = 50
+        await run(smsc, messages, 50)
+        print('(every 50th submit throttled)')
+        smsc.throttle_every = 0
+        await segmented(smsc)
+        await rebind(smsc)
+    finally:
+        await smsc.close()
+
+
+if __name__ == '__main__':
+    asyncio.new_event_loop().run_until_complete(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.005))
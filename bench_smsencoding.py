@@ -0,0 +1,96 @@
+#!coding=utf-8
+"""
+Benchmark of encoding receipt texts: `encode_message` on each text against
+rendering a `ReceiptTemplate`, in messages/sec. Checks first that GSM and
+UCS2 texts encode, split and pack as they should.
+ $ python bench_smsencoding.py [messages]
+"""
+import sys
+import time
+
+from smsencoding import (GSM7, UCS2, encode_message, gsm_decode, gsm_encode, pack_septets,
+                         receipt_template, unpack_septets)
+
+RECEIPT = (u'Umepokea $amount kutoka SARAFU tarehe $date. Kumbukumbu $reference. '
+           u'Asante kwa kutumia huduma zetu, kwa msaada piga 0800 750 000 bila malipo.')
+RECEIPT_UCS2 = u'Malipo ya $amount yamepokelewa ✓ Kumb. $reference'
+
+
+def check():
+    text = u'Bei: 5€ [{|}] ^~\\ @£$¥ Ärger'
+    assert gsm_decode(gsm_encode(text)) == text
+    assert gsm_encode(u'Malipo ✓') is None
+
+    # 8 septets in 7 octets, and back
+    septets = gsm_encode(u'hellohel')
+    assert len(pack_septets(septets)) == 7
+    assert unpack_septets(pack_septets(septets), 8) == septets
+    assert unpack_septets(pack_septets(septets, 1), 8, 1) == septets
+    # the 3GPP TS 23.038 example
+    assert bytes(pack_septets(gsm_encode(u'hellohello'))) == b'\xe8\x32\x9b\xfd\x46\x97\xd9\xec\x37'
+
+    message = encode_message(u'x' * 160)
+    assert message.data_coding == GSM7 and len(message.segments) == 1 and not message.esm_class
+    message = encode_message(u'x' * 161)
+    assert [len(s) - 6 for s in message.segments] == [153, 8] and message.esm_class == 0x40
+    udh = bytearray(message.segments[1][:6])
+    assert udh[:3] == b'\x05\x00\x03' and udh[4:] == b'\x02\x02'
+    # an escaped character is not split across segments
+    message = encode_message(u'x' * 152 + u'€' + u'x' * 10)
+    assert [len(s) - 6 for s in message.segments] == [152, 12]
+    message = encode_message(u'x' * 161, packed=True)
+    assert [len(s) - 6 for s in message.segments] == [134, 8]
+    assert unpack_septets(message.segments[0][6:], 153, 1) == gsm_encode(u'x' * 153)
+
+    message = encode_message(u'✓' * 70)
+    assert message.data_coding == UCS2 and len(message.segments) == 1
+    message = encode_message(u'✓' * 71)
+    assert [len(s) - 6 for s in message.segments] == [134, 8]
+    # nor is a surrogate pair
+    message = encode_message(u'✓' * 66 + u'\U0001F4B0' + u'x' * 4)
+    assert [len(s) - 6 for s in message.segments] == [132, 12]
+
+    values = {'amount': u'TZS 5,000.00', 'date': u'18/10/26', 'reference': u'AB12CD34'}
+    for template in (RECEIPT, RECEIPT_UCS2, u'$$5 for $amount'):
+        compiled = receipt_template(template)
+        assert compiled is receipt_template(template)
+        rendered = compiled.render(**values)
+        expected = encode_message(compiled.template.substitute(values))
+        assert rendered.data_coding == expected.data_coding
+        # equal but for the concatenation reference
+        assert [s[:3] + s[4:] for s in rendered.segments] == [s[:3] + s[4:] for s in expected.segments]
+    # a value outside the alphabet of the template
+    rendered = receipt_template(RECEIPT).render(amount=u'₹ 500', date=u'', reference=u'')
+    assert rendered.data_coding == UCS2
+    print('encoding checks ok')
+
+
+def timed(label, count, run):
+    start = time.time()
+    run()
+    elapsed = time.time() - start
+    print('%-24s %8d messages %8.2f s %10.0f messages/s' % (label, count, elapsed, count / elapsed))
+
+
+def main(count):
+    check()
+    for template in (RECEIPT, RECEIPT_UCS2):
+        values = [{'amount': u'TZS %d.00' % (i % 90000), 'date': u'18/10/26',
+                   'reference': u'%08X' % i} for i in range(count)]
+        compiled = receipt_template(template)
+        kind = 'GSM' if compiled.gsm else 'UCS2'
+
+        def encode():
+            substitute = compiled.template.substitute
+            for v in values:
+                encode_message(substitute(v))
+        timed('%s encode_message' % kind, count, encode)
+
+        def render():
+            for v in values:
+                compiled.render(**v)
+        timed('%s template render' % kind, count, render)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
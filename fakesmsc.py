@@ -0,0 +1,130 @@
+"""
+fakesmsc
+~~~~~~~~~~~~~~~~~~~~
+A local SMSC for trying out and benchmarking `SMPPClient` without a
+provider account. Requires Python 3.5+.
+ > smsc = FakeSMSC(latency=0.01, receipt_delay=0.1)
+ > await smsc.start()
+ > client = SMPPClient('127.0.0.1', smsc.port, 'sarafu', 'secret')
+It accepts any bind (or only those with `password`), answers each submit_sm
+after `latency` seconds and, when a receipt was requested, sends a
+delivery receipt `receipt_delay` seconds after that.
+"""
+import asyncio
+import time
+
+from .pducodec import (BIND_TRANSCEIVER, BIND_TRANSMITTER, DELIVER_SM_RESP, ENQUIRE_LINK,
+                       ESME_RINVCMDID, ESME_RINVPASWD, ESME_RTHROTTLED,
+                       SUBMIT_SM, TAG_MESSAGE_STATE, TAG_RECEIPTED_MESSAGE_ID, UNBIND,
+                       DeliverSM, GenericNack, PDUEncoder, PDUReader)
+
+# the esm_class of a delivery receipt
+ESM_DELIVERY_RECEIPT = 0x04
+
+
+class FakeSMSC(object):
+    """
+    password: the password binds must give, None for any
+    throttle_every: answer every n-th submit_sm with ESME_RTHROTTLED
+    stalled: when set, PDUs are read but not answered, as by a hung SMSC
+    Accepted messages are kept in `messages` as (message_id,
+    destination_addr, short_message).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, password=None, latency=0, receipt_delay=0,
+                 throttle_every=0):
+        self.host = host
+        self.port = port
+        self.password = password.encode('ascii') if isinstance(password, str) else password
+        self.latency = latency
+        self.receipt_delay = receipt_delay
+        self.throttle_every = throttle_every
+        self.stalled = False
+        self.messages = []
+        self.binds = 0
+        self.submits = 0
+        self.receipts_acked = 0
+        self._server = None
+        self._writers = set()
+        self._message_id = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        self.drop_connections()
+        await self._server.wait_closed()
+
+    def drop_connections(self):
+        """Closes every client connection, as a network failure would"""
+        for writer in list(self._writers):
+            writer.close()
+
+    async def _serve(self, reader, writer):
+        loop = asyncio.get_event_loop()
+        encoder = PDUEncoder()
+        pdus = PDUReader()
+        sequence = [0]
+        self._writers.add(writer)
+
+        def send(pdu):
+            if not writer.transport.is_closing():
+                writer.write(bytes(encoder.encode(pdu)))
+
+        def receipt(message_id, pdu):
+            sequence[0] += 1
+            send(DeliverSM(sequence[0], source_addr_ton=pdu.dest_addr_ton,
+                           source_addr_npi=pdu.dest_addr_npi, source_addr=pdu.destination_addr,
+                           dest_addr_ton=pdu.source_addr_ton, dest_addr_npi=pdu.source_addr_npi,
+                           destination_addr=pdu.source_addr, esm_class=ESM_DELIVERY_RECEIPT,
+                           short_message=(
+                               'id:%s sub:001 dlvrd:001 submit date:%s done date:%s '
+                               'stat:DELIVRD err:000 text:' % (
+                                   message_id, time.strftime('%y%m%d%H%M'),
+                                   time.strftime('%y%m%d%H%M'))).encode('ascii')
+                           + bytes(pdu.short_message)[:20],
+                           tlvs={TAG_RECEIPTED_MESSAGE_ID: message_id.encode('ascii') + b'\0',
+                                 TAG_MESSAGE_STATE: b'\x02'}))
+
+        def submitted(pdu):
+            self.submits += 1
+            if self.throttle_every and self.submits % self.throttle_every == 0:
+                return pdu.response(ESME_RTHROTTLED)
+            self._message_id += 1
+            message_id = '%010x' % self._message_id
+            self.messages.append((message_id, bytes(pdu.destination_addr),
+                                  bytes(pdu.short_message)))
+            if pdu.registered_delivery & 1:
+                loop.call_later(self.latency + self.receipt_delay, receipt, message_id, pdu)
+            return pdu.response(message_id=message_id.encode('ascii'))
+
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                for pdu in pdus.feed(data):
+                    if self.stalled:
+                        continue
+                    if pdu.command_id in (BIND_TRANSMITTER, BIND_TRANSCEIVER):
+                        if self.password is not None and pdu.password != self.password:
+                            send(pdu.response(ESME_RINVPASWD))
+                        else:
+                            self.binds += 1
+                            send(pdu.response(system_id=b'fakesmsc'))
+                    elif pdu.command_id == SUBMIT_SM:
+                        loop.call_later(self.latency, send, submitted(pdu))
+                    elif pdu.command_id == ENQUIRE_LINK:
+                        send(pdu.response())
+                    elif pdu.command_id == UNBIND:
+                        send(pdu.response())
+                        writer.close()
+                    elif pdu.command_id == DELIVER_SM_RESP:
+                        self.receipts_acked += 1
+                    else:
+                        send(GenericNack(pdu.sequence, ESME_RINVCMDID))
+        finally:
+            self._writers.discard(writer)
+            writer.close()
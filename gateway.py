@@ -1,6 +1,8 @@
 #!coding=utf-8
 from string import Template
 import base64
+from decimal import Decimal
+from hmac import compare_digest
 try:
     from hashlib import sha1
 except ImportError:
@@ -25,6 +27,91 @@ class Amount(object):
     def amount_as_string(self, exponent=2):
         return '%012d' % ((self.amount*100).to_integral())
     
+CURRENCY_EXPONENTS = {
+    TSH: 2,
+    KSH: 2,
+    USH: 0,
+    USD: 2,
+}
+
+
+class MinorAmount(object):
+    """
+    Amount held as an integer number of minor units of ``currency``, e.g.
+    MinorAmount(125050, TSH) is TSH 1250.50. It can be used wherever an
+    ``Amount`` is expected and avoids Decimal arithmetic and a per-object
+    ``__dict__``. Instances should be treated as immutable since the
+    formatted amount is cached.
+    """
+    __slots__ = ('minor', 'currency', '_string')
+
+    def __init__(self, minor, currency):
+        self.minor = minor
+        self.currency = currency
+        self._string = None
+
+    @classmethod
+    def from_decimal(cls, amount, currency):
+        """
+        Converts a Decimal ``amount`` to minor units of ``currency``. Raises
+        ValueError if it is not a whole number of them (e.g. USH 100.50),
+        rather than silently dropping the fraction.
+        """
+        exponent = CURRENCY_EXPONENTS.get(currency, 2)
+        minor = amount.scaleb(exponent)
+        if minor != minor.to_integral_value():
+            raise ValueError('%s is not a whole number of minor units of currency %s' % (amount, currency))
+        return cls(int(minor), currency)
+
+    @classmethod
+    def from_amount(cls, amount):
+        """Converts an ``Amount``; ValueError as for ``from_decimal``"""
+        return cls.from_decimal(amount.amount, amount.currency)
+
+    @property
+    def exponent(self):
+        return CURRENCY_EXPONENTS.get(self.currency, 2)
+
+    @property
+    def amount(self):
+        return Decimal(self.minor).scaleb(-self.exponent)
+
+    def amount_as_string(self, exponent=2):
+        if exponent != 2:
+            return '%012d' % _rescale(self.minor, self.exponent, exponent)
+        if self._string is None:
+            self._string = '%012d' % _rescale(self.minor, self.exponent, 2)
+        return self._string
+
+    def __eq__(self, other):
+        if not isinstance(other, MinorAmount):
+            return NotImplemented
+        return self.minor == other.minor and self.currency == other.currency
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash((self.minor, self.currency))
+
+    def __repr__(self):
+        return 'MinorAmount(%r, %r)' % (self.minor, self.currency)
+
+
+def _rescale(minor, from_exponent, to_exponent):
+    """Converts an integer amount between exponents, rounding half-even"""
+    if to_exponent >= from_exponent:
+        return minor * 10 ** (to_exponent - from_exponent)
+    div = 10 ** (from_exponent - to_exponent)
+    q, r = divmod(minor, div)
+    if 2 * r > div or (2 * r == div and q % 2):
+        q += 1
+    return q
+
+    
 class sarafuResponse(object):
     def __init__(self, **kw):
         self.__dict__.update(kw)
@@ -34,6 +121,7 @@ sarafu_URL_RU = 'https://cloud.pesaply.com/callback'
     
 class sarafu(object):
     currency_exponent = 2
+    form_renderer_cache_size = 32
     
     def __init__(self, sarafu_url, merchant_id, password, acquirer_id, merchant_response_url=None, merchant_response_url2=None):
         self.sarafu_url = sarafu_url
@@ -49,48 +137,45 @@ class sarafu(object):
         self.merchant_response_url2 = merchant_response_url2
      
     def parse_response(self, post):
-        acquirer_id = post.get('AcqID')
-        merchant_id = post.get('MerchantID')
-        order_id = post.get('OrderID')
-        signature = post.get('Signature')
-        eci = post.get('ECI')
-        ip = post.get('IP')
-        country_bin = post.get('CountryBIN')
-        country_ip = post.get('CountryIP')
-        onus = post.get('ONUS')
-        time = post.get('Time')
-        otp_phone = post.get('OTPPhone')
-        phone_country = post.get('PhoneCountry')
-        signature2 = post.get('Signature2')
-        response_code = post.get('ResponseCode')
-        reason_code = post.get('ReasonCode')
-        reason_desc = post.get('ReasonDesc')
-        refno = post.get('ReferenceNo')
-        auth_code = post.get('AuthCode')
-        
-        if not self._verify_sig1(signature, order_id):
-            raise SignatureError('Signature verification failed')
-        
-        if not self._verify_sig2(signature2, eci, ip, country_ip, country_bin, onus, time, otp_phone, phone_country):
-            raise SignatureError('Signature2 verification failed')
-        
-        return sarafuResponse(order_id=order_id,
-                              response_code=response_code,
-                              reason_code=reason_code,
-                              reason_desc=reason_desc,
-                              refno=refno,
-                              auth_code=auth_code,
-                              eci=eci,
-                              ip=ip,
-                              country_bin=country_bin,
-                              country_ip=country_ip,
-                              onus=onus,
-                              time=time,
-                              otp_phone=otp_phone,
-                              phone_country=phone_country)
+        return self.verifier.parse(post)
+
+    @property
+    def verifier(self):
+        try:
+            return self._verifier
+        except AttributeError:
+            self._verifier = SignatureVerifier(self)
+            return self._verifier
         
     def build_order_form(self, order_id, amount, alt_amount=None, text=None, xhtml=False, form_attrs={}):
-        return self._build_form(order_id, amount, alt_amount, text=text, xhtml=xhtml, form_attrs=form_attrs)
+        return self.get_form_renderer(xhtml, form_attrs).render(order_id, amount, alt_amount, text=text)
+
+    def get_form_renderer(self, xhtml=False, form_attrs={}):
+        """
+        Returns the compiled form for the given ``xhtml`` flag and ``form_attrs``.
+        Renderers are compiled on first use and cached on the instance, so the
+        merchant constants are read (and escaped) only once. They are keyed on
+        those constants too, so changing one compiles a new renderer. At most
+        ``form_renderer_cache_size`` are kept, and ``form_attrs`` with
+        unhashable values are compiled every time.
+        """
+        key = (bool(xhtml), tuple(form_attrs.iteritems()), self._form_constants())
+        try:
+            hash(key)
+        except TypeError:
+            return FormRenderer(self, xhtml, form_attrs)
+        renderers = self.__dict__.setdefault('_form_renderers', {})
+        renderer = renderers.get(key)
+        if renderer is None:
+            if len(renderers) >= self.form_renderer_cache_size:
+                renderers.clear()
+            renderer = renderers[key] = FormRenderer(self, xhtml, form_attrs)
+        return renderer
+
+    def _form_constants(self):
+        """The attributes a ``FormRenderer`` compiles into its output"""
+        return (self.sarafu_url, self.version, self.merchant_id, self.acquirer_id,
+                self.merchant_response_url, self.merchant_response_url2, self.currency_exponent)
     
     def _build_form(self, order_id, amount, alt_amount=None, additional_data=None, cardno=None, cardcvv=None, text=None, xhtml=False, form_attrs={}):
         data = {'xhtml': xhtml and '/' or '',
@@ -147,24 +232,39 @@ class sarafu(object):
         
         return u''.join(form)
     
-    def _signature(self, order_id, amount, alt_amount=None, additional_data=None):
-        s = [self.password, self.merchant_id, self.acquirer_id, order_id, amount.amount_as_string(), amount.currency]
-        
-        if alt_amount is not None:        
-            s.append(alt_amount.amount_as_string())
-            s.append(alt_amount.currency)
+    def sign_orders(self, orders):
+        """
+        Signs a batch of orders, yielding (order_id, signature) pairs in the
+        order they were given.
+        ``orders`` is an iterable of (order_id, amount, alt_amount) tuples where
+        alt_amount may be None or left out. The merchant constant part of the
+        hash is computed once and copied for every order. Signing is cheap
+        enough that spreading it over processes costs more than it saves
+        (pickling the orders and signatures dominates), so this runs serially.
+        """
+        prefix = self._sig_prefix()
+        for order in orders:
+            yield order[0], _order_signature(prefix, *order)
 
-        if additional_data is not None:
-            s.append(additional_data)
-            
-        return self._build_sig(s)
+    def _sig_prefix(self):
+        """
+        Returns a sha1 object seeded with password+merchant_id+acquirer_id.
+        Callers must ``copy()`` it before updating.
+        """
+        key = (self.password, self.merchant_id, self.acquirer_id)
+        cached = getattr(self, '_sig_prefix_cache', None)
+        if cached is None or cached[0] != key:
+            cached = self._sig_prefix_cache = (key, sha1(''.join(str(x) for x in key)))
+        return cached[1]
+
+    def _signature(self, order_id, amount, alt_amount=None, additional_data=None):
+        return _order_signature(self._sig_prefix(), order_id, amount, alt_amount, additional_data)
         
     def _verify_sig1(self, sig, order_id):
-        s = [self.password, self.merchant_id, self.acquirer_id, order_id]
-        return self._build_sig(s) == sig
+        return self.verifier.verify_sig1(sig, order_id)
     
     def _verify_sig2(self, sig,  eci, ip, country_ip, country_bin, onus, time, otp_phone, phone_country):
-        return self._build_sig([eci, ip, country_ip, country_bin, onus, time, otp_phone, phone_country]) == sig
+        return self.verifier.verify_sig2(sig, eci, ip, country_ip, country_bin, onus, time, otp_phone, phone_country)
      
     @classmethod 
     def _build_sig(cls, token_list):
@@ -173,6 +273,165 @@ class sarafu(object):
         digest = sha1(s).digest()
         return base64.encodestring(digest).strip()
         
+class SignatureVerifier(object):
+    """
+    Verifies gateway callbacks for a single ``sarafu`` instance.
+    The sha1 state for the merchant constants (password, merchant_id,
+    acquirer_id) is shared with signing, so each callback only hashes its
+    own order id, and signatures are compared in constant time.
+    """
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def parse(self, post):
+        """
+        Verifies both signatures on a callback ``post`` and returns the
+        parsed ``sarafuResponse``. Raises ``SignatureError`` on a mismatch.
+        """
+        order_id = post.get('OrderID')
+        signature = post.get('Signature')
+        eci = post.get('ECI')
+        ip = post.get('IP')
+        country_bin = post.get('CountryBIN')
+        country_ip = post.get('CountryIP')
+        onus = post.get('ONUS')
+        time = post.get('Time')
+        otp_phone = post.get('OTPPhone')
+        phone_country = post.get('PhoneCountry')
+        signature2 = post.get('Signature2')
+        response_code = post.get('ResponseCode')
+        reason_code = post.get('ReasonCode')
+        reason_desc = post.get('ReasonDesc')
+        refno = post.get('ReferenceNo')
+        auth_code = post.get('AuthCode')
+        
+        if not self.verify_sig1(signature, order_id):
+            raise SignatureError('Signature verification failed')
+        
+        if not self.verify_sig2(signature2, eci, ip, country_ip, country_bin, onus, time, otp_phone, phone_country):
+            raise SignatureError('Signature2 verification failed')
+        
+        return sarafuResponse(order_id=order_id,
+                              response_code=response_code,
+                              reason_code=reason_code,
+                              reason_desc=reason_desc,
+                              refno=refno,
+                              auth_code=auth_code,
+                              eci=eci,
+                              ip=ip,
+                              country_bin=country_bin,
+                              country_ip=country_ip,
+                              onus=onus,
+                              time=time,
+                              otp_phone=otp_phone,
+                              phone_country=phone_country)
+
+    def verify_many(self, posts):
+        """
+        Verifies a backlog of callbacks, yielding (post, response, error)
+        for each one. ``response`` is None and ``error`` is the
+        ``SignatureError`` when verification failed.
+        """
+        for post in posts:
+            try:
+                yield post, self.parse(post), None
+            except SignatureError as e:
+                yield post, None, e
+
+    def verify_sig1(self, sig, order_id):
+        h = self.gateway._sig_prefix().copy()
+        h.update(str(order_id))
+        return _compare_sig(base64.b64encode(h.digest()), sig)
+
+    def verify_sig2(self, sig, eci, ip, country_ip, country_bin, onus, time, otp_phone, phone_country):
+        expected = self.gateway._build_sig([eci, ip, country_ip, country_bin, onus, time, otp_phone, phone_country])
+        return _compare_sig(expected, sig)
+
+
+class FormRenderer(object):
+    """
+    Checkout form compiled for a single ``sarafu`` instance and a single
+    (xhtml, form_attrs) combination.
+    The output is identical to ``sarafu._build_form``: every merchant constant
+    is escaped once at compile time and only the order id, amounts, currencies,
+    signature and submit text are substituted per call.
+    """
+    def __init__(self, gateway, xhtml=False, form_attrs={}):
+        self.gateway = gateway
+        close = (xhtml and u'/' or u'') + u'>'
+
+        def field(name, value=None):
+            if value is None:
+                value = u'%%(%s)s' % name.lower()
+            return u'<input type="text" name="%s" value="%s" %s' % (name, value, close)
+
+        def const(value):
+            return _escape(value, True).replace(u'%', u'%%')
+
+        form_attrs = u' '.join('%s="%s"' % x for x in form_attrs.iteritems())
+        head = [u'<form method="post" action="%s" %s>' % (const(gateway.sarafu_url), form_attrs.replace(u'%', u'%%')),
+                field(u'Version', const(gateway.version)),
+                field(u'MerID', const(gateway.merchant_id)),
+                field(u'AcqID', const(gateway.acquirer_id)),
+                field(u'MerRespURL', const(gateway.merchant_response_url)),
+                field(u'PurchaseAmt'),
+                field(u'PurchaseCurrency'),
+                field(u'OrderID'),
+                field(u'SignatureMethod', const('SHA1')),
+                field(u'Signature'),
+                field(u'CaptureFlag', u'A'),
+                field(u'PurchaseCurrencyExponent', const(gateway.currency_exponent)),
+                ]
+        if gateway.merchant_response_url2 is not None:
+            head.append(field(u'MerRespURL2', const(gateway.merchant_response_url2)))
+
+        self.head = u''.join(head)
+        self.alt = field(u'PurchaseAmt2') + field(u'PurchaseCurrency2')
+        self.submit = u'<input type="submit" value="%%(text)s" %s' % close
+
+    def render(self, order_id, amount, alt_amount=None, text=None):
+        form = [self.head % {'purchaseamt': _escape(amount.amount_as_string(), True),
+                             'purchasecurrency': _escape(amount.currency, True),
+                             'orderid': _escape(order_id, True),
+                             'signature': _escape(self.gateway._signature(order_id, amount, alt_amount))}]
+        if alt_amount is not None:
+            form.append(self.alt % {'purchaseamt2': _escape(alt_amount.amount_as_string(), True),
+                                    'purchasecurrency2': _escape(alt_amount.currency, True)})
+        if text is not None:
+            form.append(self.submit % {'text': _escape(text, True)})
+        form.append(u'</form>')
+        return u''.join(form)
+
+
+def _order_signature(prefix, order_id, amount, alt_amount=None, additional_data=None):
+    h = prefix.copy()
+    h.update(str(order_id))
+    h.update(amount.amount_as_string())
+    h.update(str(amount.currency))
+
+    if alt_amount is not None:
+        h.update(alt_amount.amount_as_string())
+        h.update(str(alt_amount.currency))
+
+    if additional_data is not None:
+        h.update(str(additional_data))
+
+    # a sha1 digest always fits on a single base64 line, so this matches
+    # base64.encodestring(digest).strip() in _build_sig
+    return base64.b64encode(h.digest())
+
+
+def _compare_sig(expected, sig):
+    if sig is None:
+        return False
+    if isinstance(sig, unicode):
+        try:
+            sig = sig.encode('ascii')
+        except UnicodeError:
+            return False
+    return compare_digest(expected, sig)
+
+
 def _escape(s, quote=False):
     """Ripped from Werkzeug
     Replace special characters "&", "<" and ">" to HTML-safe sequences.  If
@@ -0,0 +1,57 @@
+"""
+Load test of the webhook view: posts incoming_message events from
+`concurrency` threads and reports the latency of the view.
+Run against a running server:
+ $ python loadtest_webhook.py http://localhost:8000/webhook [requests] [concurrency] [secret]
+"""
+from multiprocessing.pool import ThreadPool
+import sys
+import time
+import urllib
+import urllib2
+
+
+def percentile(latencies, p):
+    """`latencies` must be sorted"""
+    return latencies[min(len(latencies) - 1, int(round(p / 100.0 * (len(latencies) - 1))))]
+
+
+def main(url, requests, concurrency, secret):
+    def post(i):
+        data = urllib.urlencode({'secret': secret,
+                                 'event': 'incoming_message',
+                                 'id': 'SM%08d' % i,
+                                 'content': 'BAL %d' % i,
+                                 'from_number': '+2557%08d' % i,
+                                 'to_number': '+255700000000',
+                                 'phone_id': 'PN1',
+                                 'time_created': str(int(time.time()))})
+        start = time.time()
+        try:
+            urllib2.urlopen(url, data).read()
+        except (urllib2.URLError, IOError):
+            return None
+        return time.time() - start
+
+    pool = ThreadPool(concurrency)
+    start = time.time()
+    try:
+        results = pool.map(post, xrange(requests))
+    finally:
+        pool.terminate()
+    elapsed = time.time() - start
+
+    latencies = sorted(r for r in results if r is not None)
+    print '%d requests, %d failed, %d concurrent, %.0f requests/s' % (
+        requests, requests - len(latencies), concurrency, requests / elapsed)
+    if latencies:
+        print 'p50 %.1f ms  p99 %.1f ms  max %.1f ms' % (
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+            latencies[-1] * 1000)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1],
+         int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 16,
+         sys.argv[4] if len(sys.argv) > 4 else 'YOUR_WEBHOOK_SECRET_HERE')
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from ...conf import settings
+from ...profile import handle_incoming_messages, webhook_queue
+from ...webhooks import ConsumerPool
+
+
+class Command(BaseCommand):
+    help = ('Handles the webhook events queued by the webhook view, sending '
+            'the replies through settings.WEBHOOK_REPLY_SENDER if it is set '
+            '(else the view replies)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch', type=int, default=100)
+
+    def handle(self, **options):
+        # the dotted path of a function sending a list of messages
+        sender = getattr(settings, 'WEBHOOK_REPLY_SENDER', None)
+        send = import_string(sender) if sender else None
+
+        pool = ConsumerPool(webhook_queue(),
+                            lambda events: handle_incoming_messages(events, send),
+                            workers=options['workers'],
+                            batch_size=options['batch'])
+        pool.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pool.stop()
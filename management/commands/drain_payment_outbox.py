@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...profile import PaymentProfileOutbox
+
+
+class Command(BaseCommand):
+    help = ('Pushes the payment profile changes queued in the outbox '
+            '(settings.PAYMENT_PROFILE_OUTBOX) to Authorize.NET')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Drain what is due and exit')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait when nothing is due')
+        parser.add_argument('--batch', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=10)
+
+    def handle(self, **options):
+        while True:
+            pushed, failed = PaymentProfileOutbox.objects.drain(
+                options['batch'], max_attempts=options['max_attempts'])
+            if pushed or failed:
+                self.stdout.write('%d pushed, %d failed' % (pushed, failed))
+            if options['once']:
+                return
+            if not (pushed or failed):
+                time.sleep(options['interval'])
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F, Func, Value
+
+MONEY_FIELDS = ('amount', 'tax', 'duty', 'freight')
+
+
+def clean_amounts(apps, schema_editor):
+    """Blank amounts become NULL and thousands separators are dropped"""
+    Response = apps.get_model('sarafu', 'Response')
+    responses = Response.objects.using(schema_editor.connection.alias)
+    for name in MONEY_FIELDS:
+        responses.filter(**{name: ''}).update(**{name: None})
+        responses.filter(**{name + '__contains': ','}).update(
+            **{name: Func(F(name), Value(','), Value(''), function='REPLACE')})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sarafu', '0001_initial'),
+    ]
+
+    operations = [
+        # the amounts are strings until they have been cleaned up
+        migrations.AlterField(
+            model_name='response',
+            name='amount',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='tax',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='duty',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='freight',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.RunPython(clean_amounts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='response',
+            name='amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='tax',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='duty',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='freight',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='cust_id',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='response',
+            name='invoice_num',
+            field=models.CharField(blank=True, db_index=True, max_length=20),
+        ),
+        migrations.AlterIndexTogether(
+            name='response',
+            index_together=set([('response_code', 'created')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sarafu', '0002_money_and_dashboard_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customerpaymentprofile',
+            name='create_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='PaymentProfileOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True, null=True)),
+                ('claimed_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('payment_profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='sarafu.CustomerPaymentProfile')),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sarafu', '0004_customerprofile_remote_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncSeenTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=32)),
+                ('reference', models.CharField(max_length=64)),
+                ('date', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SyncWatermark',
+            fields=[
+                ('account', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('last_date', models.DateTimeField()),
+                ('last_reference', models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='syncseentransaction',
+            unique_together=set([('account', 'reference')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='syncseentransaction',
+            index_together=set([('account', 'date')]),
+        ),
+    ]
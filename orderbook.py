@@ -0,0 +1,225 @@
+"""
+orderbook
+~~~~~~~~~~~~~~~~~~~~
+In-memory order book of `orders.Order`s by symbol, which aggregates the
+quantity at each price so that a quote never goes through the orders:
+ > book = OrderBook()
+ > book.add('o1', order)
+ > book.quote(u'GOOG')     # (best bid, best ask), each (price, quantity) or None
+ > book.cancel('o1')
+ > book.snapshot(u'GOOG')  # arrays of the levels, numpy ones if installed
+BUY and CALL orders bid, SELL and SHORT orders ask. An order rests at the
+price of each of its lots or, without lots, for its total quantity at its
+limit.
+"""
+from array import array
+from bisect import bisect_left
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .orders import TradeType
+
+BID_TYPES = frozenset([TradeType.BUY, TradeType.CALL])
+ASK_TYPES = frozenset([TradeType.SELL, TradeType.SHORT])
+
+try:
+    array('q')
+    TYPECODE = 'q'
+except ValueError:  # Python 2 has no 'q'; 'l' is 64 bits on 64-bit Unix
+    TYPECODE = 'l'
+
+INT64_MIN = -1 << 63
+INT64_MAX = (1 << 63) - 1
+
+
+class PriceLevels(object):
+    """
+    One side of a book: its prices in ascending order, in an array, with
+    the total quantity and the number of lots at each price
+    """
+
+    def __init__(self):
+        self.prices = array(TYPECODE)
+        self.quantities = array(TYPECODE)
+        self.counts = array(TYPECODE)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def add(self, price, quantity):
+        prices = self.prices
+        i = bisect_left(prices, price)
+        if i < len(prices) and prices[i] == price:
+            self.quantities[i] += quantity
+            self.counts[i] += 1
+        else:
+            prices.insert(i, price)
+            self.quantities.insert(i, quantity)
+            self.counts.insert(i, 1)
+
+    def remove(self, price, quantity):
+        prices = self.prices
+        i = bisect_left(prices, price)
+        if i == len(prices) or prices[i] != price:
+            raise KeyError(price)
+        if self.counts[i] == 1:
+            del prices[i]
+            del self.quantities[i]
+            del self.counts[i]
+        else:
+            self.quantities[i] -= quantity
+            self.counts[i] -= 1
+
+    def quantity_at(self, price):
+        i = bisect_left(self.prices, price)
+        if i < len(self.prices) and self.prices[i] == price:
+            return self.quantities[i]
+        return 0
+
+    def level(self, i):
+        """Returns (price, quantity) of the i-th level from the lowest price"""
+        return self.prices[i], self.quantities[i]
+
+
+class Book(object):
+    """The bids and asks of one symbol"""
+    __slots__ = ('bids', 'asks')
+
+    def __init__(self):
+        self.bids = PriceLevels()
+        self.asks = PriceLevels()
+
+
+class OrderBook(object):
+    """Order books by symbol, with orders added and cancelled by id"""
+
+    def __init__(self):
+        self._books = {}
+        # order id -> (price levels, ((price, quantity), ...))
+        self._orders = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def symbols(self):
+        return list(self._books)
+
+    def add(self, order_id, order):
+        """
+        Puts `order` in the book of its symbol, as `order_id`. Raises
+        ValueError, leaving the book as it was, if a lot (or the limit and
+        total quantity) has no price or quantity, or one out of the 64-bit
+        range, or a quantity that is not positive.
+        """
+        if order.trade_type in BID_TYPES:
+            bid = True
+        elif order.trade_type in ASK_TYPES:
+            bid = False
+        else:
+            raise ValueError('unknown trade type %s' % order.trade_type)
+        if order.lots:
+            resting = tuple((lot.price, lot.quantity) for lot in order.lots)
+        elif order.limit is not None:
+            resting = ((order.limit, order.total_quantity),)
+        else:
+            raise ValueError('order %r has neither lots nor a limit' % (order_id,))
+        for price, quantity in resting:
+            if price is None or quantity is None:
+                raise ValueError('order %r has no price or quantity at a level' % (order_id,))
+            if not INT64_MIN <= price <= INT64_MAX or not 0 < quantity <= INT64_MAX:
+                raise ValueError('order %r has quantity %d at %d' % (order_id, quantity, price))
+
+        with self._lock:
+            if order_id in self._orders:
+                raise ValueError('order %r is already in the book' % (order_id,))
+            book = self._books.get(order.symbol)
+            if book is None:
+                book = self._books[order.symbol] = Book()
+            levels = book.bids if bid else book.asks
+            added = 0
+            try:
+                for price, quantity in resting:
+                    levels.add(price, quantity)
+                    added += 1
+            except OverflowError:
+                # the total at a level out of range: take back the others
+                for price, quantity in resting[:added]:
+                    levels.remove(price, quantity)
+                raise ValueError('order %r overflows the quantity at a level' % (order_id,))
+            self._orders[order_id] = (levels, resting)
+
+    def cancel(self, order_id):
+        """Takes the order `order_id` out of its book; KeyError if it is not in one"""
+        with self._lock:
+            levels, resting = self._orders.pop(order_id)
+            for price, quantity in resting:
+                levels.remove(price, quantity)
+
+    def best_bid(self, symbol):
+        """Returns (price, quantity) of the highest bid, or None"""
+        with self._lock:
+            return self._best(symbol)[0]
+
+    def best_ask(self, symbol):
+        """Returns (price, quantity) of the lowest ask, or None"""
+        with self._lock:
+            return self._best(symbol)[1]
+
+    def quote(self, symbol):
+        """Returns the best bid and the best ask of `symbol`"""
+        with self._lock:
+            return self._best(symbol)
+
+    def depth(self, symbol, levels=5):
+        """Returns the best `levels` bids and asks, each a list of (price, quantity)"""
+        book = self._books.get(symbol)
+        if book is None:
+            return [], []
+        with self._lock:
+            bids, asks = book.bids, book.asks
+            return ([bids.level(len(bids) - 1 - i) for i in range(min(levels, len(bids)))],
+                    [asks.level(i) for i in range(min(levels, len(asks)))])
+
+    def _best(self, symbol):
+        book = self._books.get(symbol)
+        if book is None:
+            return None, None
+        return (book.bids.level(-1) if book.bids else None,
+                book.asks.level(0) if book.asks else None)
+
+    def snapshot(self, symbol=None):
+        """
+        Returns the levels of `symbol` (or a dict of those of every symbol):
+        a dict of bid_prices, bid_quantities, ask_prices and ask_quantities,
+        best first. They are numpy arrays if numpy is installed, else arrays.
+        """
+        if symbol is None:
+            return dict((symbol, self.snapshot(symbol)) for symbol in self.symbols())
+        book = self._books.get(symbol) or Book()
+        with self._lock:
+            return {'bid_prices': _export(book.bids.prices, True),
+                    'bid_quantities': _export(book.bids.quantities, True),
+                    'ask_prices': _export(book.asks.prices, False),
+                    'ask_quantities': _export(book.asks.quantities, False)}
+
+
+def _export(values, descending):
+    if numpy is None:
+        exported = array(TYPECODE, values)
+        if descending:
+            exported.reverse()
+        return exported
+    dtype = 'i%d' % values.itemsize
+    if not values:
+        return numpy.zeros(0, dtype=dtype)
+    # a view of the array's buffer, copied once
+    exported = numpy.frombuffer(values, dtype=dtype)
+    return exported[::-1].copy() if descending else exported.copy()
@@ -0,0 +1,362 @@
+"""
+ordercodec
+~~~~~~~~~~~~~~~~~~~~
+Compact binary encoding of protorpc messages, for high volume `orders`
+traffic. The codec of a message class is compiled once from its field
+definitions:
+ > codec = codec_for(Order)
+ > order = codec.decode(codec.encode(order))
+Streams of messages are framed by a length prefix, and whole batches are
+validated before any is encoded:
+ > data = encode_frames(Order, orders)  # ValidationError naming bad orders
+ > orders = decode_frames(Order, data)
+ > reader = FrameReader(Order)
+ > for order in reader.feed(sock.recv(65536)):
+ >     ...
+A message is a bitmap of the optional fields that are set, the scalar
+fields at fixed widths (little endian), then in field number order the
+strings (a length and UTF-8), nested messages and repeated fields (a count
+and the items). Repeated messages made only of required scalars, like
+`Lot`, are packed as one array.
+"""
+import struct
+
+from protorpc import messages
+
+Variant = messages.Variant
+
+# struct codes of the scalar variants
+SCALAR_CODES = {
+    Variant.INT32: 'i', Variant.SINT32: 'i', Variant.UINT32: 'I',
+    Variant.INT64: 'q', Variant.SINT64: 'q', Variant.UINT64: 'Q',
+    Variant.ENUM: 'i', Variant.BOOL: '?', Variant.FLOAT: 'f', Variant.DOUBLE: 'd',
+}
+INTEGER_RANGES = dict((code, (-1 << (8 * size - 1), (1 << (8 * size - 1)) - 1) if code.islower()
+                       else (0, (1 << (8 * size)) - 1))
+                      for code, size in (('i', 4), ('I', 4), ('q', 8), ('Q', 8)))
+
+_LENGTH = struct.Struct('<I')
+
+_codecs = {}
+
+
+def codec_for(message_type):
+    """Returns the `MessageCodec` of `message_type`, compiling it the first time"""
+    codec = _codecs.get(message_type)
+    if codec is None:
+        codec = _codecs[message_type] = MessageCodec(message_type)
+    return codec
+
+
+def _string_kind(field):
+    return 'bytes' if field.variant == Variant.BYTES else 'string'
+
+
+def _check_count(count, size, buf, pos):
+    """
+    Raises struct.error unless `count` items of at least `size` bytes fit
+    in `buf` after `pos`, before a count read from the data is trusted
+    """
+    if count * size > len(buf) - pos:
+        raise struct.error('%d items of %d bytes in %d bytes' % (count, size, len(buf) - pos))
+
+
+class MessageCodec(object):
+    """Encoder and decoder of the messages of one protorpc message class"""
+
+    def __init__(self, message_type):
+        self.message_type = message_type
+        fields = sorted(message_type.all_fields(), key=lambda f: f.number)
+        optional = [f for f in fields if not f.required and not f.repeated]
+        self._bits = dict((f.name, 1 << i) for i, f in enumerate(optional))
+        self._bitmap_size = (len(optional) + 7) // 8
+
+        # (name, bit if optional, enum class) of the fixed width fields
+        self._scalars = []
+        codes = []
+        # (name, bit, kind, struct code or codec) of the others
+        self._variable = []
+        # (name, repeated, low, high) of the integers, and required field names
+        self._ranges = []
+        self._required = []
+        # (name, codec, repeated) of the message fields
+        self._nested = []
+        for f in fields:
+            code = SCALAR_CODES.get(f.variant)
+            enum = f.type if isinstance(f, messages.EnumField) else None
+            if f.required:
+                self._required.append(f.name)
+            if code in INTEGER_RANGES and enum is None:
+                self._ranges.append((f.name, f.repeated) + INTEGER_RANGES[code])
+            if isinstance(f, messages.MessageField):
+                codec = codec_for(f.type)
+                self._nested.append((f.name, codec, f.repeated))
+                kind = 'messages' if f.repeated else 'message'
+                self._variable.append((f.name, self._bits.get(f.name), kind, codec))
+            elif code is None:
+                kind = _string_kind(f) + ('s' if f.repeated else '')
+                self._variable.append((f.name, self._bits.get(f.name), kind, None))
+            elif f.repeated:
+                self._variable.append((f.name, None, 'scalars', (code, enum)))
+            else:
+                self._scalars.append((f.name, self._bits.get(f.name), enum))
+                codes.append(code)
+        self._struct = struct.Struct('<' + ''.join(codes))
+        self._scalar_codes = ''.join(codes)
+        # the fewest bytes a message can take (at least one, so that a
+        # count of them is bounded by the data holding them)
+        self.min_size = max(1, self._bitmap_size + self._struct.size + sum(
+            spec.min_size if kind == 'message' else 4
+            for name, bit, kind, spec in self._variable if bit is None))
+        # all required scalars: repeated, they pack into one array
+        self.flat = not self._variable and all(f.required for f in fields)
+        if self.flat:
+            self._enums = [(i, enum) for i, (name, bit, enum) in enumerate(self._scalars) if enum]
+            self._names = [name for name, bit, enum in self._scalars]
+
+    def encode(self, message):
+        """Returns the encoding of `message`, which must be initialized"""
+        error = self.error(message)
+        if error:
+            raise messages.ValidationError(error)
+        out = bytearray()
+        self._encode(message, out)
+        return bytes(out)
+
+    def decode(self, data):
+        """Returns the message encoded in `data`"""
+        message, end = self._decode(data, 0)
+        if end != len(data):
+            raise messages.DecodeError('%d bytes after the %s' % (
+                len(data) - end, self.message_type.__name__))
+        return message
+
+    def error(self, message):
+        """Returns why `message` cannot be encoded, or None"""
+        for name in self._required:
+            if getattr(message, name) is None:
+                return '%s.%s is required' % (self.message_type.__name__, name)
+        for name, repeated, low, high in self._ranges:
+            value = getattr(message, name)
+            for v in (value if repeated else (value,)):
+                if v is not None and not low <= v <= high:
+                    return '%s.%s %d out of range' % (self.message_type.__name__, name, v)
+        for name, codec, repeated in self._nested:
+            value = getattr(message, name)
+            for v in (value if repeated else (value,)):
+                error = v is not None and codec.error(v)
+                if error:
+                    return error
+        return None
+
+    def errors(self, batch):
+        """Returns (index, error) for each message of `batch` which cannot be encoded"""
+        error = self.error
+        return [(i, e) for i, e in enumerate(error(message) for message in batch) if e]
+
+    def validate(self, batch):
+        """Raises ValidationError if any message of `batch` cannot be encoded"""
+        errors = self.errors(batch)
+        if errors:
+            raise messages.ValidationError('%d of %d messages invalid: %s' % (
+                len(errors), len(batch),
+                '; '.join('%d: %s' % error for error in errors[:10])))
+
+    def _encode(self, message, out):
+        bits = 0
+        if self._bitmap_size:
+            for name, bit in self._bits.items():
+                if getattr(message, name) is not None:
+                    bits |= bit
+            for i in range(self._bitmap_size):
+                out.append(bits >> (8 * i) & 0xFF)
+
+        values = []
+        for name, bit, enum in self._scalars:
+            value = getattr(message, name)
+            if value is None:
+                value = 0
+            elif enum is not None:
+                value = value.number
+            values.append(value)
+        out += self._struct.pack(*values)
+
+        for name, bit, kind, spec in self._variable:
+            value = getattr(message, name)
+            if bit is not None and not bits & bit:
+                continue
+            if kind == 'string':
+                value = value.encode('utf-8')
+                out += _LENGTH.pack(len(value))
+                out += value
+            elif kind == 'bytes':
+                out += _LENGTH.pack(len(value))
+                out += value
+            elif kind == 'message':
+                spec._encode(value, out)
+            else:
+                out += _LENGTH.pack(len(value))
+                if kind == 'scalars':
+                    code, enum = spec
+                    if enum is not None:
+                        value = [v.number for v in value]
+                    out += struct.pack('<%d%s' % (len(value), code), *value)
+                elif kind == 'messages' and spec.flat:
+                    spec._encode_flat(value, out)
+                elif kind == 'messages':
+                    for item in value:
+                        spec._encode(item, out)
+                else:
+                    for item in value:
+                        if kind == 'strings':
+                            item = item.encode('utf-8')
+                        out += _LENGTH.pack(len(item))
+                        out += item
+
+    def _encode_flat(self, items, out):
+        names = self._names
+        values = [getattr(item, name) for item in items for name in names]
+        for i, enum in self._enums:
+            values[i::len(names)] = [v.number for v in values[i::len(names)]]
+        out += struct.pack('<' + self._scalar_codes * len(items), *values)
+
+    def _decode(self, buf, pos):
+        try:
+            bits = 0
+            for i, octet in enumerate(bytearray(buf[pos:pos + self._bitmap_size])):
+                bits |= octet << (8 * i)
+            pos += self._bitmap_size
+
+            kwargs = {}
+            values = self._struct.unpack_from(buf, pos)
+            pos += self._struct.size
+            for (name, bit, enum), value in zip(self._scalars, values):
+                if bit is not None and not bits & bit:
+                    continue
+                kwargs[name] = enum(value) if enum is not None else value
+
+            for name, bit, kind, spec in self._variable:
+                if bit is not None and not bits & bit:
+                    continue
+                if kind == 'message':
+                    kwargs[name], pos = spec._decode(buf, pos)
+                    continue
+                count = _LENGTH.unpack_from(buf, pos)[0]
+                pos += 4
+                if kind in ('string', 'bytes'):
+                    _check_count(count, 1, buf, pos)
+                    value = bytes(buf[pos:pos + count])
+                    if len(value) != count:
+                        raise struct.error('truncated')
+                    kwargs[name] = value.decode('utf-8') if kind == 'string' else value
+                    pos += count
+                elif kind == 'scalars':
+                    code, enum = spec
+                    _check_count(count, struct.calcsize('<' + code), buf, pos)
+                    fmt = struct.Struct('<%d%s' % (count, code))
+                    value = fmt.unpack_from(buf, pos)
+                    kwargs[name] = [enum(v) for v in value] if enum is not None else list(value)
+                    pos += fmt.size
+                elif kind == 'messages' and spec.flat:
+                    kwargs[name], pos = spec._decode_flat(buf, pos, count)
+                elif kind == 'messages':
+                    _check_count(count, spec.min_size, buf, pos)
+                    items = []
+                    for _ in range(count):
+                        item, pos = spec._decode(buf, pos)
+                        items.append(item)
+                    kwargs[name] = items
+                else:
+                    _check_count(count, 4, buf, pos)
+                    items = []
+                    for _ in range(count):
+                        size = _LENGTH.unpack_from(buf, pos)[0]
+                        pos += 4
+                        item = bytes(buf[pos:pos + size])
+                        if len(item) != size:
+                            raise struct.error('truncated')
+                        items.append(item.decode('utf-8') if kind == 'strings' else item)
+                        pos += size
+                    kwargs[name] = items
+            return self.message_type(**kwargs), pos
+        except (struct.error, UnicodeDecodeError, TypeError, messages.Error) as e:
+            # TypeError: an enum number the class does not have
+            raise messages.DecodeError('bad %s at %d: %s' % (self.message_type.__name__, pos, e))
+
+    def _decode_flat(self, buf, pos, count):
+        _check_count(count, self._struct.size, buf, pos)
+        fmt = struct.Struct('<' + self._scalar_codes * count)
+        values = fmt.unpack_from(buf, pos)
+        names = self._names
+        n = len(names)
+        for i, enum in self._enums:
+            values = list(values)
+            values[i::n] = [enum(v) for v in values[i::n]]
+        message_type = self.message_type
+        items = [message_type(**dict(zip(names, values[i:i + n])))
+                 for i in range(0, len(values), n)]
+        return items, pos + fmt.size
+
+
+def encode_frames(message_type, batch, validate=True):
+    """
+    Returns the messages of `batch`, each preceded by its length (four
+    bytes, little endian). With `validate`, the whole batch is checked
+    first, and nothing is encoded if any message is invalid.
+    """
+    codec = codec_for(message_type)
+    if validate:
+        codec.validate(batch)
+    out = bytearray()
+    for message in batch:
+        start = len(out)
+        out += b'\0\0\0\0'
+        codec._encode(message, out)
+        _LENGTH.pack_into(out, start, len(out) - start - 4)
+    return bytes(out)
+
+
+def decode_frames(message_type, data):
+    """Returns the messages of the frames in `data`, which must hold whole frames"""
+    reader = FrameReader(message_type, max_length=len(data))
+    batch = reader.feed(data)
+    if reader.buffered:
+        raise messages.DecodeError('%d bytes of a truncated frame' % reader.buffered)
+    return batch
+
+
+class FrameReader(object):
+    """Incremental decoder of a stream of framed messages of `message_type`"""
+
+    def __init__(self, message_type, max_length=1 << 20):
+        self.codec = codec_for(message_type)
+        self.max_length = max_length
+        self._tail = b''
+
+    def feed(self, data):
+        """Returns the list of messages completed by `data`"""
+        if self._tail:
+            data = self._tail + bytes(data)
+        decode = self.codec._decode
+        batch = []
+        pos = 0
+        size = len(data)
+        while size - pos >= 4:
+            length = _LENGTH.unpack_from(data, pos)[0]
+            if length > self.max_length:
+                raise messages.DecodeError('frame of %d bytes' % length)
+            end = pos + 4 + length
+            if end > size:
+                break
+            message, decoded = decode(data, pos + 4)
+            if decoded != end:
+                raise messages.DecodeError('frame of %d bytes holds %d' % (length, decoded - pos - 4))
+            batch.append(message)
+            pos = end
+        self._tail = bytes(data[pos:])
+        return batch
+
+    @property
+    def buffered(self):
+        """The number of bytes of an incomplete frame held back"""
+        return len(self._tail)
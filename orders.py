@@ -0,0 +1,31 @@
+"""
+orders
+~~~~~~~~~~~~~~~~~~~~
+protorpc messages of the USSD trading front end: an `Order` for a symbol
+is filled from one or more `Lot`s at a price, up to an optional `limit`.
+ > order = Order(symbol=u'GOOG', total_quantity=10, trade_type=TradeType.BUY,
+ >               lots=[Lot(price=304, quantity=7), Lot(price=305, quantity=3)])
+ > order.check_initialized()
+"""
+from protorpc import messages
+
+
+# Trade type.
+class TradeType(messages.Enum):
+    BUY = 1
+    SELL = 2
+    SHORT = 3
+    CALL = 4
+
+
+class Lot(messages.Message):
+    price = messages.IntegerField(1, required=True)
+    quantity = messages.IntegerField(2, required=True)
+
+
+class Order(messages.Message):
+    symbol = messages.StringField(1, required=True)
+    total_quantity = messages.IntegerField(2, required=True)
+    trade_type = messages.EnumField(TradeType, 3, required=True)
+    lots = messages.MessageField(Lot, 4, repeated=True)
+    limit = messages.IntegerField(5)
@@ -0,0 +1,268 @@
+"""
+payouts
+~~~~~~~~~~~~~~~~~~~~
+Bulk payouts through `pesaplyMM.make_payment`.
+Payouts run concurrently under a rate limit. Every payout has an
+idempotency key and its progress is checkpointed to an append-only journal
+before and after the payment is made, so a run that crashes can be started
+again with the same journal without anyone being paid twice:
+ > engine = PayoutEngine(pesaplyMM('2550000000', '0000'), 'payroll-2016-08.journal')
+ > engine.run('payroll-2016-08.csv', 'payroll-2016-08', results='payroll-2016-08.results.csv')
+"""
+from collections import Counter, OrderedDict
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from .exceptions import *
+
+# payout states recorded in the journal
+STARTED = 'started'
+PAID = 'paid'
+FAILED = 'failed'
+# started but with no recorded outcome: the payment may or may not have
+# gone through and must be reconciled by hand
+UNKNOWN = 'unknown'
+
+RESULT_FIELDS = ('key', 'recipient', 'amount', 'description', 'status', 'txnid', 'error')
+
+
+class Payout(object):
+    __slots__ = ('key', 'recipient', 'amount', 'description')
+
+    def __init__(self, key, recipient, amount, description=None):
+        self.key = key
+        self.recipient = recipient
+        self.amount = amount
+        self.description = description
+
+
+def payout_key(batch, recipient, amount, description=None, occurrence=0):
+    """
+    Derives the idempotency key of a payout of `batch` from its content
+    and `occurrence`, the number of identical payouts before it in the
+    batch: two identical rows are two payouts, and a row keeps its key
+    when other rows are fixed or removed before the batch is run again.
+    """
+    return hashlib.sha1('\0'.join(str(x) for x in (batch, recipient, amount, description or '',
+                                                   occurrence))).hexdigest()
+
+
+def _next_key(batch, occurrences, recipient, amount, description):
+    """
+    The key of a payout of `batch` without one of its own; `occurrences`
+    counts the identical payouts seen so far
+    """
+    content = tuple(str(x) for x in (recipient, amount, description or ''))
+    key = payout_key(batch, recipient, amount, description, occurrences[content])
+    occurrences[content] += 1
+    return key
+
+
+def read_payouts(path, batch):
+    """
+    Reads payouts from a CSV file with recipient, amount and (optional)
+    description columns. A key column, if present, is used as the
+    idempotency key; otherwise one is derived from `batch` and the row.
+    """
+    occurrences = Counter()
+    with open(path, 'rb') as f:
+        for row in csv.DictReader(f):
+            description = row.get('description') or None
+            key = row.get('key') or _next_key(batch, occurrences, row['recipient'],
+                                              row['amount'], description)
+            yield Payout(key, row['recipient'], row['amount'], description)
+
+
+class Journal(object):
+    """
+    Append-only log of payout states, one JSON object per line.
+    Every record is flushed to disk before `record` returns.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.states = {}
+        if os.path.exists(path):
+            self._load()
+        self._file = open(path, 'ab')
+
+    def _load(self):
+        end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                end += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.states[entry['key']] = entry
+        if os.path.getsize(self.path) > end:
+            # the final line of a crash mid-write: cut it off, or the next
+            # record would be appended to it
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+
+    def record(self, key, state, **extra):
+        entry = dict(extra, key=key, state=state)
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.states[key] = entry
+        return entry
+
+    def close(self):
+        self._file.close()
+
+
+class RateLimiter(object):
+    """Thread-safe token bucket allowing `rate` calls per second"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class PayoutEngine(object):
+    """
+    Pays out a batch of payouts from the account of `mm`.
+    checkpoint: path of the journal used to resume an interrupted run
+    workers: number of payouts made concurrently, each on its own session
+    rate: maximum number of payouts started per second
+    """
+
+    def __init__(self, mm, checkpoint, workers=4, rate=2):
+        self.mm = mm
+        self.journal = Journal(checkpoint)
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+    def run(self, payouts, batch, results=None):
+        """
+        Makes every payout not already paid according to the journal and
+        returns a result dict per payout, in input order.
+        `payouts` is the path of a CSV file (see `read_payouts`) or an
+        iterable of `Payout` objects or (recipient, amount, description)
+        tuples. `batch` identifies the batch: the keys of payouts without
+        one of their own are derived from it, so it must be unique among
+        the runs sharing a journal. A key that appears more than once is
+        paid once, and raises ValueError if it is given to different
+        payouts. If `results` is given the results are also written there
+        as CSV.
+        """
+        if not batch:
+            raise ValueError('a batch id is required')
+        if isinstance(payouts, basestring):
+            payouts = read_payouts(payouts, batch)
+        occurrences = Counter()
+        payouts = [self._payout(batch, occurrences, p) for p in payouts]
+
+        unique = OrderedDict()
+        for payout in payouts:
+            first = unique.setdefault(payout.key, payout)
+            if (first.recipient, first.amount, first.description) != \
+                    (payout.recipient, payout.amount, payout.description):
+                raise ValueError('payout key %s is used by two different payouts' % payout.key)
+
+        pool = ThreadPool(self.workers)
+        try:
+            paid = dict(zip(unique, pool.map(self._pay, unique.values())))
+        finally:
+            pool.terminate()
+            for mm in self._sessions:
+                mm.close()
+            self._sessions = []
+        outcome = [self._result(payout, paid[payout.key]) for payout in payouts]
+
+        if results is not None:
+            with open(results, 'wb') as f:
+                writer = csv.DictWriter(f, RESULT_FIELDS)
+                writer.writeheader()
+                for row in outcome:
+                    writer.writerow(dict((k, '' if v is None else v) for k, v in row.items()))
+        return outcome
+
+    def _payout(self, batch, occurrences, payout):
+        if isinstance(payout, Payout):
+            return payout
+        recipient, amount = payout[0], payout[1]
+        description = len(payout) > 2 and payout[2] or None
+        return Payout(_next_key(batch, occurrences, recipient, amount, description),
+                      recipient, amount, description)
+
+    def _pay(self, payout):
+        """Makes `payout` unless the journal says not to; returns its journal entry"""
+        previous = self.journal.states.get(payout.key)
+        if previous is not None and previous['state'] in (PAID, STARTED, UNKNOWN):
+            # paid already, or possibly paid by a run that crashed
+            state = previous['state'] == PAID and PAID or UNKNOWN
+            if state != previous['state']:
+                previous = self.journal.record(payout.key, state)
+            return previous
+
+        self.limiter.acquire()
+        self.journal.record(payout.key, STARTED)
+        try:
+            txnid = self._session().make_payment(payout.recipient, payout.amount, payout.description)
+        except (InvalidAccountException, AuthDeniedException) as e:
+            # the server refused the payment, so it is safe to try again later
+            entry = self.journal.record(payout.key, FAILED, error=e.__class__.__name__)
+        except RequestErrorException as e:
+            # also raised for an error page after the payment was confirmed
+            entry = self.journal.record(payout.key, UNKNOWN, error=e.__class__.__name__)
+        except Exception as e:
+            self._discard_session()
+            entry = self.journal.record(payout.key, UNKNOWN, error=repr(e))
+        else:
+            if txnid:
+                entry = self.journal.record(payout.key, PAID, txnid=txnid)
+            else:
+                entry = self.journal.record(payout.key, UNKNOWN, error='no transaction id in response')
+        return entry
+
+    def _result(self, payout, entry):
+        return {'key': payout.key,
+                'recipient': payout.recipient,
+                'amount': payout.amount,
+                'description': payout.description,
+                'status': entry['state'],
+                'txnid': entry.get('txnid'),
+                'error': entry.get('error')}
+
+    def _session(self):
+        """Each worker thread pays through its own browser session"""
+        mm = getattr(self._local, 'mm', None)
+        if mm is None:
+            mm = self._local.mm = self.mm._clone()
+            with self._sessions_lock:
+                self._sessions.append(mm)
+        return mm
+
+    def _discard_session(self):
+        self._local.mm = None
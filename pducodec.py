@@ -0,0 +1,404 @@
+"""
+pducodec
+~~~~~~~~~~~~~~~~~~~~
+SMPP 3.4 PDU codec for the SMS notification path, covering the PDUs of an
+ESME session: binds, submit_sm, deliver_sm, enquire_link, unbind and
+generic_nack (and their responses).
+ > encoder = PDUEncoder()
+ > sock.sendall(encoder.encode(SubmitSM(1, source_addr=b'sarafu', destination_addr=b'255700000000',
+ >                                      short_message=b'Payment received')))
+ > reader = PDUReader()
+ > for pdu in reader.feed(sock.recv(65536)):
+ >     ...
+Decoding does not copy the short message or optional parameter values:
+they are memoryviews of the buffer decoded from. Encoding writes into the
+encoder's own buffer, which is reused by the next encode.
+Works on Python 2.7 and 3.
+"""
+import struct
+
+# command ids
+GENERIC_NACK = 0x80000000
+BIND_RECEIVER = 0x00000001
+BIND_RECEIVER_RESP = 0x80000001
+BIND_TRANSMITTER = 0x00000002
+BIND_TRANSMITTER_RESP = 0x80000002
+SUBMIT_SM = 0x00000004
+SUBMIT_SM_RESP = 0x80000004
+DELIVER_SM = 0x00000005
+DELIVER_SM_RESP = 0x80000005
+UNBIND = 0x00000006
+UNBIND_RESP = 0x80000006
+BIND_TRANSCEIVER = 0x00000009
+BIND_TRANSCEIVER_RESP = 0x80000009
+ENQUIRE_LINK = 0x00000015
+ENQUIRE_LINK_RESP = 0x80000015
+
+# command status
+ESME_ROK = 0x00000000
+ESME_RINVMSGLEN = 0x00000001
+ESME_RINVCMDLEN = 0x00000002
+ESME_RINVCMDID = 0x00000003
+ESME_RINVBNDSTS = 0x00000004
+ESME_RALYBND = 0x00000005
+ESME_RSYSERR = 0x00000008
+ESME_RBINDFAIL = 0x0000000D
+ESME_RINVPASWD = 0x0000000E
+ESME_RINVSYSID = 0x0000000F
+ESME_RMSGQFUL = 0x00000014
+ESME_RTHROTTLED = 0x00000058
+
+# optional parameter (TLV) tags
+TAG_SAR_MSG_REF_NUM = 0x020C
+TAG_SAR_TOTAL_SEGMENTS = 0x020E
+TAG_SAR_SEGMENT_SEQNUM = 0x020F
+TAG_MESSAGE_PAYLOAD = 0x0424
+TAG_RECEIPTED_MESSAGE_ID = 0x001E
+TAG_MESSAGE_STATE = 0x0427
+
+HEADER = struct.Struct('>IIII')
+_LENGTH = struct.Struct('>I')
+_TLV = struct.Struct('>HH')
+_INT8 = struct.Struct('>B')
+
+# the longest C-Octet String of these PDUs (message_id), with its NUL
+CSTRING_MAX = 65
+
+# field kinds
+CSTRING = 'c'  # NUL terminated octets
+INT8 = 'B'
+INT32 = 'I'
+SHORT_MESSAGE = 'sm'  # octets preceded by a one octet length (sm_length)
+
+_BIND_FIELDS = (('system_id', CSTRING), ('password', CSTRING), ('system_type', CSTRING),
+                ('interface_version', INT8), ('addr_ton', INT8), ('addr_npi', INT8),
+                ('address_range', CSTRING))
+_SM_FIELDS = (('service_type', CSTRING),
+              ('source_addr_ton', INT8), ('source_addr_npi', INT8), ('source_addr', CSTRING),
+              ('dest_addr_ton', INT8), ('dest_addr_npi', INT8), ('destination_addr', CSTRING),
+              ('esm_class', INT8), ('protocol_id', INT8), ('priority_flag', INT8),
+              ('schedule_delivery_time', CSTRING), ('validity_period', CSTRING),
+              ('registered_delivery', INT8), ('replace_if_present_flag', INT8),
+              ('data_coding', INT8), ('sm_default_msg_id', INT8),
+              ('short_message', SHORT_MESSAGE))
+
+
+class PDUError(Exception):
+    """A malformed PDU; `status` is the error to answer it with"""
+
+    def __init__(self, message, status=ESME_RSYSERR):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def _compile(fields):
+    """
+    Turns a body layout into decoding steps, merging runs of integers into
+    one struct so they are unpacked with a single call
+    """
+    steps = []
+    for name, kind in fields:
+        if kind in (INT8, INT32):
+            if steps and steps[-1][0] == 'int':
+                _, fmt, names = steps.pop()
+                steps.append(('int', fmt + kind, names + (name,)))
+            else:
+                steps.append(('int', '>' + kind, (name,)))
+        else:
+            steps.append((kind, None, name))
+    return tuple((kind, struct.Struct(fmt) if kind == 'int' else None, names)
+                 for kind, fmt, names in steps)
+
+
+class PDU(object):
+    """
+    Base of the PDU classes. A PDU has a sequence number, a command status,
+    the fields of its body as attributes and optional parameters in `tlvs`
+    (a dict of tag to value).
+    """
+    __slots__ = ('sequence', 'status', 'tlvs')
+    command_id = None
+    fields = ()
+    _steps = ()
+
+    def __init__(self, sequence=0, status=ESME_ROK, tlvs=None, **params):
+        self.sequence = sequence
+        self.status = status
+        self.tlvs = tlvs or {}
+        for name, kind in self.fields:
+            setattr(self, name, params.pop(name, 0 if kind in (INT8, INT32) else b''))
+        if params:
+            raise TypeError('unknown %s fields: %s' % (self.__class__.__name__, ', '.join(params)))
+
+    def response(self, status=ESME_ROK, **params):
+        """Returns the response PDU to this request"""
+        return PDU_CLASSES[self.command_id | GENERIC_NACK](self.sequence, status, **params)
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and self.sequence == other.sequence
+                and self.status == other.status
+                and all(_value(getattr(self, name)) == _value(getattr(other, name))
+                        for name, kind in self.fields)
+                and dict((k, _value(v)) for k, v in self.tlvs.items())
+                == dict((k, _value(v)) for k, v in other.tlvs.items()))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            ['sequence=%r' % self.sequence, 'status=%r' % self.status]
+            + ['%s=%r' % (name, _value(getattr(self, name))) for name, kind in self.fields]
+            + (self.tlvs and ['tlvs=%r' % dict((k, _value(v)) for k, v in self.tlvs.items())] or [])))
+
+
+def _value(value):
+    return value.tobytes() if isinstance(value, memoryview) else value
+
+
+def _pdu_class(name, command_id, fields=()):
+    cls = type(name, (PDU,), {'__slots__': tuple(f for f, kind in fields),
+                              'command_id': command_id,
+                              'fields': fields,
+                              '_steps': _compile(fields)})
+    PDU_CLASSES[command_id] = cls
+    return cls
+
+
+PDU_CLASSES = {}
+
+GenericNack = _pdu_class('GenericNack', GENERIC_NACK)
+BindReceiver = _pdu_class('BindReceiver', BIND_RECEIVER, _BIND_FIELDS)
+BindReceiverResp = _pdu_class('BindReceiverResp', BIND_RECEIVER_RESP, (('system_id', CSTRING),))
+BindTransmitter = _pdu_class('BindTransmitter', BIND_TRANSMITTER, _BIND_FIELDS)
+BindTransmitterResp = _pdu_class('BindTransmitterResp', BIND_TRANSMITTER_RESP, (('system_id', CSTRING),))
+BindTransceiver = _pdu_class('BindTransceiver', BIND_TRANSCEIVER, _BIND_FIELDS)
+BindTransceiverResp = _pdu_class('BindTransceiverResp', BIND_TRANSCEIVER_RESP, (('system_id', CSTRING),))
+SubmitSM = _pdu_class('SubmitSM', SUBMIT_SM, _SM_FIELDS)
+SubmitSMResp = _pdu_class('SubmitSMResp', SUBMIT_SM_RESP, (('message_id', CSTRING),))
+DeliverSM = _pdu_class('DeliverSM', DELIVER_SM, _SM_FIELDS)
+DeliverSMResp = _pdu_class('DeliverSMResp', DELIVER_SM_RESP, (('message_id', CSTRING),))
+Unbind = _pdu_class('Unbind', UNBIND)
+UnbindResp = _pdu_class('UnbindResp', UNBIND_RESP)
+EnquireLink = _pdu_class('EnquireLink', ENQUIRE_LINK)
+EnquireLinkResp = _pdu_class('EnquireLinkResp', ENQUIRE_LINK_RESP)
+
+
+class UnknownPDU(PDU):
+    """A PDU with a command id this codec does not know; its body is kept raw"""
+    __slots__ = ('command_id', 'body')
+
+    def __init__(self, command_id, sequence=0, status=ESME_ROK, body=b''):
+        PDU.__init__(self, sequence, status)
+        self.command_id = command_id
+        self.body = body
+
+    def response(self, status=ESME_RINVCMDID, **params):
+        return GenericNack(self.sequence, status)
+
+
+def decode(data, offset=0):
+    """
+    Decodes the PDU at `offset` of `data` (bytes, bytearray or memoryview),
+    which must hold all of it. Returns (pdu, offset of the next PDU).
+    """
+    view = data if isinstance(data, memoryview) else memoryview(data)
+    if len(view) - offset < 16:
+        raise PDUError('incomplete PDU header', ESME_RINVCMDLEN)
+    length = _LENGTH.unpack_from(view, offset)[0]
+    if length < 16 or offset + length > len(view):
+        raise PDUError('bad command_length %d' % length, ESME_RINVCMDLEN)
+    return _decode(view, offset, length), offset + length
+
+
+def _decode(view, offset, length):
+    command_length, command_id, status, sequence = HEADER.unpack_from(view, offset)
+    cls = PDU_CLASSES.get(command_id)
+    end = offset + length
+    pos = offset + 16
+    if cls is None:
+        return UnknownPDU(command_id, sequence, status, view[pos:end])
+
+    pdu = cls.__new__(cls)
+    pdu.sequence = sequence
+    pdu.status = status
+    pdu.tlvs = {}
+    if pos == end and status != ESME_ROK:
+        # error responses may come without a body
+        for name, kind in cls.fields:
+            setattr(pdu, name, 0 if kind in (INT8, INT32) else b'')
+        return pdu
+    try:
+        for kind, fmt, names in cls._steps:
+            if kind == 'int':
+                values = fmt.unpack_from(view, pos)
+                for name, value in zip(names, values):
+                    setattr(pdu, name, value)
+                pos += fmt.size
+            elif kind == CSTRING:
+                # a memoryview has no find: copy the most the string can be
+                octets = view[pos:min(pos + CSTRING_MAX, end)].tobytes()
+                nul = octets.find(b'\0')
+                if nul < 0:
+                    raise PDUError('unterminated %s' % names, ESME_RINVMSGLEN)
+                setattr(pdu, names, octets[:nul])
+                pos += nul + 1
+            else:
+                sm_length = _INT8.unpack_from(view, pos)[0]
+                pos += 1
+                setattr(pdu, names, view[pos:pos + sm_length])
+                pos += sm_length
+        while pos + 4 <= end:
+            tag, tlv_length = _TLV.unpack_from(view, pos)
+            pos += 4
+            pdu.tlvs[tag] = view[pos:pos + tlv_length]
+            pos += tlv_length
+    except struct.error:
+        raise PDUError('%s body shorter than its fields' % cls.__name__, ESME_RINVCMDLEN)
+    if pos != end:
+        raise PDUError('%s body does not match command_length' % cls.__name__, ESME_RINVCMDLEN)
+    return pdu
+
+
+class PDUReader(object):
+    """
+    Incremental decoder of a stream of concatenated PDUs, as read from a
+    socket. PDUs wholly inside a chunk are decoded in place, so their
+    short messages are views of the chunk; only the octets of a PDU split
+    across chunks are copied.
+    """
+
+    def __init__(self, max_length=65536):
+        self.max_length = max_length
+        self._tail = b''
+
+    def feed(self, data):
+        """Returns the list of PDUs completed by `data`"""
+        view = data if isinstance(data, memoryview) else memoryview(data)
+        pdus = []
+        pos = 0
+        if self._tail:
+            pos = self._complete_tail(view, pdus)
+            if self._tail:
+                return pdus
+        size = len(view)
+        while size - pos >= 4:
+            length = self._length(view, pos)
+            if pos + length > size:
+                break
+            pdus.append(_decode(view, pos, length))
+            pos += length
+        self._tail = view[pos:].tobytes()
+        return pdus
+
+    def _complete_tail(self, view, pdus):
+        """
+        Adds the head of `view` to the PDU held back, decoding it if that
+        completes it. Returns the number of octets of `view` used.
+        """
+        tail = self._tail
+        used = 0
+        if len(tail) < 4:
+            used = min(4 - len(tail), len(view))
+            tail += view[:used].tobytes()
+            if len(tail) < 4:
+                self._tail = tail
+                return used
+        length = self._length(tail, 0)
+        more = min(length - len(tail), len(view) - used)
+        tail += view[used:used + more].tobytes()
+        used += more
+        if len(tail) == length:
+            pdus.append(_decode(memoryview(tail), 0, length))
+            tail = b''
+        self._tail = tail
+        return used
+
+    def _length(self, data, pos):
+        length = _LENGTH.unpack_from(data, pos)[0]
+        if length < 16 or length > self.max_length:
+            raise PDUError('bad command_length %d' % length, ESME_RINVCMDLEN)
+        return length
+
+    @property
+    def buffered(self):
+        """The number of octets of an incomplete PDU held back"""
+        return len(self._tail)
+
+
+class PDUEncoder(object):
+    """
+    Encodes PDUs into a buffer allocated once (and grown when a PDU does
+    not fit). The memoryview returned by `encode` is only valid until the
+    next call.
+    """
+
+    def __init__(self, size=4096):
+        self.buf = bytearray(size)
+
+    def encode(self, pdu):
+        end = self._encode_at(pdu, 0)
+        return memoryview(self.buf)[:end]
+
+    def encode_many(self, pdus):
+        """Encodes `pdus` back to back, e.g. for a single socket write"""
+        end = 0
+        for pdu in pdus:
+            end = self._encode_at(pdu, end)
+        return memoryview(self.buf)[:end]
+
+    def _encode_at(self, pdu, start):
+        values = []
+        size = 16
+        for name, kind in pdu.fields:
+            value = getattr(pdu, name)
+            if kind == INT8:
+                size += 1
+            elif kind == INT32:
+                size += 4
+            else:
+                if not isinstance(value, (bytes, bytearray, memoryview)):
+                    value = value.encode('ascii')
+                size += len(value) + 1
+                if kind == SHORT_MESSAGE and len(value) > 254:
+                    raise PDUError('short_message longer than 254 octets, use message_payload',
+                                   ESME_RINVMSGLEN)
+            values.append(value)
+        for value in pdu.tlvs.values():
+            size += 4 + len(value)
+        self._reserve(start + size)
+
+        buf = self.buf
+        HEADER.pack_into(buf, start, size, pdu.command_id, pdu.status, pdu.sequence)
+        pos = start + 16
+        for (name, kind), value in zip(pdu.fields, values):
+            if kind == INT8:
+                buf[pos] = value
+                pos += 1
+            elif kind == INT32:
+                _LENGTH.pack_into(buf, pos, value)
+                pos += 4
+            elif kind == CSTRING:
+                buf[pos:pos + len(value)] = value
+                pos += len(value)
+                buf[pos] = 0
+                pos += 1
+            else:
+                buf[pos] = len(value)
+                pos += 1
+                buf[pos:pos + len(value)] = value
+                pos += len(value)
+        for tag, value in pdu.tlvs.items():
+            _TLV.pack_into(buf, pos, tag, len(value))
+            pos += 4
+            buf[pos:pos + len(value)] = value
+            pos += len(value)
+        return pos
+
+    def _reserve(self, size):
+        if size > len(self.buf):
+            # a new buffer rather than resizing, which views of the old
+            # one still held by the caller would prevent
+            buf = bytearray(max(size, 2 * len(self.buf)))
+            buf[:len(self.buf)] = self.buf
+            self.buf = buf
@@ -5,13 +5,16 @@ This is the core module for all the functionality required
 to interact with the pesaply Mobile Money web application.
 """
 from copy import deepcopy
-import csv
 from cStringIO import StringIO
-from datetime import datetime
+from .accounts import INVALID
 from .exceptions import *
+from .scraping import BALANCE, ERROR, INVALID_PIN, NOT_FOUND, PAYMENT, PAYMENT_RECIPIENT
+from .transactions import date_shards, iter_lines, merge_transactions, \
+    parse_transactions, transactions_frame
 import json
 import mechanize
-import re
+from multiprocessing.pool import ThreadPool
+import Queue
 import urllib
 
 
@@ -34,7 +37,7 @@ class pesaplyMM(object):
     ERROR_URL = 'https://sarafu.pesaply.com/do/error'
     TRANSACTIONS_FORM = None
 
-    def __init__(self, account, pin, browser=None):
+    def __init__(self, account, pin, browser=None, pool=None, account_cache=None):
         """
         In some occasions where you'll make a number of requests
         to the server, you will want to store the mechanize browser
@@ -43,12 +46,43 @@ class pesaplyMM(object):
         necessary to complete given tasks.
         The browser object can simply be created this way:
         > browser = mechanize.Browser()
+        When many objects are created across threads, pass a
+        `sessions.SessionPool` instead; a logged in session is then borrowed
+        from the pool and given back by `close`:
+        > with pesaplyMM('2550000000', '0000', pool=pool) as mm:
+        >     mm.get_balance()
+        Account lookups are cached if an `accounts.AccountCache` is given.
         """
         self.account = account
         self.pin = pin
+        self.pool = pool
+        self.account_cache = account_cache
+        self.session = None
+        if pool is not None and browser is None:
+            self.session = pool.acquire(account, pin)
+            browser = self.session.browser
         self.br = browser or mechanize.Browser()
         self.br.set_handle_robots(False)
 
+    def close(self):
+        """
+        Gives a pooled session back to its pool. Objects created without a
+        pool need not be closed.
+        """
+        if self.session is not None:
+            self.pool.release(self.session)
+            self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None and self.session is not None:
+            # the session may be stuck half way through a page walk
+            self.pool.discard(self.session)
+            self.session = None
+        self.close()
+
     def get_account_details(self, account):
         """
         This method can be used in a number of scenarios:
@@ -56,6 +90,61 @@ class pesaplyMM(object):
         2. When there's a need to filter transactions by an account id
         3. When account details (e.g. name of account) are needed
         """
+        if self.account_cache is not None:
+            details = self.account_cache.get(account)
+            if details is INVALID:
+                raise InvalidAccountException
+            elif details is not None:
+                return details
+
+        return self._fetch_account_details(account)
+
+    def get_accounts_details(self, accounts, workers=4):
+        """
+        Looks up a number of accounts at once, returning a dict of their
+        details keyed by account, with None for accounts that don't exist.
+        Each account is looked up only once, and those not in the account
+        cache are fetched concurrently by up to `workers` browser sessions.
+        """
+        details = {}
+        misses = []
+        for account in accounts:
+            if account in details:
+                continue
+            cached = self.account_cache and self.account_cache.get(account)
+            if cached is INVALID:
+                details[account] = None
+            elif cached is not None:
+                details[account] = cached
+            else:
+                details[account] = None
+                misses.append(account)
+
+        def fetch(mm, account):
+            try:
+                return mm._fetch_account_details(account)
+            except InvalidAccountException:
+                return None
+
+        details.update(zip(misses, self._map_sessions(fetch, misses, workers)))
+        return details
+
+    def _fetch_account_details(self, account):
+        """
+        Internally used to look an account up on the server, storing the
+        result in the account cache if there is one
+        """
+        try:
+            details = self._search_member(account)
+        except InvalidAccountException:
+            if self.account_cache is not None:
+                self.account_cache.set_invalid(account)
+            raise
+        if self.account_cache is not None:
+            self.account_cache.set(account, details)
+        return details
+
+    def _search_member(self, account):
         _form = mechanize.HTMLForm(self.SEARCH_MEMBERS_URL, method="POST")
         _form.new_control('text', 'username', {'value': account})
         _form.new_control('text', '_', {'value': ''})
@@ -88,13 +177,127 @@ class pesaplyMM(object):
         need to get this information from `get_account_details` method)
         If you specify txn_ref, then it's not necessary to specify to_date and from_date.
         """
+        _form = self._transactions_form(**kwargs)
+
+        try:
+            r = self.post_url(self.TRANSACTIONS_EXPORT_URL, form=_form)
+            return self._parse_transactions(r)
+        except AuthRequiredException:
+            self._auth()
+            r = self.post_url(self.TRANSACTIONS_EXPORT_URL, form=_form)
+            return self._parse_transactions(r)
+
+    def iter_transactions(self, chunk_size=64 * 1024, **kwargs):
+        """
+        Same as `get_transactions` but the export is streamed from the
+        server `chunk_size` bytes at a time and parsed as it arrives.
+        Yields `Transaction` objects, which can also be read like the
+        dicts returned by `get_transactions`:
+        > for txn in mm.iter_transactions(from_date=datetime(2016, 1, 1)):
+        >     print txn.reference, txn['amount']
+        Memory use does not grow with the size of the export.
+        """
+        _form = self._transactions_form(**kwargs)
+
+        try:
+            r = self.open_url(self.TRANSACTIONS_EXPORT_URL, form=_form)
+        except AuthRequiredException:
+            self._auth()
+            r = self.open_url(self.TRANSACTIONS_EXPORT_URL, form=_form)
+
+        return parse_transactions(iter_lines(r, chunk_size))
+
+    def get_transactions_sharded(self, from_date, to_date, shard='week', workers=4, **kwargs):
+        """
+        Fetches the `from_date`..`to_date` history as a number of smaller
+        exports, which the server builds much faster than a single large one.
+        The window is split into `shard` sized windows ('day', 'week', a
+        number of days or a timedelta) that are fetched concurrently by up to
+        `workers` independently logged in browser sessions. Any other
+        keyword arguments are passed on as in `get_transactions`.
+        Returns `Transaction` objects ordered by date, de-duplicated by
+        reference.
+        """
+        def fetch(mm, window):
+            return list(mm.iter_transactions(from_date=window[0], to_date=window[1], **kwargs))
+
+        shards = date_shards(from_date, to_date, shard)
+        return merge_transactions(self._map_sessions(fetch, shards, workers))
+
+    def _map_sessions(self, func, items, workers, serial=2):
+        """
+        Internally used to call `func(mm, item)` for every item on a pool
+        of up to `workers` threads, each with a clone of this object.
+        Up to `serial` items are handled in turn by this object instead,
+        which is quicker than logging in new sessions for them.
+        Returns the results in the order of `items`.
+        """
+        if len(items) <= serial or workers <= 1:
+            return [func(self, item) for item in items]
+
+        sessions = Queue.Queue()
+        workers = min(workers, len(items))
+        for i in range(workers):
+            sessions.put(self._clone())
+
+        def call(item):
+            mm = sessions.get()
+            try:
+                return func(mm, item)
+            finally:
+                sessions.put(mm)
+
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(call, items)
+        finally:
+            pool.terminate()
+            while not sessions.empty():
+                sessions.get().close()
+
+    def _clone(self):
+        """
+        Internally used to get another object for the same account with
+        a browser session of its own, taken from the pool if there is one
+        """
+        return self.__class__(self.account, self.pin, pool=self.pool, account_cache=self.account_cache)
+
+    def get_transactions_frame(self, **kwargs):
+        """
+        Same as `get_transactions` but returns a pandas DataFrame with
+        typed columns instead of a list of dicts. It is parsed straight
+        from the export, which is much faster for large histories:
+        > frame = mm.get_transactions_frame(from_date=datetime(2016, 1, 1))
+        > frame.groupby('sender')['amount'].sum()
+        """
+        _form = self._transactions_form(**kwargs)
+
+        try:
+            r = self.open_url(self.TRANSACTIONS_EXPORT_URL, form=_form)
+        except AuthRequiredException:
+            self._auth()
+            r = self.open_url(self.TRANSACTIONS_EXPORT_URL, form=_form)
+
+        return transactions_frame(r)
+
+    def _transactions_form(self, **kwargs):
+        """
+        Returns a copy of the account history form with the
+        `get_transactions` filters filled in
+        """
         kw_map = {
             'to_date': 'query(period).end',
             'from_account_id': 'query(member)',
             'from_date': 'query(period).begin',
             'txn_ref': 'query(transactionNumber)'}
 
-        if not self.TRANSACTIONS_FORM:
+        # the parsed form is kept with the browser session it came from
+        if self.session is not None:
+            _form = self.session.transactions_form
+        else:
+            _form = self.TRANSACTIONS_FORM
+
+        if not _form:
             try:
                 self.get_url(self.TRANSACTIONS_URL)
             except AuthRequiredException:
@@ -103,10 +306,13 @@ class pesaplyMM(object):
             self.br.select_form("accountHistoryForm")
             self.br.form.method = 'POST'
             self.br.form.action = self.TRANSACTIONS_EXPORT_URL
-            self.TRANSACTIONS_FORM = self.br.form
-            _form = deepcopy(self.TRANSACTIONS_FORM)
-        else:
-            _form = deepcopy(self.TRANSACTIONS_FORM)
+            _form = self.br.form
+            if self.session is not None:
+                self.session.transactions_form = _form
+            else:
+                self.TRANSACTIONS_FORM = _form
+
+        _form = deepcopy(_form)
 
         # make all hidden and readonly fields writable
         _form.set_all_readonly(False)
@@ -119,13 +325,7 @@ class pesaplyMM(object):
                 else:
                     _form[field_name] = kwargs.get(key)
 
-        try:
-            r = self.post_url(self.TRANSACTIONS_EXPORT_URL, form=_form)
-            return self._parse_transactions(r)
-        except AuthRequiredException:
-            self._auth()
-            r = self.post_url(self.TRANSACTIONS_EXPORT_URL, form=_form)
-            return self._parse_transactions(r)
+        return _form
 
     def make_payment(self, recipient, amount, description=None):
         """
@@ -153,28 +353,26 @@ class pesaplyMM(object):
         self.br.new_control('text', 'pin', attrs={'value': self.pin})
         self.br.new_control('text', 'amount', attrs={'value': amount})
         self.br.new_control('text', 'channel', attrs={'value': 'WAP'})
-        r = self.br.submit()
+        r = self.br.submit().read()
 
         # Right away, we can tell if the recipient doesn't exist and raise an exception
-        if re.search(r'Recipient not found', r):
+        if PAYMENT_RECIPIENT.classify(r).kind == NOT_FOUND:
             raise InvalidAccountException
 
         self.br.select_form(nr=0)
         self.br.new_control('text', 'pin', attrs={'value': self.pin})
-        r = self.br.submit().read()
+        outcome = PAYMENT.classify(self.br.submit().read())
 
         # We don't get to know if our pin was valid until this step
-        if re.search(r'Invalid PIN', r):
+        if outcome.kind == INVALID_PIN:
             raise AuthDeniedException
 
         # An error could occur for other reasons
-        if re.search(r'Error occured', r):
+        if outcome.kind == ERROR:
             raise RequestErrorException
 
-        # If it was successful, we extract the transaction id and return that
-        if re.search(r'Transaction id: (?P<txnid>\d+)', r):
-            match = re.search(r'Transaction id: (?P<txnid>\d+)', r)
-            return match.group('txnid')
+        # If it was successful, we return the transaction id
+        return outcome.value
 
     def get_balance(self):
         """
@@ -192,20 +390,18 @@ class pesaplyMM(object):
         self.br.follow_link(text='Balance Inquiry')
         self.br.select_form(nr=0)
         self.br['pin'] = self.pin
-        r = self.br.submit().read()
+        outcome = BALANCE.classify(self.br.submit().read())
 
         # Pin valid?
-        if re.search(r'Invalid PIN', r):
+        if outcome.kind == INVALID_PIN:
             raise AuthDeniedException
 
         # An error could occur for other reasons
-        if re.search(r'Error occured', r):
+        if outcome.kind == ERROR:
             raise RequestErrorException
 
-        # If it was successful, we extract the balance
-        if re.search(r'Your balance is TSH (?P<balance>[\d\.]+)', r):
-            match = re.search(r'Your balance is TSH (?P<balance>[\d\.]+)', r)
-            return match.group('balance')
+        # If it was successful, we return the balance
+        return outcome.value
 
     def _auth(self):
         _form = urllib.urlencode({'principal': self.account, 'password': self.pin})
@@ -216,8 +412,15 @@ class pesaplyMM(object):
         if self.br.geturl().startswith(self.ERROR_URL):
             raise AuthDeniedException
         else:
+            if self.session is not None:
+                self.session.authenticated(self.pool.ttl)
             return True
 
+    @classmethod
+    def login(cls, session):
+        """Logs a `sessions.Session` in to its account, for `sessions.SessionPool`"""
+        cls(session.account, session.pin, browser=session.browser)._auth()
+
     def get_url(self, url):
         """
         Internally used to retrieve the contents of a URL
@@ -250,29 +453,32 @@ class pesaplyMM(object):
         else:
             return _r.read()
 
+    def open_url(self, url, form):
+        """
+        Internally used to POST `form` to a URL without reading the response.
+        The response is returned unread and unbuffered so that large bodies
+        can be streamed; unlike `post_url` the browser's current page and
+        history are left untouched.
+        """
+        _r = self.br.open_novisit(url, form.click_request_data()[1])
+
+        # check that we've not been redirected to the login page or an error occured
+        if _r.geturl().startswith(self.AUTH_URL):
+            raise AuthRequiredException
+        elif _r.geturl().startswith(self.ERROR_URL):
+            raise RequestErrorException
+        else:
+            # mechanize keeps everything read through its own response
+            # wrapper in memory, so read from the wrapped response instead
+            return getattr(_r, 'wrapped', _r)
+
     def _parse_transactions(self, response):
         """
         This method parses the CSV output in `get_transactions`
         to generate a usable list of transactions that use native
         python data types
         """
-        transactions = list()
-
-        if response:
-            f = StringIO(response)
-            reader = csv.DictReader(f)
-
-            for line in reader:
-                txn = {}
-                txn['date'] = datetime.strptime(line['Date'], '%d/%m/%Y %H:%M:%S')
-                txn['description'] = line['Description']
-                txn['amount'] = float(line['Amount'].replace(',', ''))
-                txn['reference'] = line['Transaction number']
-                txn['sender'] = line['???transfer.fromOwner???']
-                txn['recipient'] = line['???transfer.toOwner???']
-                txn['currency'] = 'TSH'
-                txn['comment'] = line['Transaction type']
-
-                transactions.append(txn)
+        if not response:
+            return list()
 
-        return transactions
+        return [txn.as_dict() for txn in parse_transactions(StringIO(response))]
@@ -1,17 +1,49 @@
 import os 
 import sys
 import random
-from django.db import models
+import threading
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Count, F, Q, Sum
 from django.forms.models import model_to_dict
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
 import json
+import logging
 from .conf import settings
 from .cim import add_profile, get_profile, update_payment_profile, \
     create_payment_profile, delete_profile, delete_payment_profile
 
 from .managers import CustomerProfileManager
 from .exceptions import BillingError
+from .profilecache import ProfileCache
+from .webhooks import WebhookQueue
+
+log = logging.getLogger(__name__)
+
+# the fields of an incoming_message event that are queued
+WEBHOOK_FIELDS = ('event', 'id', 'content', 'from_number', 'to_number',
+                  'phone_id', 'time_created')
+
+AUTOREPLY = "Thanks for your message!"
+
+_webhook_queue = None
+_webhook_queue_lock = threading.Lock()
+
+
+def webhook_queue():
+    """The queue of webhook events, opened once per process"""
+    global _webhook_queue
+    with _webhook_queue_lock:
+        if _webhook_queue is None:
+            _webhook_queue = WebhookQueue(
+                getattr(settings, 'WEBHOOK_QUEUE_PATH', 'pesaply_webhook.db'))
+    return _webhook_queue
+
 
 @csrf_exempt
 def webhook(request):
@@ -21,17 +53,45 @@ def webhook(request):
         return HttpResponse("Invalid webhook secret", 'text/plain', 403)
     
     if request.POST.get('event') == 'incoming_message':
-        content = request.POST.get('content')
-        from_number = request.POST.get('from_number')
-        phone_id = request.POST.get('phone_id')
-        
-        # do something with the message, e.g. send an autoreply            
-        
-        return HttpResponse(json.dumps({
-            'messages': [
-                {'content': "Thanks for your message!"}
-            ]
-        }), 'application/json')
+        for field in ('from_number', 'phone_id'):
+            if not request.POST.get(field):
+                return HttpResponse("Missing %s" % field, 'text/plain', 400)
+
+        # handled by the consume_webhooks command (handle_incoming_messages)
+        webhook_queue().put(dict((k, request.POST.get(k)) for k in WEBHOOK_FIELDS))
+
+        if not getattr(settings, 'WEBHOOK_REPLY_SENDER', None):
+            # the consumers cannot send it, so the reply goes in the response
+            return HttpResponse(json.dumps({
+                'messages': [
+                    {'content': AUTOREPLY}
+                ]
+            }), 'application/json')
+
+    return HttpResponse(json.dumps({'messages': []}), 'application/json')
+
+
+def handle_incoming_messages(events, send=None):
+    """
+    Handle a batch of queued incoming_message events, sending the replies
+    together through `send`, a list of messages (dicts of phone_id,
+    to_number and content) -> None. Without `send` (no
+    settings.WEBHOOK_REPLY_SENDER) the webhook view has replied already.
+    Returns the events which could not be handled, as (index, exception)
+    pairs, for `webhooks.ConsumerPool` to retry.
+    """
+    replies, errors = [], []
+    for i, event in enumerate(events):
+        try:
+            # do something with the message, e.g. send an autoreply
+            replies.append({'phone_id': event['phone_id'],
+                            'to_number': event['from_number'],
+                            'content': AUTOREPLY})
+        except Exception as e:
+            errors.append((i, e))
+    if replies and send is not None:
+        send(replies)
+    return errors
 
 class Malipo(object):
 	"""docstring for Malipo"""
@@ -155,15 +215,144 @@ CIM_RESPONSE_CODE_CHOICES = (
 )
 
 
-class ResponseManager(models.Manager):
+def _chunks(iterable, size):
+    """Yields lists of up to `size` items of `iterable`"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Response fields holding money, stored as decimals
+MONEY_FIELDS = ('amount', 'tax', 'duty', 'freight')
+
+
+def _money(value):
+    """Converts an AIM amount such as '1,250.00' to a Decimal ('' to None)"""
+    if isinstance(value, basestring):
+        value = value.replace(',', '').strip()
+        if not value:
+            return None
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            raise ValueError('invalid amount %r' % value)
+    return value
+
+
+def _converted(rows, convert, errors):
+    """Yields `convert(row)` for each row, skipping (and noting) invalid ones"""
+    for index, row in enumerate(rows):
+        try:
+            yield convert(row)
+        except ValueError as e:
+            log.warning('response %d not inserted: %s', index, e)
+            if errors is not None:
+                errors.append((index, e))
+
+
+class ResponseQuerySet(models.QuerySet):
+    """
+    Aggregates computed by the database, which can follow any filter:
+     > Response.objects.filter(created__gte=since).approved().totals()
+    """
+
+    def approved(self):
+        return self.filter(response_code='1')
+
+    def totals(self):
+        """Returns the number of responses and the sums of their amounts"""
+        return self.aggregate(count=Count('id'), **self._sums())
+
+    def totals_by_response_code(self):
+        return self._grouped('response_code')
+
+    def totals_by_customer(self):
+        return self._grouped('cust_id')
+
+    def daily_totals(self):
+        """
+        Returns the totals per day of `created`, in day order. The day is
+        the date the database sees, i.e. in UTC when USE_TZ is on.
+        """
+        connection = connections[self.db]
+        column = '%s.%s' % (connection.ops.quote_name(self.model._meta.db_table),
+                            connection.ops.quote_name('created'))
+        return self._grouped('day', self.extra(
+            select={'day': connection.ops.date_trunc_sql('day', column)}))
+
+    def _grouped(self, key, queryset=None):
+        queryset = self if queryset is None else queryset
+        return queryset.order_by().values(key).annotate(
+            count=Count('id'), **self._sums()).order_by(key)
+
+    def _sums(self):
+        return dict((name, Sum(name)) for name in MONEY_FIELDS)
+
+
+class ResponseManager(models.Manager.from_queryset(ResponseQuerySet)):
+    # Response field names in the order of the fields of an AIM response
+    _field_names = None
+
+    def field_names(self):
+        if ResponseManager._field_names is None:
+            ResponseManager._field_names = tuple(
+                f.name for f in self.model._meta.fields[1:])
+        return ResponseManager._field_names
+
     def create_from_dict(self, params):
-        kwargs = dict(map(lambda x: (str(x[0][2:]), x[1]), params.items()))
-        return self.create(**kwargs)
+        return self.create(**self._dict_kwargs(params))
 
     def create_from_list(self, items):
-        kwargs = dict(zip(map(lambda x: x.name,
-                              Response._meta.fields)[1:], items))
-        return self.create(**kwargs)
+        return self.create(**self._list_kwargs(self.field_names(), items))
+
+    def bulk_create_from_lists(self, rows, batch_size=1000, errors=None):
+        """
+        Inserts a Response for each AIM response list in `rows`, e.g. a
+        csv.reader over a response log. `rows` is consumed `batch_size` rows
+        at a time and each batch is a single INSERT; all the batches are in
+        one transaction. A row with an invalid amount is logged and left
+        out instead of failing the whole import; (index, error) is appended
+        to `errors`, if given, for each. Returns the number of rows inserted.
+        """
+        names = self.field_names()
+        return self._bulk_create(
+            _converted(rows, lambda items: self._list_kwargs(names, items), errors),
+            batch_size)
+
+    def bulk_create_from_dicts(self, rows, batch_size=1000, errors=None):
+        """As `bulk_create_from_lists` for dicts like `create_from_dict`'s"""
+        return self._bulk_create(_converted(rows, self._dict_kwargs, errors), batch_size)
+
+    def _bulk_create(self, rows, batch_size):
+        # Django 1.9 lets an explicit batch_size exceed the number of query
+        # parameters the backend allows (999 on SQLite), so cap it
+        fields = [f for f in self.model._meta.concrete_fields
+                  if not isinstance(f, models.AutoField)]
+        insert_size = min(batch_size, max(
+            connections[self.db].ops.bulk_batch_size(fields, [None] * batch_size), 1))
+        count = 0
+        with transaction.atomic(using=self.db):
+            for chunk in _chunks(rows, batch_size):
+                self.bulk_create([self.model(**kwargs) for kwargs in chunk],
+                                 insert_size)
+                count += len(chunk)
+        return count
+
+    def _list_kwargs(self, names, items):
+        return self._money_kwargs(dict(zip(names, items)))
+
+    def _dict_kwargs(self, params):
+        # strip the x_ prefix of the AIM field names
+        return self._money_kwargs(dict((str(k[2:]), v) for k, v in params.items()))
+
+    def _money_kwargs(self, kwargs):
+        for name in MONEY_FIELDS:
+            if name in kwargs:
+                kwargs[name] = _money(kwargs[name])
+        return kwargs
 
 
 class Response(models.Model):
@@ -178,14 +367,15 @@ class Response(models.Model):
     avs_code = models.CharField(max_length=10,
                                 choices=AVS_RESPONSE_CODE_CHOICES)
     trans_id = models.CharField(max_length=255, db_index=True)
-    invoice_num = models.CharField(max_length=20, blank=True)
+    invoice_num = models.CharField(max_length=20, blank=True, db_index=True)
     description = models.CharField(max_length=255)
-    amount = models.CharField(max_length=16)
+    amount = models.DecimalField(max_digits=16, decimal_places=2,
+                                 null=True, blank=True)
     method = models.CharField(max_length=10, choices=METHOD_CHOICES)
     type = models.CharField(max_length=20,
                             choices=TYPE_CHOICES,
                             db_index=True)
-    cust_id = models.CharField(max_length=20)
+    cust_id = models.CharField(max_length=20, db_index=True)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     company = models.CharField(max_length=50)
@@ -205,9 +395,12 @@ class Response(models.Model):
     ship_to_state = models.CharField(max_length=40, blank=True)
     ship_to_zip = models.CharField(max_length=20, blank=True)
     ship_to_country = models.CharField(max_length=60, blank=True)
-    tax = models.CharField(max_length=16, blank=True)
-    duty = models.CharField(max_length=16, blank=True)
-    freight = models.CharField(max_length=16, blank=True)
+    tax = models.DecimalField(max_digits=16, decimal_places=2,
+                              null=True, blank=True)
+    duty = models.DecimalField(max_digits=16, decimal_places=2,
+                               null=True, blank=True)
+    freight = models.DecimalField(max_digits=16, decimal_places=2,
+                                  null=True, blank=True)
     tax_exempt = models.CharField(max_length=16, blank=True)
     po_num = models.CharField(max_length=25, blank=True)
     MD5_Hash = models.CharField(max_length=255)
@@ -226,6 +419,9 @@ class Response(models.Model):
 
     objects = ResponseManager()
 
+    class Meta:
+        index_together = [('response_code', 'created')]
+
     @property
     def is_approved(self):
         return self.response_code == '1'
@@ -255,6 +451,28 @@ class CIMResponse(models.Model):
             raise BillingError(self.result_text)
 
 
+# get_profile results, cached in process or in the Django cache named by
+# settings.CIM_PROFILE_CACHE
+profile_cache = ProfileCache(get_profile,
+                             getattr(settings, 'CIM_PROFILE_CACHE', None),
+                             getattr(settings, 'CIM_PROFILE_CACHE_TTL', 300))
+
+
+def _fetch_profile(profile_id):
+    """
+    Returns (output of get_profile, None) or (None, the exception raised),
+    closing the database connections the calling worker thread opened
+    """
+    try:
+        output, digest = profile_cache.refresh(profile_id)
+        output['response'].raise_if_error()
+        return output, None
+    except Exception as e:
+        return None, e
+    finally:
+        connections.close_all()
+
+
 class CustomerProfile(models.Model):
 
     """Authorize.NET customer profile"""
@@ -262,6 +480,8 @@ class CustomerProfile(models.Model):
     customer = models.OneToOneField(settings.CUSTOMER_MODEL,
                                     related_name='customer_profile')
     profile_id = models.CharField(max_length=50)
+    # digest of the remote profile last synced (see profilecache)
+    remote_digest = models.CharField(max_length=40, blank=True)
 
     def save(self, *args, **kwargs):
         """If creating new instance, create profile on Authorize.NET also"""
@@ -273,7 +493,10 @@ class CustomerProfile(models.Model):
 
     def delete(self):
         """Delete the customer profile remotely and locally"""
-        response = delete_profile(self.profile_id)
+        try:
+            response = delete_profile(self.profile_id)
+        finally:
+            profile_cache.invalidate(self.profile_id)
         response.raise_if_error()
         super(CustomerProfile, self).delete()
 
@@ -283,17 +506,106 @@ class CustomerProfile(models.Model):
         output['response'].raise_if_error()
         self.profile_id = output['profile_id']
         self.payment_profile_ids = output['payment_profile_ids']
+        profile_cache.invalidate(self.profile_id)
 
-    def sync(self):
-        """Overwrite local customer profile data with remote data"""
-        output = get_profile(self.profile_id)
+    def remote(self):
+        """Return the remote profile, from the cache if it is there"""
+        output, digest = profile_cache.get(self.profile_id)
         output['response'].raise_if_error()
+        return output
+
+    def sync(self, force=False):
+        """
+        Overwrite local customer profile data with remote data, unless the
+        remote profile is unchanged since the last sync. With `force` the
+        remote profile is fetched afresh and applied regardless.
+        """
+        if force:
+            output, digest = profile_cache.refresh(self.profile_id)
+        else:
+            output, digest = profile_cache.get(self.profile_id)
+        output['response'].raise_if_error()
+        if digest == self.remote_digest and not force:
+            return
+        existing = dict((p.payment_profile_id, p)
+                        for p in self.payment_profiles.all())
         for payment_profile in output['payment_profiles']:
-            instance, created = CustomerPaymentProfile.objects.get_or_create(
-                customer_profile=self,
-                payment_profile_id=payment_profile['payment_profile_id']
-            )
+            instance = existing.get(payment_profile['payment_profile_id'])
+            if instance is None:
+                # sync saves it without pushing it back
+                instance = CustomerPaymentProfile(
+                    customer_id=self.customer_id,
+                    customer_profile=self,
+                    payment_profile_id=payment_profile['payment_profile_id'])
             instance.sync(payment_profile)
+        self.remote_digest = digest
+        self.save(sync=False, update_fields=['remote_digest'])
+
+    @classmethod
+    def bulk_sync(cls, profiles=None, batch_size=500, workers=8):
+        """
+        Overwrite the local payment profiles of many customer profiles
+        (all of them by default) with remote data, `batch_size` customer
+        profiles at a time: the remote profiles of a batch are fetched
+        `workers` at a time, its local payment profiles are read with one
+        query and the changes are written with bulk queries in a
+        transaction. A customer profile whose remote profile cannot be
+        fetched is skipped. Returns a dict of counts and the failures as
+        (customer profile, exception) pairs.
+        """
+        if profiles is None:
+            profiles = cls.objects.order_by('pk')
+        if isinstance(profiles, models.QuerySet):
+            profiles = profiles.iterator()
+        result = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': []}
+        pool = ThreadPool(workers)
+        try:
+            for batch in _chunks(profiles, batch_size):
+                cls._bulk_sync_batch(batch, pool, result)
+        finally:
+            pool.terminate()
+        return result
+
+    @classmethod
+    def _bulk_sync_batch(cls, batch, pool, result):
+        remote = pool.map(_fetch_profile, [profile.profile_id for profile in batch])
+        existing = dict(
+            ((p.customer_profile_id, p.payment_profile_id), p)
+            for p in CustomerPaymentProfile.objects.filter(customer_profile__in=batch))
+
+        created, updated, fields = [], [], set()
+        for profile, (output, error) in zip(batch, remote):
+            if error is not None:
+                result['failed'].append((profile, error))
+                continue
+            for data in output['payment_profiles']:
+                key = (profile.pk, data['payment_profile_id'])
+                instance = existing.get(key)
+                if instance is None:
+                    instance = CustomerPaymentProfile(
+                        customer_id=profile.customer_id,
+                        customer_profile=profile,
+                        payment_profile_id=data['payment_profile_id'])
+                    instance.apply_remote(data)
+                    created.append(instance)
+                    continue
+                changed = instance.apply_remote(data)
+                if changed:
+                    fields.update(changed)
+                    updated.append(instance)
+                else:
+                    result['unchanged'] += 1
+
+        with transaction.atomic():
+            CustomerPaymentProfile.objects.bulk_create(created)
+            if hasattr(models.QuerySet, 'bulk_update'):
+                CustomerPaymentProfile.objects.bulk_update(updated, fields)
+            else:
+                # no bulk_update before Django 2.2; one transaction at least
+                for instance in updated:
+                    instance.save(sync=False, update_fields=fields)
+        result['created'] += len(created)
+        result['updated'] += len(updated)
 
     objects = CustomerProfileManager()
 
@@ -322,6 +634,9 @@ class CustomerPaymentProfile(models.Model):
     country = models.CharField(max_length=60, blank=True)
     card_number = models.CharField(max_length=16, blank=True)
     expiration_date = models.DateField(blank=True, null=True)
+    # a create was sent to Authorize.NET but its payment profile id was
+    # not saved: the row is left for reconciliation rather than pushed again
+    create_pending = models.BooleanField(default=False)
     card_code = None
 
     def __init__(self, *args, **kwargs):
@@ -329,13 +644,45 @@ class CustomerPaymentProfile(models.Model):
         return super(CustomerPaymentProfile, self).__init__(*args, **kwargs)
 
     def save(self, *args, **kwargs):
-        """Sync payment profile on Authorize.NET if sync kwarg is not False"""
-        if kwargs.pop('sync', True):
+        """
+        Sync payment profile on Authorize.NET if sync kwarg is not False.
+        With settings.PAYMENT_PROFILE_OUTBOX on, the sync of a payment
+        profile already on Authorize.NET is queued in the
+        `PaymentProfileOutbox` instead, unless it carries a new card: card
+        data is never stored, so a new card is pushed right away.
+        """
+        sync = kwargs.pop('sync', True)
+        if sync and getattr(settings, 'PAYMENT_PROFILE_OUTBOX', False) \
+                and self.payment_profile_id and not self.has_card_data() \
+                and self._find_customer_profile():
+            with transaction.atomic():
+                self._save_masked(*args, **kwargs)
+                PaymentProfileOutbox.objects.enqueue(self)
+            return
+        if sync:
             self.push_to_server()
+        self._save_masked(*args, **kwargs)
+
+    def _save_masked(self, *args, **kwargs):
         self.card_code = None
         self.card_number = "XXXX%s" % self.card_number[-4:]
         super(CustomerPaymentProfile, self).save(*args, **kwargs)
 
+    def _find_customer_profile(self):
+        """Use the customer's profile if none is set; is there one now?"""
+        if not self.customer_profile_id:
+            try:
+                self.customer_profile = CustomerProfile.objects.get(
+                    customer=self.customer)
+            except CustomerProfile.DoesNotExist:
+                pass
+        return bool(self.customer_profile_id)
+
+    def has_card_data(self):
+        """Is there a card number or code to send, as opposed to a masked card?"""
+        return bool(self.card_code or
+                    (self.card_number and not self.card_number.startswith('XXXX')))
+
     def push_to_server(self):
         """
         Use appropriate CIM API call to save payment profile to Authorize.NET
@@ -343,12 +690,14 @@ class CustomerPaymentProfile(models.Model):
         2. If payment profile is not on Authorize.NET yet, create it there
         3. If payment profile exists on Authorize.NET update it there
         """
-        if not self.customer_profile_id:
-            try:
-                self.customer_profile = CustomerProfile.objects.get(
-                    customer=self.customer)
-            except CustomerProfile.DoesNotExist:
-                pass
+        self._find_customer_profile()
+        try:
+            self._push_to_server()
+        finally:
+            if self.customer_profile_id:
+                profile_cache.invalidate(self.customer_profile.profile_id)
+
+    def _push_to_server(self):
         if self.payment_profile_id:
             response = update_payment_profile(
                 self.customer_profile.profile_id,
@@ -358,14 +707,7 @@ class CustomerPaymentProfile(models.Model):
             )
             response.raise_if_error()
         elif self.customer_profile_id:
-            output = create_payment_profile(
-                self.customer_profile.profile_id,
-                self.raw_data,
-                self.raw_data,
-            )
-            response = output['response']
-            response.raise_if_error()
-            self.payment_profile_id = output['payment_profile_id']
+            self._create_payment_profile()
         else:
             output = add_profile(
                 self.customer.id,
@@ -381,6 +723,42 @@ class CustomerPaymentProfile(models.Model):
             )
             self.payment_profile_id = output['payment_profile_ids'][0]
 
+    def _create_payment_profile(self):
+        """
+        Create the payment profile on Authorize.NET. The row is saved first
+        with `create_pending` set, which is cleared with the payment profile
+        id: if that save is lost, the row is not created again but stays
+        flagged, as the card may be on Authorize.NET already.
+        """
+        if self.create_pending:
+            raise BillingError("Payment profile %s may be on Authorize.NET "
+                               "already, reconcile it first" % self.pk)
+        card_number, card_code = self.card_number, self.card_code
+        inserted = self.pk is None
+        self.create_pending = True
+        self._save_masked()
+        self.card_number, self.card_code = card_number, card_code
+
+        output = create_payment_profile(
+            self.customer_profile.profile_id,
+            self.raw_data,
+            self.raw_data,
+        )
+        try:
+            output['response'].raise_if_error()
+        except Exception:
+            # refused, so there is nothing to reconcile
+            saved = CustomerPaymentProfile.objects.filter(pk=self.pk)
+            if inserted:
+                saved.delete()
+                self.pk = None
+            else:
+                saved.update(create_pending=False)
+            self.create_pending = False
+            raise
+        self.payment_profile_id = output['payment_profile_id']
+        self.create_pending = False
+
     @property
     def raw_data(self):
         """Return data suitable for use in payment and billing forms"""
@@ -390,16 +768,33 @@ class CustomerPaymentProfile(models.Model):
 
     def sync(self, data):
         """Overwrite local customer payment profile data with remote data"""
-        for k, v in data.get('billing', {}).items():
-            setattr(self, k, v)
-        self.card_number = data.get('credit_card', {}).get('card_number',
-                                                           self.card_number)
+        self.apply_remote(data)
         self.save(sync=False)
 
+    def apply_remote(self, data):
+        """
+        Set the fields from remote payment profile `data` without saving,
+        masking the card number as `save` does. Returns the names of the
+        fields that changed.
+        """
+        values = dict(data.get('billing', {}))
+        values['card_number'] = data.get('credit_card', {}).get(
+            'card_number', self.card_number)
+        values['card_number'] = "XXXX%s" % values['card_number'][-4:]
+        changed = []
+        for k, v in values.items():
+            if getattr(self, k, None) != v:
+                setattr(self, k, v)
+                changed.append(k)
+        return changed
+
     def delete(self):
         """Delete the customer payment profile remotely and locally"""
-        response = delete_payment_profile(self.customer_profile.profile_id,
-                                          self.payment_profile_id)
+        try:
+            response = delete_payment_profile(self.customer_profile.profile_id,
+                                              self.payment_profile_id)
+        finally:
+            profile_cache.invalidate(self.customer_profile.profile_id)
         response.raise_if_error()
         return super(CustomerPaymentProfile, self).delete()
 
@@ -408,7 +803,146 @@ class CustomerPaymentProfile(models.Model):
         for key, value in data.items():
             setattr(self, key, value)
         self.save()
+        if self.customer_profile_id:
+            profile_cache.invalidate(self.customer_profile.profile_id)
         return self
 
     def __unicode__(self):
-return self.payment_profile_id
+        return self.payment_profile_id
+
+
+class PaymentProfileOutboxManager(models.Manager):
+
+    def enqueue(self, payment_profile):
+        """
+        Queue a push of `payment_profile`, or bring forward the push
+        already queued for it but not done yet
+        """
+        try:
+            with transaction.atomic():
+                self._enqueue(payment_profile)
+        except IntegrityError:
+            # queued concurrently, so there is an entry to update now
+            with transaction.atomic():
+                self._enqueue(payment_profile)
+
+    def _enqueue(self, payment_profile):
+        try:
+            entry = self.select_for_update().get(payment_profile=payment_profile)
+        except self.model.DoesNotExist:
+            entry = self.model(payment_profile=payment_profile, version=0)
+        entry.version += 1
+        entry.attempts = 0
+        entry.next_attempt_at = timezone.now()
+        entry.last_error = ''
+        entry.save()
+
+    def drain(self, limit=100, lease=300, max_attempts=10):
+        """
+        Push up to `limit` due payment profiles to Authorize.NET. An entry
+        is claimed for `lease` seconds, so several workers can drain the
+        outbox at once. A failed push is retried with exponential back-off
+        until it has failed `max_attempts` times; it is then parked with
+        no next attempt until it is queued again. Returns the numbers of
+        entries pushed and failed.
+        """
+        now = timezone.now()
+        due = self.filter(next_attempt_at__lte=now).filter(
+            Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+        pushed = failed = 0
+        for entry in due.order_by('next_attempt_at')[:limit]:
+            claimed = self.filter(pk=entry.pk).filter(
+                Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)).update(
+                claimed_until=now + timedelta(seconds=lease))
+            if not claimed:
+                continue
+            try:
+                entry.push()
+            except Exception as e:
+                failed += 1
+                entry.failed(e, max_attempts)
+            else:
+                pushed += 1
+                entry.done()
+        return pushed, failed
+
+
+class PaymentProfileOutbox(models.Model):
+
+    """
+    A CustomerPaymentProfile change waiting to be pushed to Authorize.NET.
+    There is at most one entry per payment profile, and a push sends the
+    payment profile as it is saved then, so repeated updates are pushed
+    once. Only payment profiles already on Authorize.NET are queued, with
+    the card masked: a push updates them and is safe to repeat.
+    """
+
+    payment_profile = models.OneToOneField(CustomerPaymentProfile,
+                                           related_name='outbox')
+    # bumped by every save, so a push can tell it was overtaken
+    version = models.PositiveIntegerField(default=1)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, db_index=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = PaymentProfileOutboxManager()
+
+    def push(self):
+        """Push the payment profile as it is saved now"""
+        self.payment_profile.push_to_server()
+
+    def done(self):
+        """Remove the entry, unless it was queued again meanwhile"""
+        outbox = PaymentProfileOutbox.objects.filter(pk=self.pk)
+        if not outbox.filter(version=self.version).delete()[0]:
+            outbox.update(claimed_until=None)
+
+    def failed(self, error, max_attempts):
+        outbox = PaymentProfileOutbox.objects.filter(pk=self.pk)
+        if outbox.filter(version=self.version).update(
+                attempts=F('attempts') + 1,
+                next_attempt_at=self._retry_at(max_attempts),
+                claimed_until=None,
+                last_error=repr(error)):
+            return
+        # queued again meanwhile, so push the new payload right away
+        outbox.update(claimed_until=None, last_error=repr(error))
+
+    def _retry_at(self, max_attempts):
+        attempts = self.attempts + 1
+        if attempts >= max_attempts:
+            return None
+        return timezone.now() + timedelta(seconds=min(60 * 2 ** (attempts - 1), 3600))
+
+    def __unicode__(self):
+        return u"%s (%s attempts)" % (self.payment_profile_id, self.attempts)
+
+
+class SyncWatermark(models.Model):
+
+    """The newest transaction `sync.TransactionSync` returned for an account"""
+
+    account = models.CharField(max_length=32, primary_key=True)
+    last_date = models.DateTimeField()
+    last_reference = models.CharField(max_length=64)
+
+    def __unicode__(self):
+        return u"%s: %s %s" % (self.account, self.last_date, self.last_reference)
+
+
+class SyncSeenTransaction(models.Model):
+
+    """A transaction returned by a sync, kept while it is in the overlap window"""
+
+    account = models.CharField(max_length=32)
+    reference = models.CharField(max_length=64)
+    date = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('account', 'reference')]
+        index_together = [('account', 'date')]
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.account, self.reference)
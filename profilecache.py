@@ -0,0 +1,116 @@
+"""
+profilecache
+~~~~~~~~~~~~~~~~~~~~
+Read-through cache of CIM `get_profile` results.
+ > cache = ProfileCache(get_profile, ttl=300)            # in-process LRU
+ > cache = ProfileCache(get_profile, backend='default')  # a Django cache
+ > output, digest = cache.get(profile_id)
+Only successful results are cached. Each is kept with a digest of the
+profile data, which changes when (and only when) the profile changed
+remotely, so a caller that saved the digest it last acted on can tell
+whether there is anything new.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+
+
+class LocMemBackend(object):
+    """In-process LRU of the `maxsize` most recently used profiles"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                return None
+            # re-insert to mark it most recently used
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DjangoCacheBackend(object):
+    """Profiles in a Django cache (e.g. memcached), shared by processes"""
+
+    def __init__(self, alias='default', prefix='cim-profile:'):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(self.prefix + key, value, ttl)
+
+    def delete(self, key):
+        self.cache.delete(self.prefix + key)
+
+
+def profile_digest(output):
+    """Returns a hex digest of the profile data of a `get_profile` output"""
+    data = dict((k, v) for k, v in output.items() if k != 'response')
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str)).hexdigest()
+
+
+class ProfileCache(object):
+    """
+    Caches the results of `fetch` (i.e. `get_profile`) for `ttl` seconds.
+    backend: a backend object, the alias of a Django cache or None for a
+    `LocMemBackend`
+    """
+
+    def __init__(self, fetch, backend=None, ttl=300):
+        if backend is None:
+            backend = LocMemBackend()
+        elif isinstance(backend, basestring):
+            backend = DjangoCacheBackend(backend)
+        self.fetch = fetch
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, profile_id):
+        """
+        Returns the output of `get_profile` and its digest, from the cache
+        if it is there. The digest is None for an unsuccessful response.
+        """
+        entry = self.backend.get(str(profile_id))
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return self.refresh(profile_id)
+
+    def refresh(self, profile_id):
+        """As `get`, but always asks the server"""
+        output = self.fetch(profile_id)
+        if not output['response'].success:
+            return output, None
+        entry = (output, profile_digest(output))
+        self.backend.set(str(profile_id), entry, self.ttl)
+        return entry
+
+    def invalidate(self, profile_id):
+        self.backend.delete(str(profile_id))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,343 @@
+"""
+responsebuffer
+~~~~~~~~~~~~~~~~~~~~
+Write-behind buffer for transaction responses: instead of one INSERT (and
+one fsync) per checkout callback, responses are collected and inserted
+together in one transaction every `max_rows` rows or `max_delay` seconds.
+ > buf = ResponseBuffer(Response, 'var/responses')
+ > buf.add(gateway.parse_response(request.POST))  # durable when it returns
+ > buf.metrics()
+ > buf.close()
+Every response is first appended to a journal segment and synced to disk,
+with concurrent adds sharing one fsync (group commit); a segment is
+removed once its rows are committed. Segments left by a crash are
+replayed when the next buffer starts. A segment which fails to commit is
+retried with back-off while the later ones are flushed; after
+`max_attempts` its rows are inserted one by one, and those which still
+fail are set aside in a '.dead' file next to it (renamed to '.journal',
+it is replayed at the next start).
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction
+
+from .gateway import sarafuResponse
+
+log = logging.getLogger(__name__)
+
+# sarafuResponse attribute -> Response field
+SARAFU_FIELDS = (
+    ('order_id', 'invoice_num'),
+    ('response_code', 'response_code'),
+    ('reason_code', 'response_reason_code'),
+    ('reason_desc', 'response_reason_text'),
+    ('refno', 'trans_id'),
+    ('auth_code', 'auth_code'),
+)
+
+
+def sarafu_response_kwargs(response):
+    """Maps a checkout `sarafuResponse` to `Response` field values"""
+    return dict((field, getattr(response, attr, None) or '')
+                for attr, field in SARAFU_FIELDS)
+
+
+class Segment(object):
+    """A closed journal segment whose rows are not committed yet"""
+    __slots__ = ('path', 'rows', 'replayed', 'attempts', 'retry_at')
+
+    def __init__(self, path, rows, replayed=False):
+        self.path = path
+        self.rows = rows
+        # left by a previous run, so some rows may be in the database
+        self.replayed = replayed
+        self.attempts = 0
+        self.retry_at = 0
+
+
+class ResponseBuffer(object):
+    """
+    Buffers rows of `model` (the `Response` model) for bulk insertion.
+    journal_dir: directory of the journal segments, one buffer per directory
+    max_rows, max_delay: a flush happens when either is reached
+    max_attempts: failed flushes of a segment before its rows are
+    inserted one by one and those which fail are set aside
+    Note that `created` is set when the rows are inserted.
+    """
+
+    def __init__(self, model, journal_dir, max_rows=500, max_delay=0.2, using=None,
+                 max_attempts=10):
+        self.model = model
+        self.journal_dir = journal_dir
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.using = using
+        self.max_attempts = max_attempts
+        self._fields = [f.attname for f in model._meta.concrete_fields
+                        if not isinstance(f, models.AutoField)]
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._rows = []
+        self._written = 0
+        self._synced = 0
+        # closed segments not yet committed, oldest first
+        self._pending = []
+        self._closing = False
+
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.flush_errors = 0
+        self.dead_rows = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = 0.0
+        self._flush_ms_total = 0.0
+
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        self._seq = 0
+        self.replayed = self._replay()
+        self._segment = self._open_segment()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, response):
+        """
+        Buffers `response`: a `sarafuResponse`, a `model` instance or a
+        dict of field values. Returns once it is in the journal on disk.
+        Raises django's ValidationError if a value does not fit its field.
+        """
+        kwargs = self._kwargs(response)
+        line = json.dumps(kwargs, cls=DjangoJSONEncoder) + '\n'
+        with self._lock:
+            if self._closing:
+                raise ValueError('add to a closed ResponseBuffer')
+            self._segment.write(line)
+            self._written += 1
+            seq = self._written
+            self._rows.append(kwargs)
+            if len(self._rows) >= self.max_rows:
+                self._wake.notify()
+        self._sync(seq)
+
+    def metrics(self):
+        """Returns the queue depth (rows not yet committed) and flush figures"""
+        with self._lock:
+            depth = len(self._rows) + sum(len(segment.rows) for segment in self._pending)
+            return {'depth': depth,
+                    'segments': len(self._pending) + 1,
+                    'flushes': self.flushes,
+                    'rows_flushed': self.rows_flushed,
+                    'flush_errors': self.flush_errors,
+                    'dead_rows': self.dead_rows,
+                    'last_flush_ms': self.last_flush_ms,
+                    'max_flush_ms': self.max_flush_ms,
+                    'avg_flush_ms': self.flushes and self._flush_ms_total / self.flushes or None}
+
+    def flush(self):
+        """Commits everything buffered so far, retrying failed segments now"""
+        with self._sync_lock:
+            with self._lock:
+                self._rotate()
+        self._flush_pending(retry=True)
+
+    def close(self):
+        """Flushes and stops the buffer"""
+        with self._lock:
+            self._closing = True
+            self._wake.notify()
+        self._thread.join()
+
+    def _kwargs(self, response):
+        if isinstance(response, sarafuResponse):
+            values = sarafu_response_kwargs(response)
+        elif isinstance(response, models.Model):
+            values = dict((name, getattr(response, name)) for name in self._fields)
+        else:
+            values = response
+        # a value the database would refuse must not reach the journal,
+        # where it would fail the flush of its segment, so check them now
+        meta = self.model._meta
+        kwargs = {}
+        for name, value in values.items():
+            field = meta.get_field(name)
+            value = field.to_python(value)
+            field.run_validators(value)
+            kwargs[name] = value
+        return kwargs
+
+    def _sync(self, seq):
+        # group commit: the first thread in fsyncs the lines of all others
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._lock:
+                segment, written = self._segment, self._written
+                segment.flush()
+            os.fsync(segment.fileno())
+            self._synced = max(self._synced, written)
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._closing and len(self._rows) < self.max_rows:
+                        self._wake.wait(self.max_delay)
+                    closing = self._closing
+                with self._sync_lock:
+                    with self._lock:
+                        self._rotate()
+                self._flush_pending()
+                if closing:
+                    with self._lock:
+                        self._segment.close()
+                        os.remove(self._segment.name)
+                    return
+        finally:
+            connections.close_all()
+
+    def _rotate(self):
+        """
+        Closes the segment of the buffered rows. The caller holds both
+        locks, always taking _sync_lock first.
+        """
+        if not self._rows:
+            return
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        self._synced = self._written
+        self._segment.close()
+        self._pending.append(Segment(self._segment.name, self._rows))
+        self._rows = []
+        self._segment = self._open_segment()
+
+    def _flush_pending(self, retry=False):
+        """
+        Commits the pending segments, each in a transaction, but those
+        waiting to be retried (unless `retry`)
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = list(self._pending)
+            for segment in pending:
+                if segment.retry_at > time.time() and not retry:
+                    continue
+                start = time.time()
+                try:
+                    rows = segment.rows
+                    if segment.replayed:
+                        rows = self._not_inserted(rows)
+                    self._insert(rows)
+                except Exception:
+                    self.flush_errors += 1
+                    segment.attempts += 1
+                    log.exception('flushing %d responses failed (attempt %d)',
+                                  len(segment.rows), segment.attempts)
+                    if segment.attempts < self.max_attempts:
+                        segment.retry_at = time.time() + min(
+                            self.max_delay * 2 ** segment.attempts, 60)
+                        continue
+                    rows, dead = self._set_aside(segment)
+                else:
+                    dead = 0
+                os.remove(segment.path)
+                elapsed = (time.time() - start) * 1000
+                with self._lock:
+                    self._pending.remove(segment)
+                    self.flushes += 1
+                    self.rows_flushed += len(rows)
+                    self.dead_rows += dead
+                    self.last_flush_ms = elapsed
+                    self.max_flush_ms = max(self.max_flush_ms, elapsed)
+                    self._flush_ms_total += elapsed
+
+    def _set_aside(self, segment):
+        """
+        Inserts the rows of a segment which keeps failing one by one, and
+        writes those which fail to its dead-letter file. Returns the rows
+        inserted and the number set aside.
+        """
+        rows = segment.rows
+        if segment.replayed:
+            try:
+                rows = self._not_inserted(rows)
+            except Exception:
+                log.exception('checking %d replayed responses failed', len(rows))
+        inserted, dead = [], []
+        for row in rows:
+            try:
+                self._insert([row])
+            except Exception as e:
+                log.error('response %r set aside: %r', row, e)
+                dead.append(row)
+            else:
+                inserted.append(row)
+        if dead:
+            path = segment.path[:-len('.journal')] + '.dead'
+            with open(path, 'ab') as f:
+                for row in dead:
+                    f.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        return inserted, len(dead)
+
+    def _insert(self, rows):
+        manager = self.model.objects.db_manager(self.using)
+        with transaction.atomic(using=manager.db):
+            manager.bulk_create([self.model(**kwargs) for kwargs in rows])
+
+    def _replay(self):
+        """
+        Queues the rows of the segments left by a previous run, to be
+        flushed like the others, and returns their number
+        """
+        replayed = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith(('.journal', '.dead')):
+                continue
+            # new segments must not reuse the number of a dead-letter file
+            self._seq = max(self._seq, int(name.split('.')[0]))
+            if name.endswith('.dead'):
+                continue
+            path = os.path.join(self.journal_dir, name)
+            rows = []
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        # a torn final line: that add never returned
+                        continue
+            self._pending.append(Segment(path, rows, replayed=True))
+            replayed += len(rows)
+        return replayed
+
+    def _not_inserted(self, rows):
+        """
+        Drops the rows already in the database: a crash can come between
+        the commit of a segment and its removal. Rows without a trans_id
+        cannot be told apart, so they are inserted again.
+        """
+        ids = set(row['trans_id'] for row in rows if row.get('trans_id'))
+        if not ids:
+            return rows
+        existing = set()
+        manager = self.model.objects.db_manager(self.using)
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            existing.update(manager.filter(trans_id__in=ids[i:i + 500])
+                            .values_list('trans_id', flat=True))
+        return [row for row in rows if not row.get('trans_id') or row['trans_id'] not in existing]
+
+    def _open_segment(self):
+        self._seq += 1
+        return open(os.path.join(self.journal_dir, '%012d.journal' % self._seq), 'ab')
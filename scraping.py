@@ -0,0 +1,62 @@
+"""
+scraping
+~~~~~~~~~~~~~~~~~~~~
+Classification of the pages returned by the pesaply Mobile Money mobile
+web application into typed outcomes:
+ > outcome = BALANCE.classify(body)
+ > if outcome.kind == OK:
+ >     print outcome.value
+The error messages are fixed strings and are looked for with substring
+search, which is several times faster than a regular expression (or one
+alternation of all of them) over the same page. Only the value is
+matched with a precompiled pattern, once.
+"""
+from collections import namedtuple
+import re
+
+OK = 'ok'
+INVALID_PIN = 'invalid_pin'
+ERROR = 'error'
+NOT_FOUND = 'not_found'
+UNKNOWN = 'unknown'
+
+Outcome = namedtuple('Outcome', 'kind value')
+
+MESSAGES = {
+    NOT_FOUND: 'Recipient not found',
+    INVALID_PIN: 'Invalid PIN',
+    ERROR: 'Error occured',
+}
+
+
+class ResponseClassifier(object):
+    """
+    Classifies a page as the first of `kinds` whose message it contains,
+    which is the order the pages have always been checked in, or else as
+    OK if it matches `value`, a pattern with a `value` group whose text
+    becomes the outcome value. Pages matching nothing are UNKNOWN.
+    """
+
+    def __init__(self, value=None, kinds=(INVALID_PIN, ERROR)):
+        self.messages = tuple((MESSAGES[kind], Outcome(kind, None)) for kind in kinds)
+        self.value = value is not None and re.compile(value) or None
+
+    def classify(self, body):
+        for message, outcome in self.messages:
+            if message in body:
+                return outcome
+        if self.value is not None:
+            match = self.value.search(body)
+            if match is not None:
+                return Outcome(OK, match.group('value'))
+        return _UNKNOWN
+
+
+_UNKNOWN = Outcome(UNKNOWN, None)
+
+# the page after submitting the recipient of a payment
+PAYMENT_RECIPIENT = ResponseClassifier(kinds=(NOT_FOUND,))
+# the page after confirming a payment with the pin
+PAYMENT = ResponseClassifier(r'Transaction id: (?P<value>\d+)')
+# the page after a balance inquiry
+BALANCE = ResponseClassifier(r'Your balance is TSH (?P<value>[\d\.]+)')
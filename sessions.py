@@ -0,0 +1,136 @@
+"""
+sessions
+~~~~~~~~~~~~~~~~~~~~
+A pool of logged in pesaply Mobile Money browser sessions.
+Logging in costs a full round trip, so instead of each `pesaplyMM` logging
+in with a fresh browser the pool keeps authenticated cookie jars warm per
+account and hands them out to whichever thread needs one:
+ > pool = SessionPool(pesaplyMM.login)
+ > with pesaplyMM('2550000000', '0000', pool=pool) as mm:
+ >     mm.get_transactions()
+Sessions are logged in again shortly before the server would expire them.
+"""
+import threading
+import time
+
+import mechanize
+
+
+class Session(object):
+    """
+    An authenticated browser for one account together with the account
+    history form parsed through it
+    """
+
+    def __init__(self, account, pin, browser=None):
+        self.account = account
+        self.pin = pin
+        self.browser = browser or mechanize.Browser()
+        self.browser.set_handle_robots(False)
+        self.transactions_form = None
+        self.authenticated_at = None
+        self.expires_at = 0
+
+    def authenticated(self, ttl):
+        self.authenticated_at = time.time()
+        self.touch(ttl)
+
+    def touch(self, ttl):
+        """The server's idle timeout starts again on every request"""
+        self.expires_at = time.time() + ttl
+
+
+class SessionPool(object):
+    """
+    Thread-safe pool of `Session` objects keyed by account.
+    login: called as `login(session)` to log the browser of a session in
+    to its account, e.g. `pesaplyMM.login`
+    ttl: seconds of inactivity after which the server drops a session
+    refresh_margin: sessions this close to expiring are logged in again
+    before being handed out
+    max_idle: how many idle sessions to keep per account
+    """
+
+    def __init__(self, login, ttl=15 * 60, refresh_margin=60, max_idle=4):
+        self.login = login
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, account, pin):
+        """
+        Returns a logged in session for exclusive use by the caller, who
+        must give it back with `release`
+        """
+        with self._lock:
+            idle = self._idle.get(account, [])
+            session = None
+            while idle:
+                session = idle.pop()
+                if session.pin == pin:
+                    break
+                session = None
+
+        if session is None:
+            session = Session(account, pin)
+        if self._expiring(session):
+            self._login(session)
+        return session
+
+    def release(self, session):
+        session.touch(self.ttl)
+        with self._lock:
+            idle = self._idle.setdefault(session.account, [])
+            if len(idle) < self.max_idle:
+                idle.append(session)
+
+    def discard(self, session):
+        """Forgets a session that is in an unknown state, e.g. after an error"""
+        with self._lock:
+            idle = self._idle.get(session.account, [])
+            if session in idle:
+                idle.remove(session)
+
+    def refresh_expiring(self):
+        """
+        Logs in again every idle session that is about to expire, so that
+        the next `acquire` does not have to. Returns the number refreshed.
+        """
+        with self._lock:
+            expiring = []
+            for account, idle in self._idle.items():
+                # decided once per session, so none is dropped between two checks
+                flagged = [(s, self._expiring(s)) for s in idle]
+                expiring.extend(s for s, due in flagged if due)
+                idle[:] = [s for s, due in flagged if not due]
+
+        refreshed = 0
+        for session in expiring:
+            try:
+                self._login(session)
+            except Exception:
+                continue
+            self.release(session)
+            refreshed += 1
+        return refreshed
+
+    def start_refresher(self, interval=30):
+        """Runs `refresh_expiring` every `interval` seconds on a daemon thread"""
+        def run():
+            while True:
+                time.sleep(interval)
+                self.refresh_expiring()
+
+        thread = threading.Thread(target=run, name='pesaply-session-refresher')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _login(self, session):
+        self.login(session)
+        session.authenticated(self.ttl)
+
+    def _expiring(self, session):
+        return session.expires_at - self.refresh_margin <= time.time()
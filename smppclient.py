@@ -0,0 +1,429 @@
+"""
+smppclient
+~~~~~~~~~~~~~~~~~~~~
+asyncio SMPP client for sending payment receipts by SMS. Up to `window`
+submit_sm are outstanding at once, matched to their responses by sequence
+number, rather than each waiting for the response to the one before.
+Requires Python 3.5+.
+ > client = SMPPClient('smsc.example.com', 2775, 'sarafu', 'secret',
+ >                     source_addr='SARAFU', on_receipt=receipt_received)
+ > await client.start()
+ > message_id = await client.submit(order_id, '255700000000', b'Payment received')
+ > message_ids = await client.submit_message(order_id, '255700000000', u'Malipo yamepokelewa')
+ > await client.close()
+The session is kept alive with enquire_link and bound again whenever the
+connection is lost. A submit_sm sent but left unanswered (the connection
+was lost or the response timed out) may or may not have been accepted by
+the SMSC: its error is `unanswered`, and it is kept in `unacknowledged` to
+be reconciled, rather than sent again blindly. Bound as a transceiver, the client passes the delivery
+receipts the SMSC sends back to `on_receipt` as `DeliveryReceipt`s, with
+the order id of the submit they are for.
+"""
+import asyncio
+from collections import OrderedDict, deque, namedtuple
+import logging
+import re
+
+from .pducodec import (ENQUIRE_LINK, DELIVER_SM, ESME_RINVCMDID, ESME_RMSGQFUL, ESME_ROK,
+                       ESME_RTHROTTLED, GENERIC_NACK, SUBMIT_SM_RESP, TAG_MESSAGE_STATE,
+                       TAG_RECEIPTED_MESSAGE_ID, UNBIND, BindTransceiver, BindTransmitter,
+                       EnquireLink, GenericNack, PDUEncoder, PDUReader, SubmitSM, Unbind)
+from .smsencoding import Message, encode_message
+
+log = logging.getLogger(__name__)
+
+TRANSMITTER = 'transmitter'
+TRANSCEIVER = 'transceiver'
+BIND_CLASSES = {TRANSMITTER: BindTransmitter, TRANSCEIVER: BindTransceiver}
+
+# esm_class of a deliver_sm carrying a delivery receipt
+ESM_DELIVERY_RECEIPT = 0x04
+
+# message_state values, as in the stat: field of receipt texts
+MESSAGE_STATES = {1: 'ENROUTE', 2: 'DELIVRD', 3: 'EXPIRED', 4: 'DELETED',
+                  5: 'UNDELIV', 6: 'ACCEPTD', 7: 'UNKNOWN', 8: 'REJECTD'}
+INTERMEDIATE_STATES = ('ENROUTE', 'ACCEPTD')
+
+RECEIPT_RE = re.compile(br'id:(?P<id>\S+).*?stat:(?P<stat>\w+)(?:.*?err:(?P<err>\w+))?',
+                        re.S | re.I)
+
+DeliveryReceipt = namedtuple('DeliveryReceipt', 'order_id message_id state error text')
+
+# a submit_sm the SMSC may or may not have accepted
+UnacknowledgedSubmit = namedtuple('UnacknowledgedSubmit',
+                                  'order_id sequence destination_addr short_message')
+
+
+class SMPPError(Exception):
+    """
+    A request refused by the SMSC (`status`) or left unanswered. If it is
+    `unanswered`, the request was sent and the SMSC may have acted on it.
+    """
+
+    def __init__(self, message, status=None, unanswered=False):
+        Exception.__init__(self, message)
+        self.status = status
+        self.unanswered = unanswered
+
+
+class SMPPConnectionError(SMPPError):
+    """The connection was lost (or the client closed) before the response
+    came; unless the error is `unanswered`, the request was never sent"""
+
+
+class SMPPClient(object):
+    """
+    An ESME session with one SMSC.
+    mode: TRANSCEIVER, to also receive delivery receipts, or TRANSMITTER
+    window: the most submit_sm awaiting their response at any time
+    enquire_link_interval: seconds without traffic after which the link is
+    checked, and the connection dropped if the check goes unanswered
+    rebind_delay, max_rebind_delay: the wait before binding again, doubled
+    after each failed attempt
+    throttle_delay, max_throttle_retries: a submit_sm refused as throttled
+    is sent again after throttle_delay (times the attempt) seconds
+    on_receipt: called with each `DeliveryReceipt`; may be a coroutine
+    max_tracked: the most message ids remembered to correlate receipts, and
+    the most `unacknowledged` submits kept
+    The asyncio objects are made by `start`, in the loop it runs in.
+    """
+
+    def __init__(self, host, port, system_id, password, system_type='', mode=TRANSCEIVER,
+                 window=10, source_addr='', source_addr_ton=5, source_addr_npi=0,
+                 response_timeout=10, enquire_link_interval=30, rebind_delay=1,
+                 max_rebind_delay=60, throttle_delay=1, max_throttle_retries=3,
+                 on_receipt=None, max_tracked=100000):
+        self.host = host
+        self.port = port
+        self.system_id = system_id
+        self.password = password
+        self.system_type = system_type
+        self.bind_class = BIND_CLASSES[mode]
+        self.window = window
+        self.source_addr = source_addr
+        self.source_addr_ton = source_addr_ton
+        self.source_addr_npi = source_addr_npi
+        self.response_timeout = response_timeout
+        self.enquire_link_interval = enquire_link_interval
+        self.rebind_delay = rebind_delay
+        self.max_rebind_delay = max_rebind_delay
+        self.throttle_delay = throttle_delay
+        self.max_throttle_retries = max_throttle_retries
+        self.on_receipt = on_receipt
+        self.max_tracked = max_tracked
+
+        self._loop = None
+        self._window = None
+        self._bound = None
+        self._encoder = PDUEncoder()
+        self._writer = None
+        self._sequence = 0
+        # sequence number -> future of the response
+        self._pending = {}
+        # sequence number -> order id of the submit_sm awaiting a response
+        self._submits = {}
+        # UnacknowledgedSubmits, oldest first: for the caller to reconcile
+        # (and remove) before sending any of them again
+        self.unacknowledged = deque(maxlen=max_tracked)
+        # message id -> order id, oldest first
+        self._orders = OrderedDict()
+        # receipts which came before the response to their submit_sm
+        self._early = OrderedDict()
+        self._last_read = 0
+        self._closing = False
+        self._task = None
+
+        self.binds = 0
+        self.submitted = 0
+        self.throttled = 0
+        self.receipts = 0
+        self.unmatched_receipts = 0
+
+    async def start(self, timeout=None):
+        """Connects and binds, waiting at most `timeout` seconds for the first bind"""
+        if self._loop is None:
+            # in the running loop, which they belong to
+            self._loop = asyncio.get_event_loop()
+            self._window = asyncio.Semaphore(self.window)
+            self._bound = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        await asyncio.wait_for(self._bound.wait(), timeout)
+
+    async def close(self):
+        """Unbinds and closes the connection"""
+        self._closing = True
+        if self._bound is None:
+            return
+        if self._bound.is_set():
+            try:
+                await self._request(Unbind(self._next_sequence()))
+            except SMPPError:
+                pass
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        # wakes the submits waiting for a bind, to fail
+        self._bound.set()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.close()
+
+    async def submit(self, order_id, destination_addr, short_message, **fields):
+        """
+        Sends `short_message` to `destination_addr`, requesting a delivery
+        receipt, and returns the message id given by the SMSC. Waits for a
+        free place in the window, and for a bind if the connection is down.
+        fields: other submit_sm fields, e.g. data_coding
+        Raises SMPPError if the SMSC refuses it, or if it is `unanswered`,
+        when it is also added to `unacknowledged`.
+        """
+        if self._window is None:
+            raise SMPPConnectionError('client not started')
+        params = {'source_addr': self.source_addr,
+                  'source_addr_ton': self.source_addr_ton,
+                  'source_addr_npi': self.source_addr_npi,
+                  'dest_addr_ton': 1,
+                  'dest_addr_npi': 1,
+                  'registered_delivery': 1}
+        params.update(fields)
+        retries = 0
+        async with self._window:
+            while True:
+                await self._bound.wait()
+                if self._closing:
+                    raise SMPPConnectionError('client closed')
+                pdu = SubmitSM(self._next_sequence(), destination_addr=destination_addr,
+                               short_message=short_message, **params)
+                self._submits[pdu.sequence] = order_id
+                try:
+                    resp = await self._request(pdu)
+                except SMPPError as e:
+                    if e.unanswered:
+                        self.unacknowledged.append(UnacknowledgedSubmit(
+                            order_id, pdu.sequence, destination_addr, short_message))
+                    raise
+                finally:
+                    self._submits.pop(pdu.sequence, None)
+                if resp.status == ESME_ROK:
+                    break
+                if (resp.status in (ESME_RTHROTTLED, ESME_RMSGQFUL)
+                        and retries < self.max_throttle_retries):
+                    retries += 1
+                    self.throttled += 1
+                    await asyncio.sleep(self.throttle_delay * retries)
+                    continue
+                raise SMPPError('submit_sm for order %s refused' % order_id, resp.status)
+        self.submitted += 1
+        return resp.message_id.decode('ascii')
+
+    async def submit_message(self, order_id, destination_addr, message, **fields):
+        """
+        Sends `message`, a text or an encoded `smsencoding.Message`, as one
+        submit_sm per segment and returns their message ids. Each segment
+        has its own delivery receipt, all of them for `order_id`.
+        The segments are sent in order, each once the one before is
+        accepted, and none after one that fails: the error raised has the
+        `message_ids` of the segments accepted before it.
+        """
+        if not isinstance(message, Message):
+            message = encode_message(message)
+        fields['data_coding'] = message.data_coding
+        fields['esm_class'] = fields.get('esm_class', 0) | message.esm_class
+        message_ids = []
+        for segment in message.segments:
+            try:
+                message_ids.append(await self.submit(order_id, destination_addr, segment,
+                                                     **fields))
+            except SMPPError as e:
+                e.message_ids = message_ids
+                raise
+        return message_ids
+
+    def stats(self):
+        return {'binds': self.binds,
+                'bound': bool(self._bound and self._bound.is_set()) and not self._closing,
+                'in_flight': len(self._pending),
+                'unacknowledged': len(self.unacknowledged),
+                'submitted': self.submitted,
+                'throttled': self.throttled,
+                'receipts': self.receipts,
+                'unmatched_receipts': self.unmatched_receipts}
+
+    def parse_receipt(self, pdu):
+        """Returns the `DeliveryReceipt` in the deliver_sm `pdu`"""
+        text = bytes(pdu.short_message)
+        match = RECEIPT_RE.search(text)
+        message_id = pdu.tlvs.get(TAG_RECEIPTED_MESSAGE_ID)
+        if message_id is not None:
+            message_id = bytes(message_id).rstrip(b'\0').decode('ascii')
+        elif match:
+            message_id = match.group('id').decode('ascii')
+        state = pdu.tlvs.get(TAG_MESSAGE_STATE)
+        if state is not None and len(state) == 1:
+            state = MESSAGE_STATES.get(bytearray(state)[0], 'UNKNOWN')
+        elif match:
+            state = match.group('stat').decode('ascii').upper()
+        error = match and match.group('err') and match.group('err').decode('ascii')
+        if state in INTERMEDIATE_STATES:
+            order_id = self._orders.get(message_id)
+        else:
+            order_id = self._orders.pop(message_id, None)
+        return DeliveryReceipt(order_id, message_id, state, error, text)
+
+    def _next_sequence(self):
+        # sequence numbers run from 1 to 0x7FFFFFFF
+        self._sequence = self._sequence % 0x7FFFFFFF + 1
+        return self._sequence
+
+    async def _run(self):
+        delay = self.rebind_delay
+        while not self._closing:
+            binds = self.binds
+            try:
+                await self._session()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning('SMPP session with %s:%s ended: %r', self.host, self.port, e)
+            if self._closing:
+                return
+            if self.binds != binds:
+                delay = self.rebind_delay
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_rebind_delay)
+
+    async def _session(self):
+        """Binds and serves one connection until it is lost"""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.response_timeout)
+        self._writer = writer
+        read = asyncio.ensure_future(self._read(reader))
+        keepalive = None
+        try:
+            resp = await self._request(self.bind_class(
+                self._next_sequence(), system_id=self.system_id, password=self.password,
+                system_type=self.system_type, interface_version=0x34))
+            if resp.status != ESME_ROK:
+                raise SMPPError('bind refused', resp.status)
+            self.binds += 1
+            log.info('bound to %s:%s as %s', self.host, self.port, self.system_id)
+            self._bound.set()
+            keepalive = asyncio.ensure_future(self._keepalive())
+            await read
+        finally:
+            self._bound.clear()
+            read.cancel()
+            if keepalive is not None:
+                keepalive.cancel()
+            writer.close()
+            self._writer = None
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(SMPPConnectionError('connection lost',
+                                                             unanswered=True))
+
+    async def _read(self, reader):
+        pdus = PDUReader()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            self._last_read = self._loop.time()
+            for pdu in pdus.feed(data):
+                self._dispatch(pdu)
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.enquire_link_interval)
+            if self._loop.time() - self._last_read < self.enquire_link_interval:
+                continue
+            try:
+                await self._request(EnquireLink(self._next_sequence()))
+            except SMPPError:
+                log.warning('enquire_link to %s:%s unanswered, reconnecting',
+                            self.host, self.port)
+                self._writer.close()
+                return
+
+    async def _request(self, pdu):
+        """Sends `pdu` and returns the response to it"""
+        if self._writer is None or self._writer.transport.is_closing():
+            raise SMPPConnectionError('not connected')
+        future = self._loop.create_future()
+        self._pending[pdu.sequence] = future
+        self._send(pdu)
+        try:
+            return await asyncio.wait_for(future, self.response_timeout)
+        except asyncio.TimeoutError:
+            raise SMPPError('no response to %s %d' % (pdu.__class__.__name__, pdu.sequence),
+                            unanswered=True)
+        finally:
+            self._pending.pop(pdu.sequence, None)
+
+    def _send(self, pdu):
+        # the transport may keep what it is given until it is sent, and the
+        # encoder reuses its buffer, so give it a copy
+        self._writer.write(bytes(self._encoder.encode(pdu)))
+
+    def _dispatch(self, pdu):
+        if pdu.command_id & GENERIC_NACK:
+            # a response (or generic_nack) to one of our requests
+            future = self._pending.get(pdu.sequence)
+            if future is not None and not future.done():
+                future.set_result(pdu)
+                if pdu.command_id == SUBMIT_SM_RESP and pdu.status == ESME_ROK:
+                    # now rather than when submit resumes, which may be
+                    # after the receipt has been dispatched
+                    self._track(pdu.message_id.decode('ascii'), self._submits.get(pdu.sequence))
+        elif pdu.command_id == DELIVER_SM:
+            self._send(pdu.response())
+            self._deliver(pdu)
+        elif pdu.command_id == ENQUIRE_LINK:
+            self._send(pdu.response())
+        elif pdu.command_id == UNBIND:
+            log.info('unbound by %s:%s', self.host, self.port)
+            self._send(pdu.response())
+            self._writer.close()
+        else:
+            self._send(GenericNack(pdu.sequence, ESME_RINVCMDID))
+
+    def _track(self, message_id, order_id):
+        self._orders[message_id] = order_id
+        if len(self._orders) > self.max_tracked:
+            self._orders.popitem(last=False)
+        receipt = self._early.pop(message_id, None)
+        if receipt is not None:
+            self.unmatched_receipts -= 1
+            self._receipt(receipt._replace(order_id=order_id))
+
+    def _deliver(self, pdu):
+        if not pdu.esm_class & ESM_DELIVERY_RECEIPT:
+            # a mobile originated message: not handled here
+            return
+        receipt = self.parse_receipt(pdu)
+        self.receipts += 1
+        if receipt.order_id is None:
+            self.unmatched_receipts += 1
+            if receipt.message_id is not None:
+                # the SMSC may send the receipt before the response to
+                # the submit_sm: it is passed on when that comes
+                self._early[receipt.message_id] = receipt
+                if len(self._early) > 1000:
+                    self._receipt(self._early.popitem(last=False)[1])
+                return
+        self._receipt(receipt)
+
+    def _receipt(self, receipt):
+        if self.on_receipt is None:
+            return
+        try:
+            result = self.on_receipt(receipt)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+        except Exception:
+            log.exception('on_receipt failed for message %s', receipt.message_id)
@@ -0,0 +1,262 @@
+#!coding=utf-8
+"""
+smsencoding
+~~~~~~~~~~~~~~~~~~~~
+Encoding of SMS texts into submit_sm bodies: GSM 03.38 (the default
+alphabet and its extension table) when every character allows it, UCS2
+otherwise, split into concatenated segments with a user data header when
+the text does not fit in one message.
+ > message = encode_message(u'Malipo ya TZS 5,000.00 yamepokelewa. Kumb: AB12CD')
+ > message.data_coding, message.esm_class, message.segments
+Receipts sent by the thousand differ only in their amount and reference,
+so a `ReceiptTemplate` encodes the fixed text once and each receipt only
+has the values to encode:
+ > template = receipt_template(u'Payment of $amount received. Ref $reference')
+ > message = template.render(amount=u'TZS 5,000.00', reference=u'AB12CD')
+Works on Python 2.7 and 3.
+"""
+from collections import namedtuple
+import itertools
+from string import Template
+
+try:
+    text_type = unicode
+except NameError:  # Python 3
+    text_type = str
+    unichr = chr
+
+# data_coding values
+GSM7 = 0x00
+UCS2 = 0x08
+
+# esm_class flag of a short_message starting with a user data header
+ESM_UDHI = 0x40
+
+ESCAPE = 0x1B
+
+# GSM 03.38 default alphabet, by septet value (the escape is not a character)
+GSM_ALPHABET = (
+    u'@£$¥èéùìòÇ\nØø\rÅå'
+    u'Δ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ'
+    u' !"#¤%&\'()*+,-./0123456789:;<=>?'
+    u'¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§'
+    u'¿abcdefghijklmnopqrstuvwxyzäöñüà')
+# characters of the extension table, sent as the escape and this septet
+GSM_EXTENSION = {u'\x0c': 0x0A, u'^': 0x14, u'{': 0x28, u'}': 0x29, u'\\': 0x2F,
+                 u'[': 0x3C, u'~': 0x3D, u']': 0x3E, u'|': 0x40, u'€': 0x65}
+
+# text.translate table to one latin-1 character per septet
+_GSM_TRANSLATE = dict((ord(char), unichr(septet))
+                      for septet, char in enumerate(GSM_ALPHABET) if septet != ESCAPE)
+_GSM_TRANSLATE.update((ord(char), u'\x1b' + unichr(septet))
+                      for char, septet in GSM_EXTENSION.items())
+GSM_CHARACTERS = frozenset(GSM_ALPHABET.replace(u'\x1b', u'')) | frozenset(GSM_EXTENSION)
+_GSM_EXTENSION_CHARS = dict((septet, char) for char, septet in GSM_EXTENSION.items())
+
+# (septets or octets in one message, in each segment of a concatenated one)
+GSM7_LIMITS = (160, 153)
+UCS2_LIMITS = (140, 134)
+
+_references = itertools.count(1)
+
+
+class Message(namedtuple('Message', 'data_coding segments udhi')):
+    """
+    An encoded text: the short_message of each submit_sm (with the user
+    data header if `udhi`) and the data_coding to send them with
+    """
+    __slots__ = ()
+
+    @property
+    def esm_class(self):
+        return ESM_UDHI if self.udhi else 0
+
+
+def gsm_encode(text):
+    """
+    Returns `text` in the GSM default alphabet, one septet per octet (as
+    sent over SMPP), or None if it has characters outside the alphabet
+    """
+    if not GSM_CHARACTERS.issuperset(text):
+        return None
+    return bytearray(text.translate(_GSM_TRANSLATE).encode('latin-1'))
+
+
+def gsm_decode(octets):
+    """Returns the text of unpacked GSM septets"""
+    chars = []
+    escaped = False
+    for septet in bytearray(octets):
+        if escaped:
+            chars.append(_GSM_EXTENSION_CHARS.get(septet, u' '))
+            escaped = False
+        elif septet == ESCAPE:
+            escaped = True
+        else:
+            chars.append(GSM_ALPHABET[septet])
+    return u''.join(chars)
+
+
+def pack_septets(septets, fill_bits=0):
+    """
+    Packs septets (one per octet) eight to seven octets, after `fill_bits`
+    zero bits, which align them after a user data header
+    """
+    packed = bytearray()
+    acc = 0
+    bits = fill_bits
+    for septet in bytearray(septets):
+        acc |= septet << bits
+        bits += 7
+        while bits >= 8:
+            packed.append(acc & 0xFF)
+            acc >>= 8
+            bits -= 8
+    if bits and septets:
+        packed.append(acc)
+    return packed
+
+
+def unpack_septets(packed, count, fill_bits=0):
+    """Returns the `count` septets packed in `packed`, one per octet"""
+    septets = bytearray()
+    acc = 0
+    bits = 0
+    for octet in bytearray(packed):
+        acc |= octet << bits
+        bits += 8
+        if fill_bits:
+            acc >>= fill_bits
+            bits -= fill_bits
+            fill_bits = 0
+        while bits >= 7 and len(septets) < count:
+            septets.append(acc & 0x7F)
+            acc >>= 7
+            bits -= 7
+    return septets
+
+
+def encode_message(text, packed=False, max_segments=255):
+    """
+    Returns the `Message` of `text`, in GSM 03.38 if possible, else UCS2.
+    packed: pack GSM septets, for SMSCs which expect them packed (most
+    take one septet per octet)
+    """
+    octets = gsm_encode(text)
+    if octets is not None:
+        return segment(octets, GSM7, packed, max_segments)
+    return segment(bytearray(text.encode('utf-16-be')), UCS2, max_segments=max_segments)
+
+
+def segment(octets, data_coding, packed=False, max_segments=255):
+    """
+    Returns the `Message` of the encoded `octets`: GSM septets (one per
+    octet) or UTF-16 code units, split into concatenated segments if they
+    are too long for one message
+    """
+    single, size = GSM7_LIMITS if data_coding == GSM7 else UCS2_LIMITS
+    if len(octets) <= single:
+        body = pack_septets(octets) if packed else octets
+        return Message(data_coding, [bytes(body)], False)
+
+    octets = bytearray(octets)
+    parts = []
+    start = 0
+    while start < len(octets):
+        end = min(start + size, len(octets))
+        if end < len(octets):
+            if data_coding == GSM7:
+                # never split an escape from the septet it escapes
+                if octets[end - 1] == ESCAPE:
+                    end -= 1
+            elif 0xD8 <= octets[end - 2] <= 0xDB:
+                # nor a surrogate pair
+                end -= 2
+        parts.append(octets[start:end])
+        start = end
+    if len(parts) > max_segments:
+        raise ValueError('text needs %d segments, more than %d' % (len(parts), max_segments))
+
+    reference = next(_references) % 256
+    segments = []
+    for number, part in enumerate(parts, 1):
+        # concatenated short messages, 8-bit reference
+        udh = bytearray((5, 0x00, 3, reference, len(parts), number))
+        if packed:
+            part = pack_septets(part, (7 - len(udh) * 8 % 7) % 7)
+        segments.append(bytes(udh + part))
+    return Message(data_coding, segments, True)
+
+
+class ReceiptTemplate(object):
+    """
+    A text with $slots (`string.Template` syntax), whose fixed parts are
+    encoded once. If the fixed text needs UCS2 every receipt is sent in
+    UCS2; if only a value does, that receipt is encoded in full.
+    The encodings of the last `cache_size` distinct values are kept too,
+    as amounts and dates recur.
+    """
+
+    def __init__(self, template, packed=False, cache_size=4096):
+        template = text_type(template)
+        self.template = Template(template)
+        self.packed = packed
+        self.cache_size = cache_size
+        self.gsm = GSM_CHARACTERS.issuperset(template)
+        self.data_coding = GSM7 if self.gsm else UCS2
+        # (encoded literal, None) and (None, slot name) pairs, in order
+        self._parts = []
+        self._values = {}
+        pos = 0
+        for match in self.template.pattern.finditer(template):
+            if match.group('invalid') is not None:
+                raise ValueError('invalid placeholder at %d in %r' % (match.start(), template))
+            name = match.group('named') or match.group('braced')
+            # up to the placeholder, or including the first $ of $$
+            literal = template[pos:match.start() if name else match.end() - 1]
+            if literal:
+                self._parts.append((self._encode(literal), None))
+            if name:
+                self._parts.append((None, name))
+            pos = match.end()
+        if template[pos:]:
+            self._parts.append((self._encode(template[pos:]), None))
+
+    def render(self, **values):
+        """Returns the `Message` of the text with `values` in its slots"""
+        cache = self._values
+        encoded = []
+        for literal, name in self._parts:
+            if name is None:
+                encoded.append(literal)
+                continue
+            value = values[name]
+            octets = cache.get(value)
+            if octets is None:
+                octets = self._encode(value if isinstance(value, text_type) else text_type(value))
+                if octets is None:
+                    return encode_message(self.template.substitute(values), self.packed)
+                if len(cache) >= self.cache_size:
+                    cache.clear()
+                cache[value] = octets
+            encoded.append(octets)
+        return segment(b''.join(encoded), self.data_coding, self.packed)
+
+    def _encode(self, text):
+        if self.gsm:
+            if not GSM_CHARACTERS.issuperset(text):
+                return None
+            return text.translate(_GSM_TRANSLATE).encode('latin-1')
+        return text.encode('utf-16-be')
+
+
+_templates = {}
+
+
+def receipt_template(template, packed=False):
+    """Returns the `ReceiptTemplate` of `template`, compiled once"""
+    key = (template, packed)
+    compiled = _templates.get(key)
+    if compiled is None:
+        compiled = _templates[key] = ReceiptTemplate(template, packed)
+    return compiled
@@ -0,0 +1,232 @@
+"""
+sync
+~~~~~~~~~~~~~~~~~~~~
+Incremental synchronisation of pesaply Mobile Money transaction history.
+Instead of downloading the whole history on every run, `TransactionSync`
+remembers the newest transaction it has seen for each account (its
+high-water mark) and only fetches from there on.
+Example:
+ > sync = TransactionSync(pesaplyMM('2550000000', '0000'))  # marks in the Django database
+ > sync = TransactionSync(mm, SQLiteWatermarkStore('/var/lib/sarafu/sync.db'))
+ > for txn in sync.sync():
+ >     reconcile(txn)
+"""
+from datetime import datetime, timedelta
+import sqlite3
+import threading
+try:
+    from django.conf import settings
+    from django.core.exceptions import ObjectDoesNotExist
+except ImportError:
+    settings = None
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# tables of the SQLiteWatermarkStore
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS pesaply_sync_watermark ('
+    'account VARCHAR(32) PRIMARY KEY, '
+    'last_date VARCHAR(19) NOT NULL, '
+    'last_reference VARCHAR(64) NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS pesaply_sync_seen ('
+    'account VARCHAR(32) NOT NULL, '
+    'reference VARCHAR(64) NOT NULL, '
+    'date VARCHAR(19) NOT NULL, '
+    'PRIMARY KEY (account, reference))',
+)
+
+
+class SQLiteWatermarkStore(object):
+    """
+    Keeps the high-water marks in the SQLite database at `path`. Dates are
+    stored as sortable strings.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._atomic():
+            for sql in SCHEMA:
+                self._execute(sql)
+
+    def get(self, account):
+        rows = self._execute('SELECT last_date, last_reference FROM pesaply_sync_watermark '
+                             'WHERE account = ?', (account,))
+        if not rows:
+            return None, None
+        return datetime.strptime(rows[0][0], DATE_FORMAT), rows[0][1]
+
+    def seen(self, account, since):
+        rows = self._execute('SELECT reference FROM pesaply_sync_seen '
+                             'WHERE account = ? AND date >= ?',
+                             (account, since.strftime(DATE_FORMAT)))
+        return set(row[0] for row in rows)
+
+    def save(self, account, last_date, last_reference, transactions, prune_before):
+        with self._atomic():
+            for txn in transactions:
+                self._execute('INSERT INTO pesaply_sync_seen (account, reference, date) '
+                              'VALUES (?, ?, ?)',
+                              (account, txn['reference'], txn['date'].strftime(DATE_FORMAT)))
+            self._execute('DELETE FROM pesaply_sync_seen WHERE account = ? AND date < ?',
+                          (account, prune_before.strftime(DATE_FORMAT)))
+            self._execute('DELETE FROM pesaply_sync_watermark WHERE account = ?', (account,))
+            self._execute('INSERT INTO pesaply_sync_watermark (account, last_date, last_reference) '
+                          'VALUES (?, ?, ?)',
+                          (account, last_date.strftime(DATE_FORMAT), last_reference))
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _atomic(self):
+        return _SQLiteTransaction(self)
+
+
+class _SQLiteTransaction(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store._lock.acquire()
+        self.store._conn.execute('BEGIN')
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            self.store._conn.execute(exc_type is None and 'COMMIT' or 'ROLLBACK')
+        finally:
+            self.store._lock.release()
+
+
+class DjangoWatermarkStore(object):
+    """
+    Keeps the high-water marks in the `SyncWatermark` and
+    `SyncSeenTransaction` models, in the Django database `using`.
+    The export's dates are naive; with USE_TZ they are stored in the
+    current time zone and given back naive.
+    """
+
+    def __init__(self, using='default'):
+        from .profile import SyncSeenTransaction, SyncWatermark
+        self.using = using
+        self.watermarks = SyncWatermark.objects.using(using)
+        self.seen_transactions = SyncSeenTransaction.objects.using(using)
+
+    def get(self, account):
+        try:
+            mark = self.watermarks.get(account=account)
+        except ObjectDoesNotExist:
+            return None, None
+        return _from_db(mark.last_date), mark.last_reference
+
+    def seen(self, account, since):
+        return set(self.seen_transactions.filter(account=account, date__gte=_to_db(since))
+                   .values_list('reference', flat=True))
+
+    def save(self, account, last_date, last_reference, transactions, prune_before):
+        from django.db import transaction
+
+        model = self.seen_transactions.model
+        with transaction.atomic(using=self.using):
+            self.seen_transactions.bulk_create(
+                [model(account=account, reference=txn['reference'], date=_to_db(txn['date']))
+                 for txn in transactions])
+            self.seen_transactions.filter(account=account, date__lt=_to_db(prune_before)).delete()
+            self.watermarks.update_or_create(account=account, defaults={
+                'last_date': _to_db(last_date), 'last_reference': last_reference})
+
+
+def _to_db(value):
+    from django.utils import timezone
+
+    if timezone.is_naive(value) and settings.USE_TZ:
+        return timezone.make_aware(value)
+    return value
+
+
+def _from_db(value):
+    from django.utils import timezone
+
+    if timezone.is_aware(value):
+        return timezone.make_naive(value)
+    return value
+
+
+def default_store():
+    """
+    Returns a `DjangoWatermarkStore` when Django is installed and
+    configured; without Django a store has to be given explicitly
+    """
+    if settings is not None and settings.configured:
+        return DjangoWatermarkStore()
+    raise ValueError('Django is not configured: pass a store, '
+                     'e.g. SQLiteWatermarkStore(path)')
+
+
+class TransactionSync(object):
+    """
+    Fetches only the transactions of `mm`'s account that have not been
+    returned by an earlier sync.
+    Each sync re-fetches `overlap` before the high-water mark so that rows
+    which reach the export late are still picked up; rows fetched twice are
+    recognised by their reference and left out.
+    `initial_date` limits how far back the very first sync goes.
+    `store` keeps the marks (`default_store()` if not given); it has:
+    - get(account): the (date, reference) of the mark, or (None, None)
+    - seen(account, since): the references seen dated `since` or later
+    - save(account, last_date, last_reference, transactions, prune_before):
+      records `transactions` as seen, forgets the ones dated before
+      `prune_before` and moves the mark, all at once
+    """
+
+    def __init__(self, mm, store=None, overlap=timedelta(days=1), initial_date=None):
+        self.mm = mm
+        self.store = store or default_store()
+        self.overlap = overlap
+        self.initial_date = initial_date
+
+    def sync(self, to_date=None):
+        """
+        Returns the new transactions, oldest first, and moves the high-water
+        mark past them
+        """
+        account = self.mm.account
+        last_date, last_reference = self.store.get(account)
+        kwargs = {'to_date': to_date or datetime.now()}
+
+        if last_date is not None:
+            kwargs['from_date'] = self._window_start(last_date)
+            seen = self.store.seen(account, kwargs['from_date'])
+        else:
+            if self.initial_date is not None:
+                kwargs['from_date'] = self.initial_date
+            seen = set()
+        since = kwargs.get('from_date')
+        if since is not None and not isinstance(since, datetime):
+            since = datetime.combine(since, datetime.min.time())
+
+        new = []
+        for txn in self.mm.iter_transactions(**kwargs):
+            # the export can return rows from before the window, which
+            # were returned already but are no longer in `seen`
+            if since is not None and txn['date'] < since:
+                continue
+            if txn['reference'] not in seen:
+                seen.add(txn['reference'])
+                new.append(txn)
+
+        if not new:
+            return new
+
+        new.sort(key=lambda txn: txn['date'])
+        if last_date is None or new[-1]['date'] >= last_date:
+            last_date, last_reference = new[-1]['date'], new[-1]['reference']
+        self.store.save(account, last_date, last_reference, new,
+                        prune_before=self._window_start(last_date))
+        return new
+
+    def _window_start(self, last_date):
+        # the export filters by whole days, so the window starts at midnight
+        return datetime.combine((last_date - self.overlap).date(), datetime.min.time())
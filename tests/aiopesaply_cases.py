@@ -0,0 +1,192 @@
+"""
+Tests of `aiopesaply.AsyncPesaplyMM` against a local aiohttp stub of the
+pesaply web and mobile web applications, collected through
+`test_aiopesaply` on Python 3.5+ only.
+"""
+import asyncio
+from datetime import date
+import unittest
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from ..aiopesaply import AsyncPesaplyMM, create_connector
+from ..exceptions import AuthDeniedException, InvalidAccountException
+
+ACCOUNT, PIN = '2550000000', '0000'
+HISTORY_FORM = '''<html><body>
+<form name="accountHistoryForm" method="POST" action="/do/member/accountHistory">
+<input type="hidden" name="query(period).begin" value="">
+<input type="hidden" name="query(period).end" value="">
+<input type="hidden" name="query(member)" value="">
+<input type="hidden" name="query(transactionNumber)" value="">
+</form></body></html>'''
+EXPORT = ('Date,Description,Amount,Transaction number,???transfer.fromOwner???,'
+          '???transfer.toOwner???,Transaction type\r\n'
+          '02/01/2016 09:00:00,Transfer,"1,000.00",T2,a,b,payment\r\n'
+          '01/01/2016 17:00:00,Transfer,250.50,T1,a,b,payment\r\n')
+MOBILE_PAGES = {
+    'my': '<a href="/m/balance">Balance Inquiry</a> <a href="/m/transfer">Transfer</a>',
+    'transfer': '<a href="/m/s2s">sarafu-to-sarafu</a>',
+    'balance': '<form action="/m/balance"><input type="hidden" name="op" value="balance">'
+               '<input name="pin"><input type="submit" name="go" value="OK"></form>',
+    's2s': '<form action="/m/pay"><input name="recipient"><input name="amount">'
+           '<input name="pin"><input type="hidden" name="channel" value=""></form>',
+}
+
+
+class StubServer(object):
+    """The pages the client goes through, counting the logins and page views"""
+
+    def __init__(self):
+        self.logins = 0
+        self.views = []
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', self.handle)
+        self.runner = web.AppRunner(app)
+
+    async def start(self):
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', 0).start()
+        self.url = 'http://127.0.0.1:%d' % self.runner.addresses[0][1]
+
+    async def close(self):
+        await self.runner.cleanup()
+
+    async def handle(self, request):
+        path = request.path
+        data = await request.post()
+        self.views.append((request.method, path))
+        if path == '/do/login':
+            if request.method == 'GET':
+                return web.Response(text='login')
+            if (data.get('principal'), data.get('password')) != (ACCOUNT, PIN):
+                raise web.HTTPFound('/do/error')
+            self.logins += 1
+            response = web.HTTPFound('/do/member/home')
+            response.set_cookie('session', str(self.logins))
+            raise response
+        if path.startswith('/do/') and path != '/do/error' and 'session' not in request.cookies:
+            raise web.HTTPFound('/do/login')
+        if path == '/do/member/accountHistory':
+            return web.Response(text=HISTORY_FORM, content_type='text/html')
+        if path == '/do/exportAccountHistoryToCsv':
+            self.exported = dict(data)
+            return web.Response(text=EXPORT, content_type='text/csv')
+        if path == '/do/searchMembersAjax':
+            if data['username'] == '2551111111':
+                return web.Response(text="[[{'id': 7, 'name': 'Juma'}]]")
+            return web.Response(text='[[]]')
+        if path.startswith('/do/'):
+            # the home and error pages
+            return web.Response(text=path)
+        if path == '/2559999999/Bluesarafu':
+            return web.Response(text='<a href="/register">Register</a>', content_type='text/html')
+        if path.endswith('/Bluesarafu'):
+            return web.Response(text='<a href="/m/my">My sarafu</a>', content_type='text/html')
+        if request.method == 'POST':
+            return web.Response(text=self.post(path, data), content_type='text/html')
+        return web.Response(text=MOBILE_PAGES[path[3:]], content_type='text/html')
+
+    def post(self, path, data):
+        if path == '/m/pay' and data['recipient'] != '2551111111':
+            return 'Recipient not found'
+        if path == '/m/pay':
+            return ('<form action="/m/confirm"><input type="hidden" name="recipient" value="%s">'
+                    '<input name="pin"></form>' % data['recipient'])
+        if data['pin'] != PIN:
+            return 'Invalid PIN'
+        if path == '/m/balance':
+            return 'Your balance is TSH 1250.50'
+        return 'Paid. Transaction id: 12345'
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class AsyncPesaplyMMTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = StubServer()
+        self.wait(self.server.start())
+        url = self.server.url
+
+        class StubMM(AsyncPesaplyMM):
+            AUTH_URL = url + '/do/login'
+            TRANSACTIONS_EXPORT_URL = url + '/do/exportAccountHistoryToCsv'
+            TRANSACTIONS_URL = url + '/do/member/accountHistory'
+            SEARCH_MEMBERS_URL = url + '/do/searchMembersAjax'
+            MOBILE_WEB_URL = url + '/%(accountno)s/Bluesarafu'
+            ERROR_URL = url + '/do/error'
+        self.StubMM = StubMM
+        # made outside the loop, as it would be at import time
+        self.mm = StubMM(ACCOUNT, PIN)
+
+    def tearDown(self):
+        self.wait(self.mm.close())
+        self.wait(self.server.close())
+        self.loop.close()
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 10))
+
+    def test_transactions(self):
+        async def test():
+            first = await self.mm.get_transactions(from_date=date(2016, 1, 1))
+            return first, await self.mm.get_transactions(to_date=date(2016, 1, 2))
+        first, second = self.wait(test())
+        self.assertEqual([(txn['reference'], txn['amount']) for txn in first],
+                         [('T2', 1000.0), ('T1', 250.5)])
+        self.assertEqual(second, first)
+        self.assertEqual(self.server.exported['query(period).end'], '02/01/2016')
+        # logged in when redirected to the login page, and the form is kept
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(self.server.views.count(('GET', '/do/member/accountHistory')), 2)
+
+    def test_account_details(self):
+        self.assertEqual(self.wait(self.mm.get_account_details('2551111111')),
+                         {'id': 7, 'name': 'Juma'})
+        with self.assertRaises(InvalidAccountException):
+            self.wait(self.mm.get_account_details('2552222222'))
+
+    def test_wrong_pin(self):
+        async def test(operation):
+            async with self.StubMM(ACCOUNT, '1111') as mm:
+                await getattr(mm, operation)()
+        for operation in ('get_transactions', 'get_balance'):
+            with self.assertRaises(AuthDeniedException):
+                self.wait(test(operation))
+
+    def test_balance_walks_the_links_once(self):
+        self.assertEqual(self.wait(self.mm.get_balance()), '1250.50')
+        self.assertEqual(self.wait(self.mm.get_balance()), '1250.50')
+        self.assertEqual(self.server.views.count(('GET', '/m/my')), 1)
+        self.assertEqual(self.server.views.count(('POST', '/m/balance')), 2)
+
+    def test_payment(self):
+        self.assertEqual(self.wait(self.mm.make_payment('2551111111', '100')), '12345')
+        with self.assertRaises(InvalidAccountException):
+            self.wait(self.mm.make_payment('2552222222', '100'))
+        self.assertEqual(self.server.views.count(('POST', '/m/confirm')), 1)
+
+    def test_unregistered_account(self):
+        async def test():
+            async with self.StubMM('2559999999', PIN) as mm:
+                await mm.get_balance()
+        with self.assertRaises(InvalidAccountException):
+            self.wait(test())
+
+    def test_shared_connector(self):
+        async def test():
+            connector = create_connector(limit_per_host=2)
+            clients = [self.StubMM(ACCOUNT, PIN, connector=connector) for i in range(3)]
+            try:
+                return await asyncio.gather(*[c.get_transactions() for c in clients])
+            finally:
+                await asyncio.gather(*[c.close() for c in clients])
+                self.assertFalse(connector.closed)
+                await connector.close()
+        self.assertEqual(len(self.wait(test())), 3)
+        # a cookie jar, so a login, each
+        self.assertEqual(self.server.logins, 3)
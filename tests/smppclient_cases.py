@@ -0,0 +1,151 @@
+"""
+Tests of `smppclient.SMPPClient` against `fakesmsc.FakeSMSC`, collected
+through `test_smppclient` on Python 3.5+ only.
+"""
+import asyncio
+import unittest
+
+from ..fakesmsc import FakeSMSC
+from ..smppclient import SMPPClient, SMPPConnectionError, SMPPError
+from ..pducodec import ESME_RTHROTTLED
+
+
+class SMPPClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.smsc = FakeSMSC(latency=0.01)
+        self.wait(self.smsc.start())
+        self.receipts = []
+        # made outside the loop, as it would be at import time
+        self.client = SMPPClient('127.0.0.1', self.smsc.port, 'sarafu', 'secret',
+                                 rebind_delay=0.05, throttle_delay=0.01,
+                                 on_receipt=self.receipts.append)
+
+    def tearDown(self):
+        self.wait(self.client.close())
+        self.wait(self.smsc.close())
+        self.loop.close()
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 10))
+
+    async def until(self, condition):
+        while not condition():
+            await asyncio.sleep(0.005)
+
+    def test_submit_and_receipts(self):
+        async def test():
+            await self.client.start(timeout=5)
+            message_ids = await asyncio.gather(*[
+                self.client.submit('ORD%d' % i, '2557000000%02d' % i, b'Payment received')
+                for i in range(20)])
+            await self.until(lambda: len(self.receipts) == 20)
+            return message_ids
+        message_ids = self.wait(test())
+        self.assertEqual(len(set(message_ids)), 20)
+        self.assertEqual(sorted(receipt.order_id for receipt in self.receipts),
+                         sorted('ORD%d' % i for i in range(20)))
+        self.assertEqual(set(receipt.state for receipt in self.receipts), {'DELIVRD'})
+        self.assertEqual(self.client.stats()['unmatched_receipts'], 0)
+
+    def test_window(self):
+        self.client.window = 3
+        in_flight = []
+
+        async def test():
+            await self.client.start(timeout=5)
+            submits = asyncio.gather(*[self.client.submit('ORD%d' % i, '255700000000', b'x')
+                                       for i in range(12)])
+            while not submits.done():
+                in_flight.append(self.client.stats()['in_flight'])
+                await asyncio.sleep(0.002)
+            await submits
+        self.wait(test())
+        self.assertEqual(max(in_flight), 3)
+        self.assertEqual(self.smsc.submits, 12)
+
+    def test_throttled_submit_is_sent_again(self):
+        self.smsc.throttle_every = 2
+
+        async def test():
+            await self.client.start(timeout=5)
+            return [await self.client.submit('ORD%d' % i, '255700000000', b'x')
+                    for i in range(3)]
+        self.assertEqual(len(set(self.wait(test()))), 3)
+        self.assertEqual(self.client.throttled, 2)
+
+    def test_refused(self):
+        self.smsc.throttle_every = 1
+        self.client.max_throttle_retries = 1
+
+        async def test():
+            await self.client.start(timeout=5)
+            await self.client.submit('ORD1', '255700000000', b'x')
+        with self.assertRaises(SMPPError) as raised:
+            self.wait(test())
+        self.assertEqual(raised.exception.status, ESME_RTHROTTLED)
+        self.assertFalse(raised.exception.unanswered)
+        self.assertFalse(self.client.unacknowledged)
+
+    def test_unanswered_submits_on_connection_loss(self):
+        async def test():
+            await self.client.start(timeout=5)
+            self.smsc.stalled = True
+            submits = asyncio.gather(*[self.client.submit('ORD%d' % i, '255700000000', b'x')
+                                       for i in range(15)], return_exceptions=True)
+            await self.until(lambda: self.client.stats()['in_flight'] == 10)
+            self.smsc.drop_connections()
+            self.smsc.stalled = False
+            return await submits
+        results = self.wait(test())
+        # the window was sent and left unanswered; the others waited for
+        # the client to bind again
+        unanswered = [i for i, result in enumerate(results)
+                      if isinstance(result, SMPPConnectionError) and result.unanswered]
+        self.assertEqual(unanswered, list(range(10)))
+        self.assertTrue(all(isinstance(result, str) for result in results[10:]))
+        self.assertEqual([submit.order_id for submit in self.client.unacknowledged],
+                         ['ORD%d' % i for i in range(10)])
+        self.assertEqual(self.client.stats()['unacknowledged'], 10)
+        self.assertEqual(self.client.binds, 2)
+
+    def test_rebind(self):
+        async def test():
+            await self.client.start(timeout=5)
+            self.smsc.drop_connections()
+            await self.until(lambda: self.client.binds == 2 and self.client.stats()['bound'])
+            return await self.client.submit('ORD1', '255700000000', b'x')
+        self.assertTrue(self.wait(test()))
+        self.assertEqual(self.smsc.binds, 2)
+
+    def test_long_message(self):
+        async def test():
+            await self.client.start(timeout=5)
+            message_ids = await self.client.submit_message('ORD1', '255700000000',
+                                                           u'Malipo ✓ ' * 10)
+            await self.until(lambda: len(self.receipts) == len(message_ids))
+            return message_ids
+        self.assertEqual(len(self.wait(test())), 2)
+        segments = [short_message for message_id, addr, short_message in self.smsc.messages]
+        self.assertTrue(all(s.startswith(b'\x05\x00\x03') for s in segments))
+        self.assertEqual([s[5] for s in segments], [1, 2])
+        self.assertEqual(set(receipt.order_id for receipt in self.receipts), {'ORD1'})
+
+    def test_long_message_stops_at_a_failed_segment(self):
+        self.smsc.throttle_every = 2
+        self.client.max_throttle_retries = 0
+
+        async def test():
+            await self.client.start(timeout=5)
+            await self.client.submit_message('ORD1', '255700000000', u'Malipo ✓ ' * 30)
+        with self.assertRaises(SMPPError) as raised:
+            self.wait(test())
+        self.assertEqual(len(raised.exception.message_ids), 1)
+        # the second of five segments was refused, and no later one sent
+        self.assertEqual(self.smsc.submits, 2)
+        self.assertEqual(len(self.smsc.messages), 1)
+
+    def test_not_started(self):
+        with self.assertRaises(SMPPConnectionError):
+            self.wait(self.client.submit('ORD1', '255700000000', b'x'))
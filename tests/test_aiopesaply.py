@@ -0,0 +1,9 @@
+"""
+Tests of `aiopesaply.AsyncPesaplyMM`. They are coroutines, which are
+syntax errors before Python 3.5, so they are in `aiopesaply_cases` and
+only imported here from 3.5 on.
+"""
+import sys
+
+if sys.version_info >= (3, 5):
+    from .aiopesaply_cases import AsyncPesaplyMMTest
@@ -0,0 +1,104 @@
+"""
+Tests of the checkout amounts (`MinorAmount` against `Amount`) and of the
+verification of gateway callbacks by `SignatureVerifier`, whose expected
+signatures are built with `sarafu._build_sig` from every token.
+"""
+from decimal import Decimal
+import sys
+import unittest
+
+from ..gateway import KSH, TSH, USD, USH, Amount, MinorAmount, SignatureError, \
+    _rescale, sarafu, sarafu_URL_EN
+
+CALLBACK = {'OrderID': 'ORD1', 'ResponseCode': '1', 'ReasonCode': '1',
+            'ReasonDesc': 'Approved', 'ReferenceNo': 'REF1', 'AuthCode': 'A1',
+            'ECI': '05', 'IP': '196.0.0.1', 'CountryIP': 'TZ', 'CountryBIN': 'TZ',
+            'ONUS': '1', 'Time': '20160801120000', 'OTPPhone': '255700000000',
+            'PhoneCountry': 'TZ'}
+SIG2_FIELDS = ('ECI', 'IP', 'CountryIP', 'CountryBIN', 'ONUS', 'Time', 'OTPPhone',
+               'PhoneCountry')
+
+
+class MinorAmountTest(unittest.TestCase):
+
+    def test_same_string_as_amount(self):
+        for currency, amount in ((TSH, '1250.50'), (KSH, '0.05'), (USD, '99999.99'),
+                                 (USH, '100'), (TSH, '0')):
+            amount = Decimal(amount)
+            minor = MinorAmount.from_decimal(amount, currency)
+            self.assertEqual(minor.amount_as_string(), Amount(amount, currency).amount_as_string())
+            self.assertEqual(minor.amount, amount)
+            self.assertEqual(MinorAmount.from_amount(Amount(amount, currency)), minor)
+
+    def test_minor_units(self):
+        self.assertEqual(MinorAmount.from_decimal(Decimal('1250.50'), TSH), MinorAmount(125050, TSH))
+        self.assertEqual(MinorAmount.from_decimal(Decimal('100'), USH), MinorAmount(100, USH))
+
+    def test_fractions_of_minor_units_are_refused(self):
+        self.assertRaises(ValueError, MinorAmount.from_decimal, Decimal('100.50'), USH)
+        self.assertRaises(ValueError, MinorAmount.from_decimal, Decimal('1.005'), TSH)
+        self.assertRaises(ValueError, MinorAmount.from_amount, Amount(Decimal('0.001'), USD))
+
+    def test_rescale_rounds_half_even(self):
+        self.assertEqual([_rescale(minor, 2, 0) for minor in (125, 150, 250, 350, 351)],
+                         [1, 2, 2, 4, 4])
+        self.assertEqual([_rescale(minor, 2, 0) for minor in (-125, -150, -250)], [-1, -2, -2])
+        self.assertEqual(_rescale(7, 0, 2), 700)
+        self.assertEqual(MinorAmount(125050, TSH).amount_as_string(0), '000000001250')
+        self.assertEqual(MinorAmount(125150, TSH).amount_as_string(0), '000000001252')
+
+
+@unittest.skipIf(sys.version_info[0] > 2, 'gateway signatures need Python 2')
+class SignatureVerifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gateway = sarafu(sarafu_URL_EN, 'MER1', 'secret', 'ACQ1')
+        self.verifier = self.gateway.verifier
+
+    def callback(self, **fields):
+        post = dict(CALLBACK, **fields)
+        post['Signature'] = sarafu._build_sig(['secret', 'MER1', 'ACQ1', post['OrderID']])
+        post['Signature2'] = sarafu._build_sig([post[name] for name in SIG2_FIELDS])
+        return post
+
+    def test_good_signatures(self):
+        post = self.callback()
+        self.assertTrue(self.verifier.verify_sig1(post['Signature'], 'ORD1'))
+        self.assertTrue(self.verifier.verify_sig1(post['Signature'].decode('ascii'), 'ORD1'))
+        self.assertTrue(self.verifier.verify_sig2(post['Signature2'],
+                                                  *[post[name] for name in SIG2_FIELDS]))
+        response = self.gateway.parse_response(post)
+        self.assertEqual((response.order_id, response.response_code, response.refno),
+                         ('ORD1', '1', 'REF1'))
+
+    def test_tampered_signatures(self):
+        post = self.callback()
+        self.assertFalse(self.verifier.verify_sig1(post['Signature'], 'ORD2'))
+        self.assertFalse(self.verifier.verify_sig1(u'\xe9' + post['Signature'][1:], 'ORD1'))
+        self.assertRaises(SignatureError, self.verifier.parse, dict(post, OrderID='ORD2'))
+        self.assertRaises(SignatureError, self.verifier.parse, dict(post, IP='196.0.0.2'))
+        self.assertRaises(SignatureError, self.verifier.parse,
+                          dict(post, Signature2=post['Signature']))
+
+    def test_missing_signatures(self):
+        for name in ('Signature', 'Signature2'):
+            post = self.callback()
+            del post[name]
+            self.assertRaises(SignatureError, self.verifier.parse, post)
+        self.assertFalse(self.verifier.verify_sig1(None, 'ORD1'))
+
+    def test_new_password(self):
+        post = self.callback()
+        self.gateway.parse_response(post)
+        self.gateway.password = 'changed'
+        self.assertRaises(SignatureError, self.gateway.parse_response, post)
+
+    def test_verify_many(self):
+        posts = [self.callback(), dict(self.callback(OrderID='ORD2'), OrderID='ORD3'),
+                 self.callback(OrderID='ORD4')]
+        results = list(self.verifier.verify_many(posts))
+        self.assertEqual([post for post, response, error in results], posts)
+        self.assertEqual([response and response.order_id for post, response, error in results],
+                         ['ORD1', None, 'ORD4'])
+        self.assertEqual([type(error) for post, response, error in results],
+                         [type(None), SignatureError, type(None)])
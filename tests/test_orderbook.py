@@ -0,0 +1,64 @@
+"""
+Tests of `orderbook.OrderBook`: quotes, depth and cancels, and orders
+which are refused without changing the book.
+"""
+import unittest
+
+from ..orderbook import OrderBook
+from ..orders import Lot, Order, TradeType
+
+
+def order(trade_type, lots=(), limit=None, total_quantity=None):
+    if total_quantity is None:
+        total_quantity = sum(quantity for price, quantity in lots)
+    return Order(symbol=u'GOOG', trade_type=trade_type, limit=limit,
+                 total_quantity=total_quantity,
+                 lots=[Lot(price=price, quantity=quantity) for price, quantity in lots])
+
+
+class OrderBookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.book = OrderBook()
+        self.book.add('b1', order(TradeType.BUY, [(100, 1), (99, 4)]))
+        self.book.add('b2', order(TradeType.CALL, limit=100, total_quantity=2))
+        self.book.add('a1', order(TradeType.SELL, [(102, 3)]))
+
+    def test_quote_and_depth(self):
+        self.assertEqual(self.book.quote(u'GOOG'), ((100, 3), (102, 3)))
+        self.assertEqual(self.book.depth(u'GOOG'), ([(100, 3), (99, 4)], [(102, 3)]))
+        self.assertEqual(self.book.quote(u'AAPL'), (None, None))
+
+    def test_cancel(self):
+        self.book.cancel('b2')
+        self.book.cancel('a1')
+        self.assertEqual(self.book.quote(u'GOOG'), ((100, 1), None))
+        self.assertEqual(len(self.book), 1)
+
+    def test_duplicate(self):
+        self.assertRaises(ValueError, self.book.add, 'a1', order(TradeType.SELL, [(101, 1)]))
+        self.assertEqual(self.book.quote(u'GOOG'), ((100, 3), (102, 3)))
+
+    def test_invalid_orders_leave_the_book_unchanged(self):
+        for bad in (order(TradeType.SELL, [(101, 1), (1 << 63, 1)]),
+                    order(TradeType.SELL, [(101, 1), (-1 << 64, 1)]),
+                    order(TradeType.SELL, [(101, 1), (103, 0)]),
+                    order(TradeType.SELL, [(101, 1), (103, -2)]),
+                    order(TradeType.SELL, [(101, 1), (103, 1 << 63)]),
+                    order(TradeType.SELL, limit=101, total_quantity=0),
+                    order(TradeType.BUY, limit=1 << 63, total_quantity=1)):
+            self.assertRaises(ValueError, self.book.add, 'bad', bad)
+        bad = order(TradeType.SELL, [(101, 1)])
+        bad.lots.append(Lot(price=103))
+        self.assertRaises(ValueError, self.book.add, 'bad', bad)
+        self.assertNotIn('bad', self.book)
+        self.assertEqual(len(self.book), 3)
+        self.assertEqual(self.book.depth(u'GOOG'), ([(100, 3), (99, 4)], [(102, 3)]))
+
+    def test_level_overflow_is_taken_back(self):
+        big = (1 << 63) - 3
+        self.book.add('a2', order(TradeType.SELL, [(103, big)]))
+        self.assertRaises(ValueError, self.book.add, 'a3',
+                          order(TradeType.SELL, [(101, 1), (102, 1), (103, 5)]))
+        self.assertNotIn('a3', self.book)
+        self.assertEqual(self.book.depth(u'GOOG'), ([(100, 3), (99, 4)], [(102, 3), (103, big)]))
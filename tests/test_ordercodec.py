@@ -0,0 +1,129 @@
+"""
+Tests of the `ordercodec` binary encoding of `orders` messages.
+"""
+import struct
+import time
+import unittest
+
+from protorpc import messages
+
+from ..ordercodec import FrameReader, codec_for, decode_frames, encode_frames
+from ..orders import Lot, Order, TradeType
+
+SYMBOLS = [u'GOOG', u'AAPL', u'TBL', u'CRDB']
+TRADE_TYPES = [TradeType.BUY, TradeType.SELL, TradeType.SHORT, TradeType.CALL]
+
+
+class Basket(messages.Message):
+    """Repeated fields of every kind the codec decodes with a count"""
+    prices = messages.IntegerField(1, repeated=True)
+    symbols = messages.StringField(2, repeated=True)
+    orders = messages.MessageField(Order, 3, repeated=True)
+    lots = messages.MessageField(Lot, 4, repeated=True)
+
+
+def make_orders(count):
+    orders = []
+    for i in range(count):
+        lots = [Lot(price=300 + (i + j) % 20, quantity=1 + (i * j) % 50) for j in range(i % 5)]
+        order = Order(symbol=SYMBOLS[i % len(SYMBOLS)],
+                      total_quantity=sum(lot.quantity for lot in lots),
+                      trade_type=TRADE_TYPES[i % 4], lots=lots)
+        if i % 3:
+            order.limit = 310 + i % 7
+        orders.append(order)
+    return orders + [Order(symbol=u'Ng\u2019ombe', total_quantity=0, trade_type=TradeType.CALL)]
+
+
+def with_count(data, offset, count):
+    """`data` with the count at `offset` replaced"""
+    return data[:offset] + struct.pack('<I', count) + data[offset + 4:]
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.orders = make_orders(100)
+        self.codec = codec_for(Order)
+
+    def test_messages(self):
+        for order in self.orders:
+            self.assertEqual(self.codec.decode(self.codec.encode(order)), order)
+
+    def test_all_kinds(self):
+        basket = Basket(prices=[1, -2, 1 << 40], symbols=[u'GOOG', u'Ng\u2019ombe'],
+                        orders=self.orders[:5], lots=self.orders[4].lots)
+        codec = codec_for(Basket)
+        self.assertEqual(codec.decode(codec.encode(basket)), basket)
+        self.assertEqual(codec.decode(codec.encode(Basket())), Basket())
+
+    def test_frames(self):
+        data = encode_frames(Order, self.orders)
+        self.assertEqual(decode_frames(Order, data), self.orders)
+
+    def test_stream_split_anywhere(self):
+        data = encode_frames(Order, self.orders[:6])
+        for split in range(len(data) + 1):
+            reader = FrameReader(Order)
+            self.assertEqual(reader.feed(data[:split]) + reader.feed(data[split:]),
+                             self.orders[:6], split)
+            self.assertEqual(reader.buffered, 0)
+
+
+class ErrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = codec_for(Order)
+
+    def test_invalid_orders(self):
+        bad = make_orders(5)
+        bad[1].symbol = None
+        bad[3].lots[0].price = 1 << 63
+        self.assertEqual([i for i, error in self.codec.errors(bad)], [1, 3])
+        with self.assertRaises(messages.ValidationError) as raised:
+            encode_frames(Order, bad)
+        self.assertIn('1: Order.symbol is required', str(raised.exception))
+
+    def test_truncated(self):
+        data = encode_frames(Order, make_orders(3))
+        self.assertRaises(messages.DecodeError, decode_frames, Order, data[:-1])
+        order = self.codec.encode(make_orders(3)[2])
+        self.assertRaises(messages.DecodeError, self.codec.decode, order[:-1])
+        self.assertRaises(messages.DecodeError, self.codec.decode, order + b'\0')
+
+    def test_frame_too_long(self):
+        data = encode_frames(Order, make_orders(2))
+        self.assertRaises(messages.DecodeError, FrameReader(Order, max_length=8).feed, data)
+
+    def test_corrupt_lots_count(self):
+        # an order without lots ends with their count
+        data = encode_frames(Order, [Order(symbol=u'GOOG', total_quantity=0,
+                                           trade_type=TradeType.BUY, limit=300)])
+        for count in (1, 50 * 1000 * 1000, 0xFFFFFFFF):
+            start = time.time()
+            self.assertRaises(messages.DecodeError, FrameReader(Order).feed,
+                              with_count(data, len(data) - 4, count))
+            self.assertLess(time.time() - start, 0.5)
+
+    def test_corrupt_counts(self):
+        codec = codec_for(Basket)
+        empty = codec.encode(Basket())
+        self.assertEqual(len(empty), 16)
+        for offset in range(0, 16, 4):
+            for count in (1, 50 * 1000 * 1000, 0xFFFFFFFF):
+                self.assertRaises(messages.DecodeError, codec.decode,
+                                  with_count(empty, offset, count))
+
+    def test_corrupt_string_length(self):
+        data = self.codec.encode(Order(symbol=u'GOOG', total_quantity=0,
+                                       trade_type=TradeType.BUY))
+        # the symbol follows the bitmap and the scalars
+        offset = len(data) - 4 - 4 - 4
+        self.assertRaises(messages.DecodeError, self.codec.decode,
+                          with_count(data, offset, 0xFFFFFFFF))
+
+    def test_unknown_enum(self):
+        data = bytearray(self.codec.encode(Order(symbol=u'GOOG', total_quantity=0,
+                                                 trade_type=TradeType.BUY)))
+        data[1 + 8] = 9  # trade_type, after the bitmap and total_quantity
+        self.assertRaises(messages.DecodeError, self.codec.decode, bytes(data))
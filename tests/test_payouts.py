@@ -0,0 +1,130 @@
+"""
+Tests of `payouts.PayoutEngine` against a stand-in for `pesaplyMM`, and
+of resuming from its `Journal`. Requires Python 2.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from ..exceptions import InvalidAccountException
+from ..payouts import FAILED, PAID, STARTED, UNKNOWN, Journal, Payout, PayoutEngine, \
+    payout_key, read_payouts
+
+
+class StandInMM(object):
+    """Pays everyone but the recipients in `refused`, recording the payments"""
+
+    def __init__(self):
+        self.payments = []
+        self.refused = set()
+        self._lock = threading.Lock()
+
+    def _clone(self):
+        return self
+
+    def close(self):
+        pass
+
+    def make_payment(self, recipient, amount, description=None):
+        if recipient in self.refused:
+            raise InvalidAccountException
+        with self._lock:
+            self.payments.append((recipient, amount, description))
+            return 'TX%d' % len(self.payments)
+
+
+@unittest.skipIf(sys.version_info[0] > 2, 'payouts needs Python 2')
+class PayoutEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.dir, 'payouts.journal')
+        self.mm = StandInMM()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_batch(self, payouts, batch='payroll'):
+        engine = PayoutEngine(self.mm, self.journal, workers=2, rate=1000)
+        try:
+            return [(r['recipient'], r['status']) for r in engine.run(payouts, batch)]
+        finally:
+            engine.journal.close()
+
+    def write_journal(self, *entries):
+        with open(self.journal, 'wb') as f:
+            for key, state in entries:
+                f.write(json.dumps({'key': key, 'state': state}) + '\n')
+
+    def test_identical_rows_are_paid_once_each(self):
+        rows = [('A', '100'), ('B', '50'), ('B', '50')]
+        self.assertEqual(self.run_batch(rows), [('A', PAID), ('B', PAID), ('B', PAID)])
+        self.assertEqual(self.run_batch(rows), [('A', PAID), ('B', PAID), ('B', PAID)])
+        self.assertEqual(sorted(self.mm.payments),
+                         [('A', '100', None), ('B', '50', None), ('B', '50', None)])
+
+    def test_fixed_or_removed_row_does_not_change_later_keys(self):
+        self.mm.refused.add('X')
+        self.assertEqual(self.run_batch([('A', '100'), ('X', '10'), ('C', '30'), ('C', '30')]),
+                         [('A', PAID), ('X', FAILED), ('C', PAID), ('C', PAID)])
+        self.assertEqual(self.run_batch([('A', '100'), ('C', '30'), ('C', '30')]),
+                         [('A', PAID), ('C', PAID), ('C', PAID)])
+        self.assertEqual(self.run_batch([('A', '100'), ('B', '10'), ('C', '30'), ('C', '30')]),
+                         [('A', PAID), ('B', PAID), ('C', PAID), ('C', PAID)])
+        self.assertEqual(sorted(self.mm.payments), [('A', '100', None), ('B', '10', None),
+                                                    ('C', '30', None), ('C', '30', None)])
+
+    def test_keys(self):
+        key = payout_key('payroll', 'A', '100')
+        self.assertEqual(key, payout_key('payroll', 'A', '100', None, 0))
+        self.assertNotEqual(key, payout_key('payroll', 'A', '100', occurrence=1))
+        self.assertNotEqual(key, payout_key('payroll-2', 'A', '100'))
+        self.assertNotEqual(key, payout_key('payroll', 'A', '100', 'August'))
+
+    def test_resume(self):
+        self.write_journal(('started', STARTED), ('paid', PAID), ('failed', FAILED),
+                           ('unknown', UNKNOWN))
+        payouts = [Payout(key, key, '10') for key in ('started', 'paid', 'failed', 'unknown')]
+        # started by a run that crashed: it may have been paid
+        self.assertEqual(self.run_batch(payouts),
+                         [('started', UNKNOWN), ('paid', PAID), ('failed', PAID),
+                          ('unknown', UNKNOWN)])
+        self.assertEqual(self.mm.payments, [('failed', '10', None)])
+        states = Journal(self.journal).states
+        self.assertEqual(states['started']['state'], UNKNOWN)
+        self.assertEqual(states['failed']['state'], PAID)
+
+    def test_key_of_two_payouts(self):
+        payouts = [Payout('k1', 'A', '10'), Payout('k1', 'A', '20')]
+        self.assertRaises(ValueError, self.run_batch, payouts)
+        self.assertEqual(self.run_batch([Payout('k1', 'A', '10')] * 2), [('A', PAID)] * 2)
+        self.assertEqual(self.mm.payments, [('A', '10', None)])
+
+    def test_batch_is_required(self):
+        self.assertRaises(ValueError, self.run_batch, [('A', '10')], batch='')
+
+    def test_torn_last_line(self):
+        self.write_journal(('k1', PAID))
+        with open(self.journal, 'ab') as f:
+            f.write('{"key": "k2", "sta')
+        journal = Journal(self.journal)
+        self.assertEqual(list(journal.states), ['k1'])
+        journal.record('k3', STARTED)
+        journal.close()
+        self.assertEqual(sorted(Journal(self.journal).states), ['k1', 'k3'])
+
+    def test_read_payouts(self):
+        path = os.path.join(self.dir, 'payouts.csv')
+        with open(path, 'wb') as f:
+            f.write('recipient,amount,description,key\r\n'
+                    'A,100,August,\r\nA,100,August,\r\nB,50,,own\r\n')
+        payouts = list(read_payouts(path, 'payroll'))
+        self.assertEqual([p.key for p in payouts],
+                         [payout_key('payroll', 'A', '100', 'August'),
+                          payout_key('payroll', 'A', '100', 'August', 1), 'own'])
+        self.assertEqual(payouts[2].description, None)
+        self.assertEqual(self.run_batch(path), [('A', PAID), ('A', PAID), ('B', PAID)])
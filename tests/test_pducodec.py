@@ -0,0 +1,104 @@
+"""
+Tests of the `pducodec` SMPP codec, against the deliver_sm sample of pdu.py.
+"""
+import binascii
+import unittest
+
+from ..pducodec import (DeliverSM, EnquireLink, PDUEncoder, PDUError, PDUReader, SubmitSM,
+                        SubmitSMResp, TAG_RECEIPTED_MESSAGE_ID, decode)
+
+SAMPLE = binascii.a2b_hex(
+    '0000004d00000005000000009f88f12441575342440001013136353035353531323334000101'
+    '313737333535353430373000000000000000000300117468657265206973206e6f2073706f6f6e')
+
+
+def viewed(value, data):
+    """Is memoryview `value` a view of `data` (when Python tells)?"""
+    return isinstance(value, memoryview) and getattr(value, 'obj', data) is data
+
+
+class DecodeTest(unittest.TestCase):
+
+    def test_sample(self):
+        pdu, end = decode(SAMPLE)
+        self.assertEqual(end, len(SAMPLE))
+        self.assertIsInstance(pdu, DeliverSM)
+        self.assertEqual((pdu.sequence, pdu.status), (0x9f88f124, 0))
+        self.assertEqual(pdu.service_type, b'AWSBD')
+        self.assertEqual((pdu.source_addr_ton, pdu.source_addr_npi, pdu.source_addr),
+                         (1, 1, b'16505551234'))
+        self.assertEqual((pdu.dest_addr_ton, pdu.dest_addr_npi, pdu.destination_addr),
+                         (1, 1, b'17735554070'))
+        self.assertEqual(pdu.data_coding, 3)
+        self.assertEqual(pdu.short_message.tobytes(), b'there is no spoon')
+        self.assertTrue(viewed(pdu.short_message, SAMPLE))
+
+    def test_sample_round_trip(self):
+        pdu = decode(SAMPLE)[0]
+        self.assertEqual(PDUEncoder(16).encode(pdu).tobytes(), SAMPLE)
+
+    def test_part_of_a_buffer(self):
+        data = bytearray(b'\0' * 7 + SAMPLE + b'\0' * 5)
+        view = memoryview(data)[7:7 + len(SAMPLE)]
+        pdu, end = decode(view)
+        self.assertEqual(pdu, decode(SAMPLE)[0])
+        self.assertTrue(viewed(pdu.short_message, data))
+        self.assertEqual(decode(data, 7), (pdu, 7 + len(SAMPLE)))
+
+    def test_round_trips(self):
+        for pdu in (SubmitSMResp(7, message_id=b'abc123'),
+                    DeliverSM(8, short_message=b'id:abc123 stat:DELIVRD',
+                              tlvs={TAG_RECEIPTED_MESSAGE_ID: b'abc123\0'}),
+                    SubmitSM(9, source_addr=b'SARAFU', destination_addr=b'255700000000',
+                             registered_delivery=1, short_message=b'Payment received'),
+                    EnquireLink(10)):
+            self.assertEqual(decode(PDUEncoder().encode(pdu).tobytes())[0], pdu)
+
+    def test_malformed(self):
+        self.assertRaises(PDUError, decode, SAMPLE[:15])
+        self.assertRaises(PDUError, decode, SAMPLE[:-1])
+        self.assertRaises(PDUError, decode, b'\0\0\0\x08' + SAMPLE[4:])
+        unterminated = bytearray(SAMPLE)
+        unterminated[21] = ord('x')  # the NUL after service_type
+        self.assertRaises(PDUError, decode, bytes(unterminated))
+
+
+class PDUReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pdus = [decode(SAMPLE)[0], SubmitSMResp(7, message_id=b'abc123'),
+                     DeliverSM(8, short_message=b'id:abc123 stat:DELIVRD',
+                               tlvs={TAG_RECEIPTED_MESSAGE_ID: b'abc123\0'})]
+        self.stream = PDUEncoder().encode_many(self.pdus).tobytes()
+
+    def test_split_anywhere(self):
+        for split in range(len(self.stream) + 1):
+            reader = PDUReader()
+            pdus = reader.feed(self.stream[:split]) + reader.feed(self.stream[split:])
+            self.assertEqual(pdus, self.pdus, split)
+            self.assertEqual(reader.buffered, 0)
+
+    def test_octet_by_octet(self):
+        reader = PDUReader()
+        pdus = []
+        for i in range(len(self.stream)):
+            pdus += reader.feed(self.stream[i:i + 1])
+        self.assertEqual(pdus, self.pdus)
+
+    def test_only_the_split_pdu_is_copied(self):
+        split = len(SAMPLE) + 5
+        head, rest = self.stream[:split], bytearray(self.stream[split:])
+        reader = PDUReader()
+        self.assertEqual(reader.feed(head), self.pdus[:1])
+        self.assertEqual(reader.buffered, 5)
+        pdus = reader.feed(memoryview(rest))
+        self.assertEqual(pdus, self.pdus[1:])
+        # the PDU after the split one is decoded from the chunk itself
+        self.assertTrue(viewed(pdus[1].short_message, rest))
+
+    def test_bad_length(self):
+        self.assertRaises(PDUError, PDUReader().feed, b'\0\0\0\x04' + b'\0' * 12)
+        self.assertRaises(PDUError, PDUReader(max_length=64).feed, SAMPLE)
+        reader = PDUReader()
+        reader.feed(b'\0\0')
+        self.assertRaises(PDUError, reader.feed, b'\0\x08' + b'\0' * 12)
@@ -0,0 +1,280 @@
+"""
+Tests of the `PaymentProfileOutbox` (settings.PAYMENT_PROFILE_OUTBOX)
+against a stand-in for Authorize.NET CIM, which keeps the remote payment
+profiles and the calls made to it, and of the webhook view and consumers.
+"""
+from datetime import date, timedelta
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from .. import profile
+from ..conf import settings
+from ..exceptions import BillingError
+from ..profile import CustomerPaymentProfile, CustomerProfile, PaymentProfileOutbox, \
+    handle_incoming_messages, webhook
+from ..webhooks import ConsumerPool, WebhookQueue
+
+CARD = '4111111111111111'
+
+
+class Response(object):
+
+    def __init__(self, success=True):
+        self.success = success
+
+    def raise_if_error(self):
+        if not self.success:
+            raise ValueError('CIM error')
+
+
+class StandInCIM(object):
+    """The CIM calls `profile` makes, on payment profiles kept in memory"""
+
+    def __init__(self):
+        # profile id -> {payment profile id: payment profile}
+        self.profiles = {}
+        self.calls = []
+        self.down = False
+        self._ids = itertools.count(1)
+
+    def _call(self, name, card=None):
+        self.calls.append((name, card and card['card_number'], card and card['card_code']))
+        if self.down:
+            raise IOError('Authorize.NET is down')
+
+    def _payment_profile(self, payment_profile_id, data):
+        return {'payment_profile_id': payment_profile_id,
+                'billing': {'city': data['city']},
+                'credit_card': {'card_number': 'XXXX' + data['card_number'][-4:]}}
+
+    def get_profile(self, profile_id):
+        self._call('get_profile')
+        if profile_id not in self.profiles:
+            return {'response': Response(False)}
+        return {'response': Response(),
+                'payment_profiles': list(self.profiles[profile_id].values())}
+
+    def create_payment_profile(self, profile_id, billing, card):
+        self._call('create', card)
+        payment_profile_id = 'PP%d' % next(self._ids)
+        self.profiles[profile_id][payment_profile_id] = self._payment_profile(
+            payment_profile_id, card)
+        return {'response': Response(), 'payment_profile_id': payment_profile_id}
+
+    def update_payment_profile(self, profile_id, payment_profile_id, billing, card):
+        self._call('update', card)
+        remote = self.profiles[profile_id][payment_profile_id]
+        if not card['card_number'].startswith('XXXX'):
+            remote['credit_card']['card_number'] = 'XXXX' + card['card_number'][-4:]
+        remote['billing']['city'] = card['city']
+        return Response()
+
+    def calls_of(self, name):
+        return [call for call in self.calls if call[0] == name]
+
+
+class OutboxTest(TestCase):
+
+    def setUp(self):
+        self.cim = StandInCIM()
+        self.patched = {}
+        for name in ('create_payment_profile', 'update_payment_profile'):
+            self.patch(profile, name, getattr(self.cim, name))
+        self.patch(profile.profile_cache, 'fetch', self.cim.get_profile)
+        self.patch(settings, 'PAYMENT_PROFILE_OUTBOX', True)
+
+        Customer = CustomerProfile._meta.get_field('customer').related_model
+        self.customer = Customer.objects.create()
+        CustomerProfile(customer=self.customer, profile_id='P1').save(sync=False)
+        self.cim.profiles['P1'] = {}
+
+    def patch(self, obj, name, value):
+        self.patched[obj, name] = getattr(obj, name, None)
+        setattr(obj, name, value)
+
+    def tearDown(self):
+        for (obj, name), value in self.patched.items():
+            setattr(obj, name, value)
+
+    def new_payment_profile(self, **fields):
+        fields = dict(dict(card_number=CARD, card_code='123', city='Dar es Salaam',
+                           expiration_date=date(2030, 1, 1)), **fields)
+        payment_profile = CustomerPaymentProfile(customer=self.customer, **fields)
+        payment_profile.save()
+        return payment_profile
+
+    def test_new_card_is_pushed_and_not_stored(self):
+        payment_profile = self.new_payment_profile()
+        self.assertEqual(self.cim.calls_of('create'), [('create', CARD, '123')])
+        self.assertFalse(PaymentProfileOutbox.objects.exists())
+        saved = CustomerPaymentProfile.objects.get()
+        self.assertEqual(saved.payment_profile_id, payment_profile.payment_profile_id)
+        self.assertEqual(saved.card_number, 'XXXX1111')
+        # nothing of the card beyond its last four digits is in the database
+        for table in connection.introspection.table_names():
+            if table.startswith('sarafu_'):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT * FROM %s' % connection.ops.quote_name(table))
+                    for row in cursor.fetchall():
+                        self.assertFalse([v for v in row if CARD in repr(v) or v == '123'])
+
+    def test_update_is_queued_and_drained(self):
+        payment_profile = self.new_payment_profile()
+        del self.cim.calls[:]
+        payment_profile.update(city='Arusha')
+        self.assertEqual(self.cim.calls, [])
+        self.assertEqual(PaymentProfileOutbox.objects.count(), 1)
+
+        self.assertEqual(PaymentProfileOutbox.objects.drain(), (1, 0))
+        self.assertEqual(self.cim.calls, [('update', 'XXXX1111', None)])
+        remote = self.cim.profiles['P1'][payment_profile.payment_profile_id]
+        self.assertEqual(remote['billing']['city'], 'Arusha')
+        self.assertFalse(PaymentProfileOutbox.objects.exists())
+
+    def test_repeated_updates_are_pushed_once(self):
+        payment_profile = self.new_payment_profile()
+        del self.cim.calls[:]
+        for city in ('Arusha', 'Mwanza', 'Dodoma'):
+            payment_profile.update(city=city)
+        self.assertEqual(PaymentProfileOutbox.objects.drain(), (1, 0))
+        self.assertEqual(len(self.cim.calls_of('update')), 1)
+        remote = self.cim.profiles['P1'][payment_profile.payment_profile_id]
+        self.assertEqual(remote['billing']['city'], 'Dodoma')
+
+    def test_failed_push_is_retried_later(self):
+        payment_profile = self.new_payment_profile()
+        payment_profile.update(city='Arusha')
+        self.cim.down = True
+        self.assertEqual(PaymentProfileOutbox.objects.drain(), (0, 1))
+        entry = PaymentProfileOutbox.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+        self.assertIn('down', entry.last_error)
+        self.assertEqual(PaymentProfileOutbox.objects.drain(), (0, 0))
+
+        self.cim.down = False
+        PaymentProfileOutbox.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(PaymentProfileOutbox.objects.drain(), (1, 0))
+        self.assertFalse(PaymentProfileOutbox.objects.exists())
+
+    def test_new_card_on_existing_profile_is_pushed(self):
+        payment_profile = self.new_payment_profile()
+        del self.cim.calls[:]
+        payment_profile.update(card_number='5555555555554444', card_code='321')
+        self.assertEqual(self.cim.calls, [('update', '5555555555554444', '321')])
+        self.assertFalse(PaymentProfileOutbox.objects.exists())
+
+    def test_push_repeated_after_crash_before_done(self):
+        payment_profile = self.new_payment_profile()
+        payment_profile.update(city='Arusha')
+        # pushed, but the worker died before removing the entry
+        PaymentProfileOutbox.objects.get().push()
+        self.assertEqual(PaymentProfileOutbox.objects.drain(), (1, 0))
+        self.assertEqual(len(self.cim.calls_of('update')), 2)
+        self.assertEqual(len(self.cim.calls_of('create')), 1)
+        self.assertEqual(len(self.cim.profiles['P1']), 1)
+
+    def test_create_is_not_repeated_after_crash_before_save(self):
+        save = CustomerPaymentProfile._save_masked
+        saves = []
+
+        def crash(self, *args, **kwargs):
+            saves.append(self.payment_profile_id)
+            if self.payment_profile_id:
+                raise IOError('crashed after the push')
+            save(self, *args, **kwargs)
+        CustomerPaymentProfile._save_masked = crash
+        try:
+            self.assertRaises(IOError, self.new_payment_profile)
+        finally:
+            CustomerPaymentProfile._save_masked = save
+        self.assertEqual(len(self.cim.profiles['P1']), 1)
+        saved = CustomerPaymentProfile.objects.get()
+        self.assertEqual((saved.payment_profile_id, saved.create_pending), ('', True))
+
+        # left for reconciliation, rather than created again
+        saved.card_number, saved.card_code = CARD, '123'
+        self.assertRaises(BillingError, saved.save)
+        self.assertEqual(len(self.cim.calls_of('create')), 1)
+        self.assertEqual(self.cim.calls_of('get_profile'), [])
+
+    def test_refused_create_saves_nothing(self):
+        create = self.cim.create_payment_profile
+        self.cim.create_payment_profile = lambda *args: dict(create(*args), response=Response(False))
+        self.patch(profile, 'create_payment_profile', self.cim.create_payment_profile)
+        self.assertRaises(ValueError, self.new_payment_profile)
+        self.assertFalse(CustomerPaymentProfile.objects.exists())
+
+    def test_failed_create_is_left_pending(self):
+        self.cim.down = True
+        self.assertRaises(IOError, self.new_payment_profile)
+        self.assertTrue(CustomerPaymentProfile.objects.get().create_pending)
+
+    def test_other_card_is_created(self):
+        self.new_payment_profile()
+        self.new_payment_profile(card_number='5555555555554444')
+        self.assertEqual(len(self.cim.calls_of('create')), 2)
+        self.assertEqual(len(self.cim.profiles['P1']), 2)
+
+
+class WebhookTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue = WebhookQueue(os.path.join(self.dir, 'webhook.db'))
+        self.saved = profile._webhook_queue, getattr(settings, 'WEBHOOK_REPLY_SENDER', None)
+        profile._webhook_queue = self.queue
+        self.sent = []
+
+    def tearDown(self):
+        profile._webhook_queue, settings.WEBHOOK_REPLY_SENDER = self.saved
+        self.queue.close()
+        shutil.rmtree(self.dir)
+
+    def post(self, **data):
+        data = dict(dict(secret='YOUR_WEBHOOK_SECRET_HERE', event='incoming_message',
+                         content='Hi', from_number='255700000000', phone_id='PN1'), **data)
+        response = webhook(RequestFactory().post('/webhook', data))
+        return response.status_code, json.loads(response.content.decode('utf-8'))
+
+    def consume(self, send):
+        return ConsumerPool(self.queue, lambda events: handle_incoming_messages(events, send)
+                            ).run_once()
+
+    def test_replies_in_the_response_without_a_sender(self):
+        settings.WEBHOOK_REPLY_SENDER = None
+        self.assertEqual(self.post(), (200, {'messages': [{'content': profile.AUTOREPLY}]}))
+        self.assertEqual(self.consume(None), 1)
+        self.assertEqual(self.queue.depth(), 0)
+
+    def test_sender_replies(self):
+        settings.WEBHOOK_REPLY_SENDER = 'sender.send'
+        self.assertEqual(self.post(), (200, {'messages': []}))
+        self.assertEqual(self.post(from_number='255711111111'), (200, {'messages': []}))
+        self.assertEqual(self.consume(self.sent.extend), 2)
+        self.assertEqual([reply['to_number'] for reply in self.sent],
+                         ['255700000000', '255711111111'])
+        self.assertEqual(self.queue.depth(), 0)
+
+    def test_bad_event_is_retried_alone(self):
+        self.queue.put({'event': 'incoming_message', 'from_number': '255700000000'})
+        self.queue.put({'event': 'incoming_message', 'from_number': '255711111111',
+                        'phone_id': 'PN1'})
+        self.assertEqual(self.consume(self.sent.extend), 2)
+        self.assertEqual([reply['to_number'] for reply in self.sent], ['255711111111'])
+        self.assertEqual(self.queue.depth(), 1)
+
+    def test_invalid(self):
+        self.assertEqual(webhook(RequestFactory().post('/webhook', {})).status_code, 403)
+        data = {'secret': 'YOUR_WEBHOOK_SECRET_HERE', 'event': 'incoming_message'}
+        for missing in ({}, {'from_number': '255700000000'}, {'phone_id': 'PN1'}):
+            request = RequestFactory().post('/webhook', dict(data, **missing))
+            self.assertEqual(webhook(request).status_code, 400)
+        self.assertEqual(self.queue.depth(), 0)
@@ -0,0 +1,124 @@
+"""
+Tests of `responsebuffer.ResponseBuffer`: flushing, validation, replay
+of the journal and setting aside rows which cannot be inserted.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError
+from django.test import TransactionTestCase
+
+from ..gateway import sarafuResponse
+from ..profile import Response
+from ..responsebuffer import ResponseBuffer
+
+
+class FailingBuffer(ResponseBuffer):
+    """Fails to insert any batch with a row of a trans_id in `failing`"""
+
+    failing = set()
+
+    def _insert(self, rows):
+        if any(row.get('trans_id') in self.failing for row in rows):
+            raise DatabaseError('refused')
+        super(FailingBuffer, self)._insert(rows)
+
+
+class ResponseBufferTest(TransactionTestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.buffers = []
+        FailingBuffer.failing = set()
+
+    def tearDown(self):
+        for buf in self.buffers:
+            buf.close()
+        shutil.rmtree(self.dir)
+
+    def buffer(self, **kwargs):
+        buf = FailingBuffer(Response, self.dir, max_delay=60, **kwargs)
+        self.buffers.append(buf)
+        return buf
+
+    def journal(self):
+        return sorted(name for name in os.listdir(self.dir) if name.endswith('.journal'))
+
+    def test_flush(self):
+        buf = self.buffer()
+        buf.add(sarafuResponse(order_id='O1', response_code='1', refno='T1'))
+        buf.add({'trans_id': 'T2', 'amount': '12.50'})
+        self.assertEqual(buf.metrics()['depth'], 2)
+        buf.flush()
+        self.assertEqual(sorted(Response.objects.values_list('trans_id', 'invoice_num')),
+                         [('T1', 'O1'), ('T2', '')])
+        metrics = buf.metrics()
+        self.assertEqual((metrics['depth'], metrics['flushes'], metrics['rows_flushed']), (0, 1, 2))
+        self.assertEqual(len(self.journal()), 1)
+
+    def test_invalid_values_are_refused(self):
+        buf = self.buffer()
+        self.assertRaises(ValidationError, buf.add, sarafuResponse(order_id='O' * 21))
+        self.assertRaises(ValidationError, buf.add, {'amount': '1,0x'})
+        self.assertEqual(buf.metrics()['depth'], 0)
+        buf.flush()
+        self.assertFalse(Response.objects.exists())
+
+    def test_failing_segment_does_not_block_others(self):
+        FailingBuffer.failing.add('BAD')
+        buf = self.buffer(max_attempts=3)
+        buf.add({'trans_id': 'BAD'})
+        buf.add({'trans_id': 'T1'})
+        buf.flush()
+        buf.add({'trans_id': 'T2'})
+        buf.flush()
+        self.assertEqual(list(Response.objects.values_list('trans_id', flat=True)), ['T2'])
+        self.assertEqual(buf.metrics()['depth'], 2)
+
+        buf.flush()
+        # its third failure: the rows are inserted one by one, and the
+        # one which fails is set aside
+        self.assertEqual(sorted(Response.objects.values_list('trans_id', flat=True)),
+                         ['T1', 'T2'])
+        metrics = buf.metrics()
+        self.assertEqual((metrics['depth'], metrics['dead_rows'], metrics['flush_errors']),
+                         (0, 1, 3))
+        dead = [name for name in os.listdir(self.dir) if name.endswith('.dead')]
+        self.assertEqual(len(dead), 1)
+        with open(os.path.join(self.dir, dead[0])) as f:
+            self.assertEqual([json.loads(line)['trans_id'] for line in f], ['BAD'])
+
+    def test_failed_segment_waits_to_be_retried(self):
+        FailingBuffer.failing.add('BAD')
+        buf = self.buffer()
+        buf.add({'trans_id': 'BAD'})
+        buf.flush()
+        buf._flush_pending()
+        self.assertEqual(buf.metrics()['flush_errors'], 1)
+
+    def test_replay(self):
+        with open(os.path.join(self.dir, '000000000007.journal'), 'wb') as f:
+            f.write(b'{"trans_id": "T1", "amount": "2.50"}\n{"trans_id": "T2"}\n{"trans_i')
+        Response.objects.create(trans_id='T1', amount='2.50')
+        buf = self.buffer()
+        self.assertEqual(buf.replayed, 2)
+        buf.flush()
+        self.assertEqual(sorted(Response.objects.values_list('trans_id', flat=True)),
+                         ['T1', 'T2'])
+        self.assertEqual(self.journal(), ['000000000008.journal'])
+
+    def test_failing_replay_does_not_prevent_start(self):
+        with open(os.path.join(self.dir, '000000000001.journal'), 'wb') as f:
+            f.write(b'{"trans_id": "T1"}\n')
+        FailingBuffer.failing.add('T1')
+        buf = self.buffer()
+        buf.add({'trans_id': 'T2'})
+        buf.flush()
+        self.assertEqual(list(Response.objects.values_list('trans_id', flat=True)), ['T2'])
+        FailingBuffer.failing.clear()
+        buf.flush()
+        self.assertEqual(sorted(Response.objects.values_list('trans_id', flat=True)),
+                         ['T1', 'T2'])
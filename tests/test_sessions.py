@@ -0,0 +1,81 @@
+"""
+Tests of `sessions.SessionPool`, with a login which counts the sessions
+it logs in.
+"""
+import time
+import unittest
+
+from ..sessions import SessionPool
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logins = []
+        self.failing = False
+        self.pool = SessionPool(self.login, ttl=100, refresh_margin=10)
+
+    def login(self, session):
+        if self.failing:
+            raise IOError('login refused')
+        self.logins.append(session)
+
+    def test_acquire_logs_in(self):
+        session = self.pool.acquire('2550000000', '0000')
+        self.assertEqual(self.logins, [session])
+        self.assertEqual((session.account, session.pin), ('2550000000', '0000'))
+        self.assertGreater(session.expires_at, time.time() + 80)
+
+    def test_released_session_is_reused(self):
+        session = self.pool.acquire('2550000000', '0000')
+        self.pool.release(session)
+        self.assertIs(self.pool.acquire('2550000000', '0000'), session)
+        self.assertEqual(len(self.logins), 1)
+        # not handed out twice
+        self.assertIsNot(self.pool.acquire('2550000000', '0000'), session)
+        self.assertEqual(len(self.logins), 2)
+
+    def test_other_pin_or_account_is_not_reused(self):
+        session = self.pool.acquire('2550000000', '0000')
+        self.pool.release(session)
+        self.assertIsNot(self.pool.acquire('2550000000', '1111'), session)
+        self.assertIsNot(self.pool.acquire('2551111111', '0000'), session)
+        self.assertEqual(len(self.logins), 3)
+
+    def test_expiring_session_is_logged_in_again(self):
+        session = self.pool.acquire('2550000000', '0000')
+        self.pool.release(session)
+        session.expires_at = time.time() + 5
+        self.assertIs(self.pool.acquire('2550000000', '0000'), session)
+        self.assertEqual(self.logins, [session, session])
+
+    def test_refresh_expiring(self):
+        sessions = [self.pool.acquire('2550000000', '0000') for i in range(3)]
+        for session in sessions:
+            self.pool.release(session)
+        sessions[0].expires_at = sessions[2].expires_at = time.time() + 5
+        del self.logins[:]
+        self.assertEqual(self.pool.refresh_expiring(), 2)
+        self.assertEqual(self.logins, [sessions[0], sessions[2]])
+        self.assertEqual(self.pool.refresh_expiring(), 0)
+        acquired = [self.pool.acquire('2550000000', '0000') for i in range(3)]
+        self.assertEqual(sorted(map(id, acquired)), sorted(map(id, sessions)))
+        self.assertEqual(len(self.logins), 2)
+
+    def test_session_failing_to_refresh_is_dropped(self):
+        session = self.pool.acquire('2550000000', '0000')
+        self.pool.release(session)
+        session.expires_at = time.time()
+        self.failing = True
+        self.assertEqual(self.pool.refresh_expiring(), 0)
+        self.failing = False
+        self.assertIsNot(self.pool.acquire('2550000000', '0000'), session)
+
+    def test_discard_and_max_idle(self):
+        sessions = [self.pool.acquire('2550000000', '0000') for i in range(6)]
+        for session in sessions:
+            self.pool.release(session)
+        self.pool.discard(sessions[3])
+        acquired = [self.pool.acquire('2550000000', '0000') for i in range(4)]
+        self.assertEqual(set(map(id, acquired[:3])), set(map(id, sessions[:3])))
+        self.assertEqual(len(self.logins), 7)
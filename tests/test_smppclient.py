@@ -0,0 +1,9 @@
+"""
+Tests of `smppclient.SMPPClient`. They are coroutines, which are syntax
+errors before Python 3.5, so they are in `smppclient_cases` and only
+imported here from 3.5 on.
+"""
+import sys
+
+if sys.version_info >= (3, 5):
+    from .smppclient_cases import SMPPClientTest
@@ -0,0 +1,85 @@
+"""
+Tests of `sync.TransactionSync` with a `SQLiteWatermarkStore`, against
+a stand-in for `pesaplyMM` whose export, like the real one's, also holds
+rows from a few hours before the window.
+"""
+from datetime import date, datetime, timedelta
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..sync import SQLiteWatermarkStore, TransactionSync
+
+
+class StandInMM(object):
+
+    account = '2550000000'
+
+    def __init__(self):
+        self.history = []
+        self.windows = []
+
+    def add(self, when, reference):
+        self.history.append({'date': when, 'reference': reference})
+
+    def iter_transactions(self, from_date=None, to_date=None):
+        self.windows.append((from_date, to_date))
+        begin = from_date and datetime.combine(from_date, datetime.min.time()) - timedelta(hours=3)
+        # newest first, as exported
+        return iter([txn for txn in reversed(self.history)
+                     if (begin is None or txn['date'] >= begin) and txn['date'] <= to_date])
+
+
+class TransactionSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.mm = StandInMM()
+        for day in range(1, 6):
+            for hour, suffix in ((9, 'a'), (22, 'b')):
+                self.mm.add(datetime(2016, 1, day, hour), 'T%d%s' % (day, suffix))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sync(self, to_date, **kwargs):
+        store = SQLiteWatermarkStore(os.path.join(self.dir, 'sync.db'))
+        sync = TransactionSync(self.mm, store, **kwargs)
+        return [txn['reference'] for txn in sync.sync(to_date)]
+
+    def seen(self):
+        store = SQLiteWatermarkStore(os.path.join(self.dir, 'sync.db'))
+        return sorted(row[0] for row in store._execute('SELECT reference FROM pesaply_sync_seen'))
+
+    def test_first_sync_from_initial_date(self):
+        self.assertEqual(self.sync(datetime(2016, 1, 3, 12), initial_date=date(2016, 1, 2)),
+                         ['T2a', 'T2b', 'T3a'])
+
+    def test_nothing_returned_twice(self):
+        self.assertEqual(self.sync(datetime(2016, 1, 3, 12)), ['T1a', 'T1b', 'T2a', 'T2b', 'T3a'])
+        # the window starts at midnight of 2 January, and the export goes
+        # back to 21:00 of the 1st
+        self.assertEqual(self.sync(datetime(2016, 1, 3, 12)), [])
+        self.assertEqual(self.mm.windows[-1][0], datetime(2016, 1, 2))
+        self.assertEqual(self.sync(datetime(2016, 1, 5, 12)), ['T3b', 'T4a', 'T4b', 'T5a'])
+        self.assertEqual(self.sync(datetime(2016, 1, 6)), ['T5b'])
+        self.assertEqual(self.sync(datetime(2016, 1, 6)), [])
+
+    def test_late_row_in_the_overlap(self):
+        self.sync(datetime(2016, 1, 3, 12))
+        self.mm.add(datetime(2016, 1, 2, 23), 'LATE')
+        self.assertEqual(self.sync(datetime(2016, 1, 3, 12)), ['LATE'])
+        self.assertEqual(self.sync(datetime(2016, 1, 3, 12)), [])
+
+    def test_seen_rows_are_pruned(self):
+        self.sync(datetime(2016, 1, 3, 12))
+        self.assertEqual(self.seen(), ['T2a', 'T2b', 'T3a'])
+        self.sync(datetime(2016, 1, 5, 12))
+        self.assertEqual(self.seen(), ['T4a', 'T4b', 'T5a'])
+
+    def test_longer_overlap(self):
+        overlap = timedelta(days=2)
+        self.sync(datetime(2016, 1, 3, 12), overlap=overlap)
+        self.assertEqual(self.seen(), ['T1a', 'T1b', 'T2a', 'T2b', 'T3a'])
+        self.assertEqual(self.sync(datetime(2016, 1, 4, 12), overlap=overlap), ['T3b', 'T4a'])
@@ -0,0 +1,193 @@
+"""
+Tests of `transactions.date_shards` and of `pesaplyMM.get_transactions_sharded`
+against a local stub of the pesaply web application. `pesaplyMM` needs
+Python 2 and mechanize; without them only `date_shards` is tested.
+"""
+from datetime import date, datetime, timedelta
+import os
+import threading
+import unittest
+
+try:
+    import BaseHTTPServer
+    import Cookie
+    import urlparse
+except ImportError:  # Python 3
+    import http.server as BaseHTTPServer
+    import http.cookies as Cookie
+    import urllib.parse as urlparse
+
+from ..transactions import date_shards
+
+
+def load_pesaply():
+    """
+    The `pesaply.py` module, which the `pesaply` Django project package
+    shadows, loaded from its path as a module of this package
+    """
+    import imp
+    package = __name__.rsplit('.', 2)[0]
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'pesaply.py')
+    return imp.load_source(package + '.pesaplymm', path)
+
+try:
+    pesaplyMM = load_pesaply().pesaplyMM
+except ImportError:
+    pesaplyMM = None
+
+HISTORY_FORM = '''<html><body>
+<form name="accountHistoryForm" method="GET" action="/do/member/accountHistory">
+<input type="hidden" name="query(period).begin" value="">
+<input type="hidden" name="query(period).end" value="">
+<input type="hidden" name="query(member)" value="">
+<input type="hidden" name="query(transactionNumber)" value="">
+</form></body></html>'''
+
+HEADER = ('Date,Description,Amount,Transaction number,???transfer.fromOwner???,'
+          '???transfer.toOwner???,Transaction type\r\n')
+
+# a few transactions a day, two of them in the same second
+HISTORY = [(datetime(2016, 1, 1, hour) + timedelta(days=day), 'T%02d%d' % (day, i))
+           for day in range(21) for i, hour in enumerate((17, 9, 9, 23))]
+
+
+class StubServer(BaseHTTPServer.HTTPServer):
+    """
+    The login, account history and export pages. The export of a period
+    also holds the last transactions of the day before it, as the real
+    server's can around midnight, and lists them newest first.
+    """
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.logins = 0
+        self.exports = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_port
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/do/login':
+            self.reply('login')
+        elif not self.logged_in():
+            self.redirect('/do/login')
+        else:
+            self.reply(HISTORY_FORM if self.path.startswith('/do/member/accountHistory') else 'home')
+
+    def do_POST(self):
+        query = urlparse.parse_qs(self.rfile.read(int(self.headers.get('content-length', 0))),
+                                  keep_blank_values=True)
+        if self.path == '/do/login':
+            with self.server.lock:
+                self.server.logins += 1
+                session = self.server.logins
+            self.send_response(302)
+            self.send_header('Set-Cookie', 'session=%d; Path=/' % session)
+            self.send_header('Location', self.server.url + '/do/member/home')
+            self.end_headers()
+        elif not self.logged_in():
+            self.redirect('/do/login')
+        else:
+            begin = datetime.strptime(query['query(period).begin'][0], '%d/%m/%Y')
+            end = datetime.strptime(query['query(period).end'][0], '%d/%m/%Y') + timedelta(days=1)
+            with self.server.lock:
+                self.server.exports.append((begin, end))
+            rows = [HEADER]
+            for when, reference in reversed(HISTORY):
+                if begin - timedelta(hours=3) <= when < end:
+                    rows.append('%s,Transfer,"1,000.00",%s,a,b,payment\r\n' % (
+                        when.strftime('%d/%m/%Y %H:%M:%S'), reference))
+            self.reply(''.join(rows), 'text/csv')
+
+    def logged_in(self):
+        return 'session' in Cookie.SimpleCookie(self.headers.get('Cookie', ''))
+
+    def redirect(self, path):
+        self.send_response(302)
+        self.send_header('Location', self.server.url + path)
+        self.end_headers()
+
+    def reply(self, body, content_type='text/html'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DateShardsTest(unittest.TestCase):
+
+    def test_weeks_of_dates(self):
+        self.assertEqual(date_shards(date(2016, 1, 1), date(2016, 1, 20)),
+                         [(date(2016, 1, 1), date(2016, 1, 7)),
+                          (date(2016, 1, 8), date(2016, 1, 14)),
+                          (date(2016, 1, 15), date(2016, 1, 20))])
+
+    def test_datetimes_start_at_midnight(self):
+        self.assertEqual(date_shards(datetime(2016, 1, 1, 9), datetime(2016, 1, 5, 10), 2),
+                         [(datetime(2016, 1, 1, 9), datetime(2016, 1, 2, 9)),
+                          (datetime(2016, 1, 3), datetime(2016, 1, 4)),
+                          (datetime(2016, 1, 5), datetime(2016, 1, 5, 10))])
+
+    def test_date_and_datetime(self):
+        self.assertEqual(date_shards(date(2016, 1, 1), datetime(2016, 1, 2, 10), 'day'),
+                         [(datetime(2016, 1, 1), datetime(2016, 1, 1)),
+                          (datetime(2016, 1, 2), datetime(2016, 1, 2))])
+
+    def test_empty_and_invalid(self):
+        self.assertEqual(date_shards(date(2016, 1, 2), date(2016, 1, 1)), [])
+        self.assertRaises(ValueError, date_shards, date(2016, 1, 1), date(2016, 1, 2),
+                          timedelta(hours=12))
+
+
+@unittest.skipIf(pesaplyMM is None, 'pesaplyMM needs Python 2 and mechanize')
+class ShardedTransactionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = self.server.url
+
+        class StubMM(pesaplyMM):
+            AUTH_URL = url + '/do/login'
+            TRANSACTIONS_EXPORT_URL = url + '/do/exportAccountHistoryToCsv'
+            TRANSACTIONS_URL = url + '/do/member/accountHistory?advanced=true'
+            ERROR_URL = url + '/do/error'
+
+        self.mm = StubMM('2550000000', '0000')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_ordered_and_deduplicated(self):
+        txns = self.mm.get_transactions_sharded(date(2016, 1, 1), date(2016, 1, 21),
+                                                shard=3, workers=4)
+        self.assertEqual(sorted(self.server.exports),
+                         [(datetime(2016, 1, day), datetime(2016, 1, day + 3))
+                          for day in range(1, 22, 3)])
+        # by date, then in the order of the export
+        expected = sorted(reversed(HISTORY), key=lambda txn: txn[0])
+        self.assertEqual([(txn.date, txn.reference) for txn in txns], expected)
+        # no more than one login per worker
+        self.assertTrue(1 <= self.server.logins <= 4, self.server.logins)
+
+    def test_same_as_one_export(self):
+        whole = self.mm.get_transactions(from_date=date(2016, 1, 4), to_date=date(2016, 1, 10))
+        sharded = self.mm.get_transactions_sharded(date(2016, 1, 4), date(2016, 1, 10), shard='day')
+        self.assertEqual([txn.as_dict() for txn in sharded],
+                         sorted(whole, key=lambda txn: txn['date']))
+
+if __name__ == '__main__':
+    unittest.main()
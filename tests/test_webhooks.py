@@ -0,0 +1,59 @@
+"""
+Tests of `webhooks.WebhookQueue` and `webhooks.ConsumerPool`.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..webhooks import ConsumerPool, WebhookQueue
+
+
+class ConsumerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue = WebhookQueue(os.path.join(self.dir, 'webhook.db'))
+        for i in range(5):
+            self.queue.put({'id': i})
+        self.handled = []
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.dir)
+
+    def handler(self, events):
+        """Handles the events but the one with id 2"""
+        failed = []
+        for i, event in enumerate(events):
+            if event['id'] == 2:
+                failed.append((i, ValueError('bad event')))
+            else:
+                self.handled.append(event['id'])
+        return failed
+
+    def test_handled_events_are_acknowledged(self):
+        pool = ConsumerPool(self.queue, lambda events: self.handled.extend(events))
+        self.assertEqual(pool.run_once(), 5)
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(pool.run_once(), 0)
+
+    def test_failed_event_is_retried_alone(self):
+        pool = ConsumerPool(self.queue, self.handler, max_attempts=2)
+        self.assertEqual(pool.run_once(), 5)
+        self.assertEqual(self.queue.depth(), 1)
+        self.assertEqual(pool.run_once(), 1)
+        self.assertEqual(sorted(self.handled), [0, 1, 3, 4])
+        # failed twice, so it is kept aside
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(pool.run_once(), 0)
+
+    def test_failed_batch_is_retried(self):
+        def handler(events):
+            raise IOError('sender down')
+        pool = ConsumerPool(self.queue, handler)
+        self.assertEqual(pool.run_once(), 5)
+        self.assertEqual(self.queue.depth(), 5)
+        pool.handler = self.handler
+        self.assertEqual(pool.run_once(), 5)
+        self.assertEqual(sorted(self.handled), [0, 1, 3, 4])
@@ -0,0 +1,216 @@
+"""
+transactions
+~~~~~~~~~~~~~~~~~~~~
+Parsing of the account history CSV export of the pesaply Mobile Money
+web application.
+"""
+import csv
+from datetime import datetime, timedelta
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+# transaction attribute -> column in the CSV export
+COLUMNS = (
+    ('date', 'Date'),
+    ('description', 'Description'),
+    ('amount', 'Amount'),
+    ('reference', 'Transaction number'),
+    ('sender', '???transfer.fromOwner???'),
+    ('recipient', '???transfer.toOwner???'),
+    ('comment', 'Transaction type'),
+)
+
+
+class Transaction(object):
+    """
+    A single row of the account history.
+    Attributes are the same as the keys of the dicts returned by
+    `pesaplyMM.get_transactions` and can be read either way:
+    > txn.amount == txn['amount']
+    """
+    __slots__ = ('date', 'description', 'amount', 'reference',
+                 'sender', 'recipient', 'currency', 'comment')
+
+    def __init__(self, date, description, amount, reference, sender,
+                 recipient, comment, currency='TSH'):
+        self.date = date
+        self.description = description
+        self.amount = amount
+        self.reference = reference
+        self.sender = sender
+        self.recipient = recipient
+        self.comment = comment
+        self.currency = currency
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return '<Transaction %s %s %s>' % (self.reference, self.date, self.amount)
+
+
+def parse_date(value):
+    """
+    Parses a date in the fixed DATE_FORMAT used by the export without going
+    through `datetime.strptime`, falling back to it for anything unexpected.
+    """
+    if len(value) == 19 and value[2] == '/' and value[5] == '/':
+        try:
+            return datetime(int(value[6:10]), int(value[3:5]), int(value[0:2]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19]))
+        except ValueError:
+            pass
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+def iter_lines(response, chunk_size=64 * 1024):
+    """
+    Yields the lines of a file-like ``response`` while reading it
+    ``chunk_size`` bytes at a time, so the whole body is never held in memory.
+    """
+    pending = ''
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        data = pending + chunk
+        end = data.rfind('\n')
+        if end < 0:
+            pending = data
+            continue
+        for line in data[:end].split('\n'):
+            yield line + '\n'
+        pending = data[end + 1:]
+    if pending:
+        yield pending
+
+
+def parse_transactions(lines):
+    """
+    Generates `Transaction` records from the lines of a CSV export.
+    Column positions are looked up once from the header row.
+    """
+    reader = csv.reader(lines)
+    try:
+        header = next(reader)
+    except StopIteration:
+        return
+
+    index = dict((name, i) for i, name in enumerate(header))
+    date, description, amount, reference, sender, recipient, comment = \
+        [index[column] for _, column in COLUMNS]
+
+    for row in reader:
+        if not row:
+            continue
+        yield Transaction(parse_date(row[date]),
+                          row[description],
+                          float(row[amount].replace(',', '')),
+                          row[reference],
+                          row[sender],
+                          row[recipient],
+                          row[comment])
+
+
+def date_shards(from_date, to_date, shard='week'):
+    """
+    Splits the inclusive ``from_date``..``to_date`` window into consecutive,
+    non-overlapping (from_date, to_date) windows.
+    ``shard`` is 'day', 'week', a number of days or a timedelta. The export
+    filters by whole days, so every window but the first starts at midnight.
+    The bounds may be dates or datetimes; windows of two dates are dates.
+    """
+    if shard == 'day':
+        step = timedelta(days=1)
+    elif shard == 'week':
+        step = timedelta(weeks=1)
+    elif isinstance(shard, timedelta):
+        step = shard
+    else:
+        step = timedelta(days=shard)
+    if step.days < 1:
+        raise ValueError('shards must span at least one day')
+
+    if isinstance(from_date, datetime) or isinstance(to_date, datetime):
+        from_date, to_date = _as_datetime(from_date), _as_datetime(to_date)
+        start_of = _as_datetime
+    else:
+        step = timedelta(days=step.days)
+        start_of = lambda day: day
+
+    shards = []
+    start = from_date
+    while _as_date(start) <= _as_date(to_date):
+        end = min(start + step - timedelta(days=1), to_date)
+        shards.append((start, end))
+        start = start_of(_as_date(end) + timedelta(days=1))
+    return shards
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _as_datetime(value):
+    """``value``, or midnight of it if it is a date"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value, datetime.min.time())
+
+
+def merge_transactions(batches):
+    """
+    Merges batches of transactions into a single list ordered by date,
+    keeping only the first transaction seen for each reference.
+    Transactions with the same date keep their batch order.
+    """
+    seen = set()
+    merged = []
+    for batch in batches:
+        for txn in batch:
+            if txn['reference'] not in seen:
+                seen.add(txn['reference'])
+                merged.append(txn)
+    merged.sort(key=lambda txn: txn['date'])
+    return merged
+
+
+def transactions_frame(response):
+    """
+    Parses a CSV export from the file-like ``response`` straight into a
+    pandas DataFrame with one typed column per `Transaction` attribute:
+    datetime64 dates, float64 amounts and categorical sender, recipient,
+    comment and currency columns.
+    """
+    if pd is None:
+        raise ImportError('pandas is required to build a transactions frame')
+
+    names = dict((column, name) for name, column in COLUMNS)
+    try:
+        frame = pd.read_csv(response, usecols=list(names), thousands=',',
+                            dtype=dict((column, object) for column in names if column != 'Amount'))
+    except ValueError as e:
+        # an empty export raises EmptyDataError (a ValueError subclass on
+        # newer pandas, a plain ValueError on older ones)
+        if not str(e).startswith('No columns to parse'):
+            raise
+        frame = pd.DataFrame(columns=list(names))
+
+    frame = frame.rename(columns=names)
+    frame['date'] = pd.to_datetime(frame['date'], format=DATE_FORMAT)
+    frame['amount'] = frame['amount'].astype('float64')
+    for name in ('sender', 'recipient', 'comment'):
+        frame[name] = frame[name].astype('category')
+    frame['currency'] = pd.Series('TSH', index=frame.index).astype('category')
+
+    return frame[list(Transaction.__slots__)]
@@ -0,0 +1,181 @@
+"""
+webhooks
+~~~~~~~~~~~~~~~~~~~~
+Ingestion of SMS provider webhook events through a local queue, so that
+the view only has to validate and append an event, while a pool of
+consumers (in another process) handles them in batches:
+ > queue = WebhookQueue('pesaply_webhook.db')
+ > queue.put({'event': 'incoming_message', 'content': 'Hi', ...})  # in the view
+ > pool = ConsumerPool(queue, handle_events, workers=4)            # elsewhere
+ > pool.start()
+The queue is a SQLite database in WAL mode, which lets the web workers
+append while the consumers read. An appended event survives the process
+crashing; with the default synchronous=NORMAL the last events can be lost
+if the machine loses power.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS pesaply_webhook_queue ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+    'event TEXT NOT NULL, '
+    'attempts INTEGER NOT NULL DEFAULT 0, '
+    'claimed_until REAL NOT NULL DEFAULT 0, '
+    'dead INTEGER NOT NULL DEFAULT 0, '
+    'error TEXT)',
+    'CREATE INDEX IF NOT EXISTS pesaply_webhook_queue_ready '
+    'ON pesaply_webhook_queue (dead, claimed_until)',
+)
+
+
+class WebhookQueue(object):
+    """
+    Durable FIFO of webhook events (dicts) in a local SQLite database,
+    shared by any number of processes.
+    """
+
+    def __init__(self, path='pesaply_webhook.db', synchronous='NORMAL', timeout=30):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=%s' % synchronous)
+        for sql in SCHEMA:
+            self._conn.execute(sql)
+
+    def put(self, event):
+        """Appends `event` and returns its id"""
+        data = json.dumps(event)
+        with self._lock:
+            return self._conn.execute('INSERT INTO pesaply_webhook_queue (event) VALUES (?)',
+                                      (data,)).lastrowid
+
+    def claim(self, limit=100, lease=60):
+        """
+        Returns up to `limit` (id, event) pairs, oldest first, which no
+        other consumer gets for `lease` seconds unless they are released
+        """
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock now, so two consumers cannot
+            # select the same events
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._conn.execute(
+                    'SELECT id, event FROM pesaply_webhook_queue '
+                    'WHERE dead = 0 AND claimed_until < ? ORDER BY id LIMIT ?',
+                    (now, limit)).fetchall()
+                if rows:
+                    self._conn.execute(
+                        'UPDATE pesaply_webhook_queue SET claimed_until = ? '
+                        'WHERE id IN (%s)' % ','.join('?' * len(rows)),
+                        [now + lease] + [row[0] for row in rows])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return [(id, json.loads(event)) for id, event in rows]
+
+    def ack(self, ids):
+        """Removes the events `ids`, which have been handled"""
+        self._update('DELETE FROM pesaply_webhook_queue WHERE id IN (%s)', ids)
+
+    def release(self, ids, error=None, max_attempts=5):
+        """
+        Makes the events `ids` available again after a failure, unless
+        they have failed `max_attempts` times, when they are kept aside
+        as dead for inspection
+        """
+        self._update('UPDATE pesaply_webhook_queue SET claimed_until = 0, '
+                     'attempts = attempts + 1, error = ?, dead = attempts + 1 >= ? '
+                     'WHERE id IN (%s)', ids, [error, max_attempts])
+
+    def depth(self):
+        """Returns the number of events waiting or being handled"""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM pesaply_webhook_queue '
+                                      'WHERE dead = 0').fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def _update(self, sql, ids, params=()):
+        ids = list(ids)
+        if ids:
+            with self._lock:
+                self._conn.execute(sql % ','.join('?' * len(ids)), list(params) + ids)
+
+
+class ConsumerPool(object):
+    """
+    Threads that claim batches of up to `batch_size` events from `queue`
+    and pass the list of events to `handler`, which returns the events it
+    failed to handle as (index in the list, exception) pairs. Those are
+    released to be retried and the others acknowledged, so an event that
+    was handled is not handled again because another one failed. If
+    `handler` raises, no event of the batch counts as handled and they
+    are all released.
+    """
+
+    def __init__(self, queue, handler, workers=4, batch_size=100, interval=0.5,
+                 lease=60, max_attempts=5):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def run_once(self):
+        """Handles one batch; returns the number of events in it"""
+        batch = self.queue.claim(self.batch_size, self.lease)
+        if not batch:
+            return 0
+        ids = [id for id, event in batch]
+        try:
+            failed = self.handler([event for id, event in batch]) or []
+        except Exception as e:
+            log.exception('webhook batch of %d events failed', len(batch))
+            self.queue.release(ids, repr(e), self.max_attempts)
+            return len(batch)
+        for i, error in failed:
+            log.warning('webhook event %d failed: %r', ids[i], error)
+            self.queue.release([ids[i]], repr(error), self.max_attempts)
+        failed_ids = set(ids[i] for i, error in failed)
+        self.queue.ack(id for id in ids if id not in failed_ids)
+        return len(batch)
+
+    def start(self):
+        self._stopping.clear()
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stops the workers once they have finished their current batch"""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                handled = self.run_once()
+            except Exception:
+                log.exception('webhook consumer error')
+                handled = 0
+            if not handled:
+                self._stopping.wait(self.interval)